@@ -0,0 +1,608 @@
+"""Bulk summarisation of archived documents through batch request files.
+
+Chunk prompts of many documents are written to JSONL request files and submitted to a
+batch service, which completes them within hours at a fraction of the interactive cost
+and without occupying the celery workers. Once the batches are completed, their
+results are ingested back into the user tasks of the documents.
+
+Run from the backend folder with ``python -m batch submit --email <email> <paths>``,
+then ``python -m batch ingest`` until all the jobs are completed.
+"""
+
+from abc import ABC, abstractmethod
+from backend.blob_store import blob_store
+from backend.boilerplate import build_boilerplate_filter
+from backend.checkpoints import TaskCheckpoint
+from backend.chunker import TokenChunker, get_tokenizer
+from backend.configuration import global_config
+from backend.db import connect_to_db
+from backend.llm_backends import LocalBackend
+from backend.models import BatchJob, User, UserTasks
+from backend.openai_pool import build_openai_client
+from backend.output_budget import OutputBudget
+from backend.parser import ParserFactory
+from backend.summarise_gpt import GPTSummarisation
+from backend.utils import get_file_extension
+from datetime import datetime
+import argparse
+import json
+import os
+import shutil
+import time
+import uuid
+
+# statuses of the batches the batch service is done with, completed or not
+FINISHED_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchService(ABC):
+    """
+    Abstract base class of the services completing batches of chat completion requests.
+
+    Request files hold one request per line, in the format of the OpenAI batch API,
+    and results follow the format of its output files.
+    """
+
+    @abstractmethod
+    def submit(self, requests_path: str) -> str:
+        """
+        Submit a request file.
+
+        Args:
+            requests_path (str): Path of the JSONL request file.
+
+        Returns:
+            str: The ID of the batch.
+        """
+        pass
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        """
+        Get the status of a batch.
+
+        Args:
+            batch_id (str): The ID of the batch.
+
+        Returns:
+            str: The status of the batch, as named by the OpenAI batch API.
+        """
+        pass
+
+    @abstractmethod
+    def results(self, batch_id: str):
+        """
+        Get the results of a finished batch.
+
+        Args:
+            batch_id (str): The ID of the batch.
+
+        Yields:
+            dict: The result of each request of the batch that has one.
+        """
+        pass
+
+
+class OpenAIBatchService(BatchService):
+    """
+    Batch service backed by the OpenAI batch API.
+
+    Attributes:
+        client: The OpenAI client.
+        completion_window (str): Time frame within which batches are completed.
+    """
+
+    def __init__(
+        self,
+        api_key: str = global_config["OpenAI"]["API_KEY"],
+        completion_window: str = "24h",
+    ):
+        """
+        Initialize the OpenAIBatchService.
+
+        Args:
+            api_key (str): The API key for accessing OpenAI services.
+            completion_window (str): Time frame within which batches are completed.
+        """
+        self.client = build_openai_client(api_key)
+        self.completion_window = completion_window
+
+    def submit(self, requests_path: str) -> str:
+        with open(requests_path, "rb") as requests_file:
+            input_file = self.client.files.create(file=requests_file, purpose="batch")
+        # the batches endpoints are more recent than the pinned openai package
+        batch = self.client.post(
+            "/batches",
+            body={
+                "input_file_id": input_file.id,
+                "endpoint": "/v1/chat/completions",
+                "completion_window": self.completion_window,
+            },
+            cast_to=object,
+        )
+        return batch["id"]
+
+    def status(self, batch_id: str) -> str:
+        return self.client.get(f"/batches/{batch_id}", cast_to=object)["status"]
+
+    def results(self, batch_id: str):
+        batch = self.client.get(f"/batches/{batch_id}", cast_to=object)
+        for file_id in [batch.get("output_file_id"), batch.get("error_file_id")]:
+            if file_id is None:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line:
+                    yield json.loads(line)
+
+
+class LocalBatchService(BatchService):
+    """
+    File based stand-in for the OpenAI batch API.
+
+    Batches are directories holding their request file. A batch is completed by the
+    language model backend on the first status check made completion_delay seconds
+    after its submission, and its results are written next to the requests.
+
+    Attributes:
+        directory (str): Directory holding the batches.
+        backend (LLMBackend): Backend completing the requests.
+        completion_delay (float): Seconds after which submitted batches are completed.
+    """
+
+    def __init__(
+        self,
+        directory: str = global_config.get(
+            "Batch", "LOCAL_DIRECTORY", fallback="batch_service"
+        ),
+        backend=None,
+        completion_delay: float = global_config.getfloat(
+            "Batch", "LOCAL_COMPLETION_DELAY", fallback=0.0
+        ),
+    ):
+        """
+        Initialize the LocalBatchService.
+
+        Args:
+            directory (str): Directory holding the batches.
+            backend (LLMBackend, optional): Backend completing the requests, defaults
+                to the deterministic local backend.
+            completion_delay (float): Seconds after which submitted batches are
+                completed.
+        """
+        self.directory = directory
+        self.backend = backend or LocalBackend()
+        self.completion_delay = completion_delay
+
+    def _path(self, batch_id: str, filename: str) -> str:
+        return os.path.join(self.directory, batch_id, filename)
+
+    def submit(self, requests_path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        os.makedirs(os.path.join(self.directory, batch_id))
+        shutil.copyfile(requests_path, self._path(batch_id, "requests.jsonl"))
+        return batch_id
+
+    def _complete(self, batch_id: str):
+        """
+        Complete the requests of a batch, recording failures in their results.
+        """
+        with open(self._path(batch_id, "requests.jsonl")) as requests_file, open(
+            self._path(batch_id, "results.jsonl.tmp"), "w"
+        ) as results_file:
+            for line in requests_file:
+                request = json.loads(line)
+                result = {"custom_id": request["custom_id"], "error": None}
+                try:
+                    content = self.backend.complete(
+                        request["body"]["messages"][-1]["content"],
+                        max_tokens=request["body"]["max_tokens"],
+                    ).text
+                    body = {"choices": [{"message": {"content": content}}]}
+                    result["response"] = {"status_code": 200, "body": body}
+                except Exception as error:
+                    result["response"] = None
+                    result["error"] = {"code": "server_error", "message": str(error)}
+                results_file.write(json.dumps(result) + "\n")
+        os.replace(
+            self._path(batch_id, "results.jsonl.tmp"),
+            self._path(batch_id, "results.jsonl"),
+        )
+
+    def status(self, batch_id: str) -> str:
+        if os.path.exists(self._path(batch_id, "results.jsonl")):
+            return "completed"
+        submitted_at = os.path.getmtime(self._path(batch_id, "requests.jsonl"))
+        if time.time() - submitted_at < self.completion_delay:
+            return "in_progress"
+        self._complete(batch_id)
+        return "completed"
+
+    def results(self, batch_id: str):
+        with open(self._path(batch_id, "results.jsonl")) as results_file:
+            for line in results_file:
+                yield json.loads(line)
+
+
+def build_batch_service(
+    service: str = global_config.get("Batch", "SERVICE", fallback="openai")
+) -> BatchService:
+    """
+    Build the batch service from the configuration.
+
+    Args:
+        service (str): "local" for the file based stand-in, "openai" otherwise.
+
+    Returns:
+        BatchService: The batch service.
+    """
+    if service == "local":
+        return LocalBatchService()
+    return OpenAIBatchService()
+
+
+def get_result_summary(result: dict):
+    """
+    Get the summary of a batch result.
+
+    Args:
+        result (dict): A line of the results of a batch.
+
+    Returns:
+        str | None: The summary, or None if the request failed.
+    """
+    response = result.get("response")
+    if result.get("error") or response is None or response["status_code"] != 200:
+        return None
+    return response["body"]["choices"][0]["message"]["content"].strip()
+
+
+class BulkSummarisation:
+    """
+    Summarises documents in bulk through a batch service.
+
+    Documents are chunked like interactive tasks, and the prompts of their chunks are
+    written to request files of at most max_requests requests and max_bytes bytes,
+    the limits of the batch API on its input files. Ingested chunk
+    summaries are saved as task checkpoints, so that documents some chunks of which
+    failed can be resumed interactively.
+
+    Attributes:
+        batch_service (BatchService): The service completing the batches.
+        directory (str): Directory the request files are written to.
+        max_requests (int): Maximum number of requests of a request file.
+        max_bytes (int): Maximum size of a request file in bytes.
+        model (str): The GPT model summarising the documents.
+        chunk_tokens (int): The token budget of each chunk.
+        min_chunk_tokens (int): The minimum number of tokens of the last chunk.
+        checkpoint_class: Builds the checkpoint of a task.
+        output_budget (OutputBudget): Output token budgets of the requests.
+        boilerplate_filter (BoilerplateFilter | None): Removes repeated boilerplate
+            from documents before they are chunked.
+        document_store (BlobStore): Holds the parsed texts of the documents.
+    """
+
+    def __init__(
+        self,
+        batch_service: BatchService,
+        directory: str = global_config.get(
+            "Batch", "REQUESTS_DIRECTORY", fallback="batch_requests"
+        ),
+        max_requests: int = global_config.getint(
+            "Batch", "MAX_REQUESTS", fallback=50000
+        ),
+        max_bytes: int = global_config.getint(
+            "Batch", "MAX_BYTES", fallback=100 * 1024 * 1024
+        ),
+        model: str = global_config["OpenAI"]["MODEL"],
+        chunk_tokens: int = global_config.getint(
+            "OpenAI", "CHUNK_TOKENS", fallback=2000
+        ),
+        min_chunk_tokens: int = global_config.getint(
+            "OpenAI", "MIN_CHUNK_TOKENS", fallback=200
+        ),
+        checkpoint_class=TaskCheckpoint,
+        output_budget=None,
+        boilerplate_filter=None,
+        document_store=blob_store,
+    ):
+        """
+        Initialize the BulkSummarisation.
+
+        Args:
+            batch_service (BatchService): The service completing the batches.
+            directory (str): Directory the request files are written to.
+            max_requests (int): Maximum number of requests of a request file.
+            max_bytes (int): Maximum size of a request file in bytes. A single
+                request larger than this is written to a file of its own.
+            model (str): The GPT model summarising the documents.
+            chunk_tokens (int): The token budget of each chunk.
+            min_chunk_tokens (int): The minimum number of tokens of the last chunk.
+            checkpoint_class: Builds the checkpoint of a task.
+            output_budget (OutputBudget, optional): Output token budgets of the
+                requests, defaults to the configured compression ratio.
+            boilerplate_filter (BoilerplateFilter, optional): Removes repeated
+                boilerplate from documents before they are chunked.
+            document_store (BlobStore): Holds the parsed texts of the documents.
+        """
+        self.batch_service = batch_service
+        self.directory = directory
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.model = model
+        self.chunk_tokens = chunk_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self.checkpoint_class = checkpoint_class
+        self.output_budget = output_budget or OutputBudget()
+        self.boilerplate_filter = boilerplate_filter
+        self.document_store = document_store
+        self.tokenizer = get_tokenizer(model)
+
+    def chunk_task(self, user_task) -> list:
+        """
+        Chunk the parsed text of a user task.
+
+        Args:
+            user_task (UserTasks): The user task.
+
+        Returns:
+            list: The chunks of the text.
+        """
+        if user_task.user_read_docs_ref is None:
+            # tasks parsed before the blob store keep their text inline
+            return self.chunk(user_task.user_read_docs)
+        return self.chunk(self.document_store.get(user_task.user_read_docs_ref))
+
+    def chunk(self, text: str) -> list:
+        if self.boilerplate_filter is not None:
+            text = self.boilerplate_filter.strip(text)
+        chunker = TokenChunker(
+            self.tokenizer.count, self.chunk_tokens, self.min_chunk_tokens
+        )
+        return chunker.chunk(text)
+
+    def build_request(self, task_id: str, chunk_index: int, chunk: str) -> dict:
+        """
+        Build the batch request summarising a chunk.
+
+        Args:
+            task_id (str): ID of the user task of the document.
+            chunk_index (int): Index of the chunk in the document.
+            chunk (str): The chunk.
+
+        Returns:
+            dict: The request, in the format of the OpenAI batch API.
+        """
+        return {
+            "custom_id": f"{task_id}:{chunk_index}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": GPTSummarisation.format_prompt(chunk),
+                    }
+                ],
+                "max_tokens": self.output_budget.budget(self.tokenizer.count(chunk)),
+            },
+        }
+
+    def write_request_files(self, job_id: str, user_tasks) -> list:
+        """
+        Write the chunk prompts of documents to request files.
+
+        Args:
+            job_id (str): ID of the bulk job.
+            user_tasks (list): The user tasks of the parsed documents.
+
+        Returns:
+            list: The paths of the request files.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        paths = []
+        requests_file = None
+        written = 0
+        written_bytes = 0
+        try:
+            for user_task in user_tasks:
+                chunks = self.chunk_task(user_task)
+                self.checkpoint_class(user_task.user_task_id).start(len(chunks))
+                for chunk_index, chunk in enumerate(chunks):
+                    request = self.build_request(
+                        user_task.user_task_id, chunk_index, chunk
+                    )
+                    line = (json.dumps(request) + "\n").encode("utf-8")
+                    if (
+                        requests_file is None
+                        or written == self.max_requests
+                        or (written and written_bytes + len(line) > self.max_bytes)
+                    ):
+                        if requests_file is not None:
+                            requests_file.close()
+                        paths.append(
+                            os.path.join(self.directory, f"{job_id}_{len(paths)}.jsonl")
+                        )
+                        requests_file = open(paths[-1], "wb")
+                        written = 0
+                        written_bytes = 0
+                    requests_file.write(line)
+                    written += 1
+                    written_bytes += len(line)
+        finally:
+            if requests_file is not None:
+                requests_file.close()
+        return paths
+
+    def submit(self, user_tasks) -> BatchJob:
+        """
+        Submit the documents of user tasks for bulk summarisation.
+
+        Args:
+            user_tasks (list): The user tasks of the parsed documents.
+
+        Returns:
+            BatchJob: The saved bulk job.
+        """
+        job_id = str(uuid.uuid4())
+        paths = self.write_request_files(job_id, user_tasks)
+        job = BatchJob(
+            job_id=job_id,
+            batch_ids=[self.batch_service.submit(path) for path in paths],
+            task_ids=[user_task.user_task_id for user_task in user_tasks],
+            model=self.model,
+            chunk_tokens=self.chunk_tokens,
+            min_chunk_tokens=self.min_chunk_tokens,
+            strip_boilerplate=self.boilerplate_filter is not None,
+        )
+        job.save()
+        return job
+
+    def ingest_batch(self, batch_id: str):
+        """
+        Save the chunk summaries of a finished batch as task checkpoints.
+
+        Args:
+            batch_id (str): The ID of the batch.
+        """
+        summaries = {}
+        for result in self.batch_service.results(batch_id):
+            summary = get_result_summary(result)
+            if summary is not None:
+                task_id, chunk_index = result["custom_id"].rsplit(":", 1)
+                summaries.setdefault(task_id, {})[int(chunk_index)] = summary
+        for task_id, task_summaries in summaries.items():
+            user_task = UserTasks.objects(user_task_id=task_id).first()
+            chunks = self.chunk_task(user_task)
+            checkpoint = self.checkpoint_class(task_id)
+            for chunk_index, summary in task_summaries.items():
+                checkpoint.save(chunk_index, chunks[chunk_index], summary)
+
+    def complete_task(self, task_id: str):
+        """
+        Store the summary of a bulk task whose batches were all ingested, or record
+        the chunks that failed.
+
+        Args:
+            task_id (str): ID of the user task.
+        """
+        user_task = UserTasks.objects(user_task_id=task_id).first()
+        chunks = self.chunk_task(user_task)
+        checkpoint = self.checkpoint_class(task_id)
+        summaries = checkpoint.load(chunks)
+        if len(summaries) < len(chunks):
+            user_task.update(
+                set__user_task_status="FAILED",
+                set__user_task_error=f"{len(chunks) - len(summaries)} of {len(chunks)} chunks could not be summarised in bulk, kindly resume the task",
+                set__user_task_completed=datetime.now(),
+            )
+            return
+        user_task.update(
+            set__user_generated_summary="\n".join(
+                summaries[chunk_index] for chunk_index in range(len(chunks))
+            ),
+            set__user_task_status="SUCCESS",
+            set__user_task_completed=datetime.now(),
+        )
+        checkpoint.clear()
+        if user_task.user_read_docs_ref is not None:
+            # failed tasks keep their text to be resumed
+            self.document_store.release(user_task.user_read_docs_ref)
+
+    def ingest(self, job: BatchJob) -> bool:
+        """
+        Ingest the finished batches of a bulk job, and complete its tasks once all of
+        them are finished.
+
+        Args:
+            job (BatchJob): The bulk job.
+
+        Returns:
+            bool: Whether all the batches of the job are ingested.
+        """
+        for batch_id in job.batch_ids:
+            if batch_id in job.ingested_batch_ids:
+                continue
+            if self.batch_service.status(batch_id) not in FINISHED_STATUSES:
+                continue
+            self.ingest_batch(batch_id)
+            job.update(push__ingested_batch_ids=batch_id)
+            job.ingested_batch_ids.append(batch_id)
+        if len(job.ingested_batch_ids) < len(job.batch_ids):
+            return False
+        for task_id in job.task_ids:
+            self.complete_task(task_id)
+        job.update(set__job_status="SUCCESS")
+        return True
+
+
+def create_user_tasks(user_email: str, paths) -> list:
+    """
+    Parse documents into new user tasks.
+
+    Args:
+        user_email (str): Email of the user the documents belong to.
+        paths (list): Paths of the documents.
+
+    Returns:
+        list: The saved user tasks.
+    """
+    user_tasks = []
+    for path in paths:
+        file_extension = get_file_extension(path)
+        with open(path, "rb") as document:
+            read_docs = ParserFactory(document, file_extension).build().read()
+        user_task = UserTasks(
+            user_email=user_email,
+            user_task_id=str(uuid.uuid4()),
+            user_file_extension=file_extension,
+            user_read_docs_ref=blob_store.put(read_docs),
+        )
+        user_task.save()
+        user_tasks.append(user_task)
+    return user_tasks
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = argument_parser.add_subparsers(dest="command", required=True)
+    submit_parser = subparsers.add_parser("submit")
+    submit_parser.add_argument("--email", required=True)
+    submit_parser.add_argument("paths", nargs="+")
+    ingest_parser = subparsers.add_parser("ingest")
+    ingest_parser.add_argument("job_ids", nargs="*")
+    arguments = argument_parser.parse_args()
+
+    connect_to_db()
+    if arguments.command == "submit":
+        if User.objects(user_email=arguments.email).first() is None:
+            argument_parser.error(f"User {arguments.email} not found")
+        bulk_summarisation = BulkSummarisation(
+            build_batch_service(), boilerplate_filter=build_boilerplate_filter()
+        )
+        job = bulk_summarisation.submit(
+            create_user_tasks(arguments.email, arguments.paths)
+        )
+        print(f"Submitted job {job.job_id} of {len(job.batch_ids)} batches")
+        return
+    jobs = BatchJob.objects(job_status="PENDING")
+    if arguments.job_ids:
+        jobs = jobs.filter(job_id__in=arguments.job_ids)
+    for job in jobs:
+        bulk_summarisation = BulkSummarisation(
+            build_batch_service(),
+            model=job.model,
+            chunk_tokens=job.chunk_tokens,
+            min_chunk_tokens=job.min_chunk_tokens,
+            # documents are chunked again as they were when submitted
+            boilerplate_filter=build_boilerplate_filter(job.strip_boilerplate),
+        )
+        done = bulk_summarisation.ingest(job)
+        print(
+            f"Job {job.job_id}: {len(job.ingested_batch_ids)} of {len(job.batch_ids)} batches ingested"
+            + (", completed" if done else "")
+        )
+
+
+if __name__ == "__main__":
+    main()
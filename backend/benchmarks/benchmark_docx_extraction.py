@@ -0,0 +1,97 @@
+"""Benchmark of the streaming .docx extractor against python-docx.
+
+Run from the backend folder with ``python -m benchmarks.benchmark_docx_extraction``.
+"""
+
+import argparse
+import io
+import time
+import tracemalloc
+from docx import Document
+from backend.parser import DocxParser
+
+SENTENCE = "The parties agree to the terms and conditions set out below. "
+
+
+def build_docx(paragraph_count: int) -> bytes:
+    """
+    Build a synthetic .docx document with a table every hundred paragraphs.
+
+    Args:
+        paragraph_count (int): Number of paragraphs of the document.
+
+    Returns:
+        bytes: The content of the generated .docx document.
+    """
+    document = Document()
+    for paragraph_number in range(paragraph_count):
+        document.add_paragraph(f"{paragraph_number}. {SENTENCE * 4}")
+        if paragraph_number % 100 == 0:
+            table = document.add_table(rows=5, cols=3)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = SENTENCE
+    file_like_object = io.BytesIO()
+    document.save(file_like_object)
+    return file_like_object.getvalue()
+
+
+def python_docx_read(content: bytes) -> str:
+    """
+    Extract text the way DocxParser did before it streamed the document.
+    """
+    document = Document(io.BytesIO(content))
+    return "\n".join(paragraph.text for paragraph in document.paragraphs)
+
+
+def streaming_read(content: bytes) -> str:
+    """
+    Extract text with the streaming DocxParser.
+    """
+    return DocxParser(content).read()
+
+
+def measure(read, content: bytes):
+    """
+    Measure the wall time and peak traced memory of a text extraction.
+
+    Args:
+        read (callable): The extraction function.
+        content (bytes): The content of the .docx document.
+
+    Returns:
+        tuple: Wall time in seconds, peak memory in MB and extracted characters.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    text = read(content)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024, len(text)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument(
+        "--paragraphs", type=int, nargs="+", default=[1000, 10000, 50000]
+    )
+    arguments = argument_parser.parse_args()
+
+    print(
+        f"{'paragraphs':>10} {'parser':>12} {'seconds':>9} {'peak MB':>9} {'chars':>10}"
+    )
+    for paragraph_count in arguments.paragraphs:
+        content = build_docx(paragraph_count)
+        for name, read in [
+            ("python-docx", python_docx_read),
+            ("streaming", streaming_read),
+        ]:
+            elapsed, peak, characters = measure(read, content)
+            print(
+                f"{paragraph_count:>10} {name:>12} {elapsed:>9.3f} {peak:>9.1f} {characters:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Benchmark of the extractive stage on long synthetic documents.
+
+Reports the compression ratio and the time spent per MB of text. Run from the backend
+folder with ``python -m benchmarks.benchmark_extractive``.
+"""
+
+import argparse
+import random
+import time
+from backend.extractive import ExtractiveCompressor
+
+TOPICS = [
+    "revenue grew in the northern region thanks to new contracts",
+    "the board approved the acquisition of a logistics company",
+    "operating costs were reduced by consolidating warehouses",
+    "the legal team settled the dispute with a former supplier",
+    "customer satisfaction improved after the support reorganisation",
+]
+FILLER = "company quarter report market product team plan result year growth".split()
+
+
+def build_document(size_mb: float, seed: int = 0) -> str:
+    """
+    Build a synthetic document mixing recurring topics with filler sentences.
+
+    Args:
+        size_mb (float): Approximate size of the document in MB.
+        seed (int): Seed of the generator.
+
+    Returns:
+        str: The document.
+    """
+    generator = random.Random(seed)
+    paragraphs = []
+    size = 0
+    while size < size_mb * 1024 * 1024:
+        sentences = []
+        for _ in range(5):
+            words = generator.choices(FILLER, k=generator.randint(6, 20))
+            if generator.random() < 0.3:
+                words += generator.choice(TOPICS).split()
+            sentences.append(" ".join(words).capitalize() + ".")
+        paragraphs.append(" ".join(sentences))
+        size += len(paragraphs[-1]) + 2
+    return "\n\n".join(paragraphs)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument(
+        "--sizes", type=float, nargs="+", default=[1, 5, 10], help="sizes in MB"
+    )
+    argument_parser.add_argument("--ratio", type=float, default=0.2)
+    arguments = argument_parser.parse_args()
+
+    compressor = ExtractiveCompressor(min_tokens=0)
+    print(f"{'MB':>6} {'sentences':>10} {'kept':>7} {'seconds':>9} {'s / MB':>8}")
+    for size_mb in arguments.sizes:
+        document = build_document(size_mb)
+        start = time.perf_counter()
+        compressed = compressor.compress(document, arguments.ratio)
+        elapsed = time.perf_counter() - start
+        megabytes = len(document) / 1024 / 1024
+        sentences = len(compressor.split_sentences(document))
+        print(
+            f"{megabytes:>6.1f} {sentences:>10} {len(compressed) / len(document):>7.1%} "
+            f"{elapsed:>9.2f} {elapsed / megabytes:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark of serial against parallel PDF text extraction.
+
+Run from the backend folder with ``python -m benchmarks.benchmark_pdf_extraction``.
+"""
+
+import argparse
+import time
+import fitz
+from backend.parser import PDFParser
+
+LINE = "The quick brown fox jumps over the lazy dog, again and again. "
+
+
+def build_pdf(page_count: int, lines_per_page: int = 50) -> bytes:
+    """
+    Build a synthetic text-only PDF document.
+
+    Args:
+        page_count (int): Number of pages of the document.
+        lines_per_page (int): Number of lines of text on each page.
+
+    Returns:
+        bytes: The content of the generated PDF document.
+    """
+    doc = fitz.open()
+    for page_number in range(page_count):
+        page = doc.new_page()
+        text = "\n".join(
+            f"{page_number}.{line_number} {LINE}"
+            for line_number in range(lines_per_page)
+        )
+        page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=8)
+    content = doc.tobytes()
+    doc.close()
+    return content
+
+
+def time_extraction(content: bytes, workers: int, repeat: int) -> float:
+    """
+    Time the text extraction of a PDF document.
+
+    Args:
+        content (bytes): The content of the PDF document.
+        workers (int): Number of worker processes, 1 for serial extraction.
+        repeat (int): Number of runs, the best one is reported.
+
+    Returns:
+        float: The best wall time in seconds.
+    """
+    parser = PDFParser(content, parallel_page_threshold=1, parallel_workers=workers)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser.read()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("--pages", type=int, nargs="+", default=[50, 200, 800])
+    argument_parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    argument_parser.add_argument("--repeat", type=int, default=3)
+    arguments = argument_parser.parse_args()
+
+    print(f"{'pages':>6} {'workers':>8} {'seconds':>9} {'speedup':>8}")
+    for page_count in arguments.pages:
+        content = build_pdf(page_count)
+        serial = time_extraction(content, 1, arguments.repeat)
+        print(f"{page_count:>6} {1:>8} {serial:>9.3f} {1:>8.2f}")
+        for workers in arguments.workers:
+            parallel = time_extraction(content, workers, arguments.repeat)
+            print(
+                f"{page_count:>6} {workers:>8} {parallel:>9.3f} {serial / parallel:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Throughput benchmark of the whole API, celery and notification path.
+
+Uploads documents to a running API and polls their summaries until all tasks are
+completed. Run the API and the celery workers with BACKEND=local in the LLM section of
+config.ini to benchmark the pipeline without paying for OpenAI requests, then run
+``python -m benchmarks.benchmark_pipeline --email ... --password ...`` from the backend
+folder.
+"""
+
+import argparse
+import statistics
+import time
+import requests
+
+PARAGRAPH = "The parties agree to the terms and conditions set out below. " * 8
+
+
+def build_document(document_number: int, paragraph_count: int) -> bytes:
+    """
+    Build a synthetic text document, unique so that no cache serves it.
+
+    Args:
+        document_number (int): Number of the document, written into every paragraph.
+        paragraph_count (int): Number of paragraphs of the document.
+
+    Returns:
+        bytes: The content of the text document.
+    """
+    return "\n\n".join(
+        f"Document {document_number}, paragraph {paragraph_number}. {PARAGRAPH}"
+        for paragraph_number in range(paragraph_count)
+    ).encode("utf-8")
+
+
+def login(api_host: str, email: str, password: str) -> str:
+    """
+    Log in as the benchmark user.
+
+    Args:
+        api_host (str): URL of the API.
+        email (str): Email of the benchmark user.
+        password (str): Password of the benchmark user.
+
+    Returns:
+        str: The JWT token of the user.
+    """
+    response = requests.post(
+        api_host + "/user/login/password",
+        json={"user_email": email, "user_password": password},
+    )
+    response.raise_for_status()
+    return response.json()["jwt_token"]
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("--api-host", default="http://localhost:8000")
+    argument_parser.add_argument("--email", required=True)
+    argument_parser.add_argument("--password", required=True)
+    argument_parser.add_argument("--documents", type=int, default=100)
+    argument_parser.add_argument("--paragraphs", type=int, default=50)
+    argument_parser.add_argument("--poll-interval", type=float, default=0.5)
+    arguments = argument_parser.parse_args()
+
+    token = login(arguments.api_host, arguments.email, arguments.password)
+    submitted_at = {}
+    start = time.perf_counter()
+    for document_number in range(arguments.documents):
+        response = requests.post(
+            arguments.api_host + "/generate_summary",
+            params={"token": token},
+            files={
+                "file": (
+                    f"document_{document_number}.txt",
+                    build_document(document_number, arguments.paragraphs),
+                )
+            },
+        )
+        response.raise_for_status()
+        submitted_at[response.json()["task_id"]] = time.perf_counter()
+    submission_time = time.perf_counter() - start
+
+    latencies = []
+    failed = 0
+    pending = set(submitted_at)
+    while pending:
+        time.sleep(arguments.poll_interval)
+        for task_id in list(pending):
+            response = requests.get(
+                arguments.api_host + "/user/get_summary",
+                params={"token": token, "task_id": task_id},
+            )
+            response.raise_for_status()
+            if response.headers["content-type"].startswith("application/json"):
+                status = response.json()["status"]
+                if status == "PENDING":
+                    continue
+                failed += status == "FAILED"
+            latencies.append(time.perf_counter() - submitted_at[task_id])
+            pending.remove(task_id)
+    total_time = time.perf_counter() - start
+
+    print(f"documents:          {arguments.documents} ({failed} failed)")
+    print(f"submission seconds: {submission_time:.2f}")
+    print(f"total seconds:      {total_time:.2f}")
+    print(f"documents / second: {arguments.documents / total_time:.2f}")
+    print(f"median latency:     {statistics.median(latencies):.2f}")
+    if len(latencies) > 1:
+        print(f"p95 latency:        {statistics.quantiles(latencies, n=20)[-1]:.2f}")
+
+
+if __name__ == "__main__":
+    main()
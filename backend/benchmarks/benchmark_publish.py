@@ -0,0 +1,113 @@
+"""Publish throughput benchmark of task messages.
+
+Publishes the same task messages with a new broker connection for every message, as
+celery does with its broker pool disabled, then through the publisher pool, and
+reports the messages per second and the publish latency of both. Messages are
+published to a dedicated queue, deleted at the end, so no worker consumes them. Run
+``python -m benchmarks.benchmark_publish`` from the backend folder, with the broker
+configured in config.ini or given with --broker.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from celery import Celery
+from kombu import Queue
+from backend.configuration import global_config
+from backend.publisher_pool import PublisherPool
+
+QUEUE = "benchmark_publish"
+TASK_NAME = "benchmark_publish.noop"
+
+
+def publish_messages(send, messages: int, threads: int) -> list:
+    """
+    Publish messages from several threads.
+
+    Args:
+        send (callable): Publishes one message.
+        messages (int): Number of messages published by each thread.
+        threads (int): Number of publishing threads.
+
+    Returns:
+        list: The latency of every publish, in seconds.
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def publish():
+        thread_latencies = []
+        for _ in range(messages):
+            start = time.perf_counter()
+            send()
+            thread_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(thread_latencies)
+
+    workers = [threading.Thread(target=publish) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies
+
+
+def report(label: str, latencies: list, seconds: float):
+    print(
+        f"{label:<10} {len(latencies) / seconds:>10.1f} msg/s"
+        f"  median {statistics.median(latencies) * 1000:.2f} ms"
+        f"  p95 {statistics.quantiles(latencies, n=20)[-1] * 1000:.2f} ms"
+    )
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("--broker", default=global_config["Celery"]["BROKER"])
+    argument_parser.add_argument("--messages", type=int, default=500)
+    argument_parser.add_argument("--threads", type=int, default=4)
+    argument_parser.add_argument("--pool-size", type=int, default=4)
+    arguments = argument_parser.parse_args()
+
+    app = Celery(
+        "benchmark_publish",
+        broker=arguments.broker,
+        broker_pool_limit=0,
+        broker_transport_options={"confirm_publish": True},
+    )
+    # the same payload shape as a summarisation task passing its document by key
+    task_kwargs = {"user_openai_key": "sk-" + "x" * 48, "read_docs_ref": "0" * 64}
+
+    def send(producer=None):
+        # the pool retries on its own, as CeleryApplication.send_task does
+        app.send_task(
+            TASK_NAME,
+            kwargs=task_kwargs,
+            queue=QUEUE,
+            producer=producer,
+            retry=producer is None,
+        )
+
+    start = time.perf_counter()
+    latencies = publish_messages(send, arguments.messages, arguments.threads)
+    report("unpooled", latencies, time.perf_counter() - start)
+
+    publisher_pool = PublisherPool(
+        app.connection_for_write,
+        app.amqp.Producer,
+        max_connections=arguments.pool_size,
+    )
+    start = time.perf_counter()
+    latencies = publish_messages(
+        lambda: publisher_pool.publish(send), arguments.messages, arguments.threads
+    )
+    report("pooled", latencies, time.perf_counter() - start)
+    print(publisher_pool.stats())
+    publisher_pool.close()
+
+    with app.connection_for_write() as connection:
+        Queue(QUEUE).bind(connection.default_channel).delete()
+
+
+if __name__ == "__main__":
+    main()
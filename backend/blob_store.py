@@ -0,0 +1,372 @@
+from abc import ABC, abstractmethod
+from backend.configuration import global_config
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+import fcntl
+import gridfs
+import hashlib
+import mongoengine
+import os
+import tempfile
+import threading
+
+
+class BlobStore(ABC):
+    """
+    Content-addressed, reference counted store of the parsed texts of documents.
+
+    Texts are written once under the SHA-256 of their content, so that tasks only
+    carry the key of their text and identical documents share a single blob. Every
+    put takes a reference to the blob, which the task releases once it no longer
+    needs the text, and a blob is deleted with its last reference. Blobs whose
+    references are never released, e.g. of failed tasks that are never resumed,
+    expire ttl seconds after they were last put; expired blobs are removed every
+    expiry_interval puts of a process.
+
+    Attributes:
+        ttl (float): Seconds after their last put after which blobs expire.
+        expiry_interval (int): Number of puts of a process between removals of the
+            expired blobs.
+    """
+
+    def __init__(
+        self,
+        ttl: float = global_config.getfloat(
+            "BlobStore", "TTL", fallback=30 * 24 * 60 * 60
+        ),
+        expiry_interval: int = 100,
+    ):
+        """
+        Initialize the BlobStore.
+
+        Args:
+            ttl (float): Seconds after their last put after which blobs expire.
+            expiry_interval (int): Number of puts of a process between removals of
+                the expired blobs.
+        """
+        self.ttl = ttl
+        self.expiry_interval = expiry_interval
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_key(text: str) -> str:
+        """
+        Build the key of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            str: Hex SHA-256 digest of the UTF-8 encoded text.
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def put(self, text: str) -> str:
+        """
+        Store a text, unless a blob with the same content is already stored, and take
+        a reference to it. Expired blobs are removed every expiry_interval puts.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            str: The key of the text, to be released once the text is not needed.
+        """
+        key = self.build_key(text)
+        self.acquire(key, text.encode("utf-8"))
+        with self._lock:
+            self._puts += 1
+            expire = self._puts % self.expiry_interval == 0
+        if expire:
+            self.expire(datetime.utcnow() - timedelta(seconds=self.ttl))
+        return key
+
+    @abstractmethod
+    def acquire(self, key: str, content: bytes):
+        """
+        Take a reference to a blob, writing it if it is not stored.
+
+        Args:
+            key (str): The key of the blob.
+            content (bytes): The UTF-8 encoded text.
+        """
+
+    @abstractmethod
+    def release(self, key: str) -> bool:
+        """
+        Release a reference to a blob, deleting the blob with its last reference.
+
+        Args:
+            key (str): The key of the blob.
+
+        Returns:
+            bool: Whether the blob was deleted.
+        """
+
+    @abstractmethod
+    def delete(self, key: str):
+        """
+        Delete a blob, whatever its references.
+
+        Args:
+            key (str): The key of the blob.
+        """
+
+    @abstractmethod
+    def expire(self, before: datetime) -> int:
+        """
+        Delete the blobs last put before a time, whatever their references.
+
+        Args:
+            before (datetime): The time, in UTC.
+
+        Returns:
+            int: The number of blobs deleted.
+        """
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """
+        Check whether a blob is stored.
+
+        Args:
+            key (str): The key of the blob.
+
+        Returns:
+            bool: Whether the blob is stored.
+        """
+
+    @abstractmethod
+    def get(self, key: str) -> str:
+        """
+        Read a text.
+
+        Args:
+            key (str): The key of the text.
+
+        Returns:
+            str: The text.
+
+        Raises:
+            KeyError: If no blob is stored under the key.
+        """
+
+
+class GridFSBlobStore(BlobStore):
+    """
+    Blob store keeping texts in GridFS, in the database of the application.
+
+    A blob is a GridFS file named after its key, holding its reference count and
+    the time of its last put in its metadata. References are counted with atomic
+    updates of the file document, and a blob is only revived while it has
+    references left: a put racing with the release of the last reference writes a
+    new file instead, so that deleting the old file never deletes its content.
+
+    Attributes:
+        collection (str): Name of the GridFS bucket.
+    """
+
+    def __init__(self, collection: str = "blobs", **kwargs):
+        """
+        Initialize the GridFSBlobStore.
+
+        Args:
+            collection (str): Name of the GridFS bucket.
+            **kwargs: Arguments passed on to the BlobStore constructor.
+        """
+        super().__init__(**kwargs)
+        self.collection = collection
+
+    def _grid_fs(self) -> gridfs.GridFS:
+        # resolved on use, as celery workers only connect to the db after forking
+        return gridfs.GridFS(mongoengine.connection.get_db(), self.collection)
+
+    def _files(self):
+        return mongoengine.connection.get_db()[self.collection + ".files"]
+
+    def acquire(self, key: str, content: bytes):
+        now = datetime.utcnow()
+        if (
+            self._files()
+            .update_one(
+                {"filename": key, "metadata.refs": {"$gte": 1}},
+                {"$inc": {"metadata.refs": 1}, "$set": {"metadata.used_at": now}},
+            )
+            .matched_count
+        ):
+            return
+        self._grid_fs().put(content, filename=key, metadata={"refs": 1, "used_at": now})
+
+    def release(self, key: str) -> bool:
+        blob = self._files().find_one_and_update(
+            {"filename": key, "metadata.refs": {"$gte": 1}},
+            {"$inc": {"metadata.refs": -1}},
+            projection={"metadata.refs": True},
+            return_document=ReturnDocument.AFTER,
+        )
+        if blob is None or blob["metadata"]["refs"] > 0:
+            return False
+        self._grid_fs().delete(blob["_id"])
+        return True
+
+    def delete(self, key: str):
+        grid_fs = self._grid_fs()
+        for blob in self._files().find({"filename": key}, projection={"_id": True}):
+            grid_fs.delete(blob["_id"])
+
+    def expire(self, before: datetime) -> int:
+        grid_fs = self._grid_fs()
+        expired = list(
+            self._files().find(
+                {"metadata.used_at": {"$lt": before}}, projection={"_id": True}
+            )
+        )
+        for blob in expired:
+            grid_fs.delete(blob["_id"])
+        return len(expired)
+
+    def exists(self, key: str) -> bool:
+        return self._grid_fs().exists(filename=key)
+
+    def get(self, key: str) -> str:
+        try:
+            return self._grid_fs().get_last_version(key).read().decode("utf-8")
+        except gridfs.errors.NoFile:
+            raise KeyError(key)
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blob store keeping texts on the local filesystem, a stand-in for GridFS when the
+    API and the celery workers share a host or a network filesystem.
+
+    The reference count of a blob is kept in a file next to it, updated under a lock
+    on the directory shared by all processes.
+
+    Attributes:
+        directory (str): Directory holding the texts.
+    """
+
+    def __init__(self, directory: str, **kwargs):
+        """
+        Initialize the LocalBlobStore, creating its directory if needed.
+
+        Args:
+            directory (str): Directory holding the texts.
+            **kwargs: Arguments passed on to the BlobStore constructor.
+        """
+        super().__init__(**kwargs)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _blob_path(self, key: str) -> str:
+        # spread blobs over subdirectories to keep directories small
+        return os.path.join(self.directory, key[:2], key + ".txt")
+
+    def _refs_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".refs")
+
+    def _locked(self):
+        lock_file = open(os.path.join(self.directory, ".lock"), "a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # closing the file releases the lock
+        return lock_file
+
+    def _read_refs(self, key: str) -> int:
+        try:
+            with open(self._refs_path(key), "r") as refs:
+                return int(refs.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_refs(self, key: str, refs: int):
+        with open(self._refs_path(key), "w") as refs_file:
+            refs_file.write(str(refs))
+
+    def _remove(self, key: str):
+        for path in (self._blob_path(key), self._refs_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def acquire(self, key: str, content: bytes):
+        blob_path = self._blob_path(key)
+        with self._locked():
+            if os.path.exists(blob_path):
+                # the modification time is the time of the last put
+                os.utime(blob_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                # write to a temporary file first so readers never see partial blobs
+                file_descriptor, temp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(blob_path), suffix=".tmp"
+                )
+                with os.fdopen(file_descriptor, "wb") as blob:
+                    blob.write(content)
+                os.replace(temp_path, blob_path)
+            self._write_refs(key, self._read_refs(key) + 1)
+
+    def release(self, key: str) -> bool:
+        with self._locked():
+            refs = self._read_refs(key) - 1
+            if refs > 0:
+                self._write_refs(key, refs)
+                return False
+            if not os.path.exists(self._blob_path(key)):
+                return False
+            self._remove(key)
+            return True
+
+    def delete(self, key: str):
+        with self._locked():
+            self._remove(key)
+
+    def expire(self, before: datetime) -> int:
+        # modification times are POSIX timestamps, before is in UTC
+        deadline = (before - datetime(1970, 1, 1)).total_seconds()
+        expired = 0
+        with self._locked():
+            for subdirectory in os.scandir(self.directory):
+                if not subdirectory.is_dir():
+                    continue
+                for blob in os.scandir(subdirectory.path):
+                    if blob.name.endswith(".txt") and blob.stat().st_mtime < deadline:
+                        self._remove(blob.name[: -len(".txt")])
+                        expired += 1
+        return expired
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._blob_path(key))
+
+    def get(self, key: str) -> str:
+        try:
+            with open(self._blob_path(key), "r", encoding="utf-8") as blob:
+                return blob.read()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+
+def build_blob_store(
+    backend: str = global_config.get("BlobStore", "BACKEND", fallback="gridfs"),
+    directory: str = global_config.get(
+        "BlobStore", "DIRECTORY", fallback="/tmp/pdf_gpt_blobs"
+    ),
+) -> BlobStore:
+    """
+    Build the blob store from the configuration.
+
+    Args:
+        backend (str): "local" to keep texts on the filesystem, otherwise GridFS.
+        directory (str): Directory of the local blob store.
+
+    Returns:
+        BlobStore: The blob store.
+    """
+    if backend == "local":
+        return LocalBlobStore(directory)
+    return GridFSBlobStore()
+
+
+blob_store = build_blob_store()
@@ -0,0 +1,322 @@
+from backend.configuration import global_config
+from backend.parser import PAGE_BREAK
+from functools import lru_cache
+import hashlib
+import re
+import threading
+
+DIGITS = re.compile(r"\d+")
+WHITESPACE = re.compile(r"\s+")
+# 64 lanes of 16 bits, see spread_shingle_hash
+LANE_ONES = sum(1 << 16 * lane for lane in range(64))
+LANE_TOP_BITS = LANE_ONES << 15
+# top bytes of the lanes to binary digits
+TOP_BYTE_DIGITS = bytes.maketrans(b"\x00\x80", b"01")
+
+
+def normalise_line(line: str) -> str:
+    """
+    Normalise a header or footer line so that page numbers and dates do not hide its
+    repetitions.
+
+    Args:
+        line (str): The line.
+
+    Returns:
+        str: The lowercase line, with whitespace collapsed and numbers replaced by 0.
+    """
+    return DIGITS.sub("0", WHITESPACE.sub(" ", line.strip().lower()))
+
+
+@lru_cache(maxsize=1 << 16)
+def spread_shingle_hash(shingle: str) -> int:
+    """
+    Hash a shingle and spread the 64 bits of its hash into 16 bit lanes.
+
+    Adding spread hashes counts the set bits of every lane in a single big integer
+    addition, which is much faster than counting bits one at a time.
+
+    Args:
+        shingle (str): The shingle.
+
+    Returns:
+        int: The spread hash, bit i of the hash being bit 16 * i.
+    """
+    shingle_hash = int.from_bytes(
+        hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+    return sum(1 << 16 * bit for bit in range(64) if shingle_hash >> bit & 1)
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """
+    Compute the 64 bit SimHash of a text over its character shingles.
+
+    Near-duplicate texts have fingerprints differing in a few bits only.
+
+    Args:
+        text (str): The text, only its first 65535 shingles are used.
+        shingle_size (int): Number of characters of the shingles.
+
+    Returns:
+        int: The fingerprint of the text.
+    """
+    shingles = [
+        text[start : start + shingle_size]
+        for start in range(min(max(len(text) - shingle_size + 1, 1), 0xFFFF))
+    ]
+    counts = sum(map(spread_shingle_hash, shingles))
+    # a bit is set if it is set in the hashes of the majority of the shingles: adding
+    # 0x7FFF - half to every lane sets the top bit of the lanes counting more than half
+    majority = counts + (0x7FFF - len(shingles) // 2) * LANE_ONES & LANE_TOP_BITS
+    top_bytes = majority.to_bytes(128, "little")[1::2]
+    return int(top_bytes[::-1].translate(TOP_BYTE_DIGITS), 2)
+
+
+class BoilerplateFilter:
+    """
+    Removes the headers and footers repeated on the pages of a document before it is
+    summarised.
+
+    Running heads, footers, disclaimers and page numbers show up at the same place
+    on every page, possibly with a changing page number or date. Only the
+    edge_lines first and last non-blank lines of every page are candidates, and
+    only their numbers are normalised away, so that tables, data rows and headings
+    in the body of the pages are never touched. Candidates are fingerprinted with
+    SimHash and grouped per position on the page: a candidate joins the group of
+    the first candidate within max_distance bits at the same position. Every group
+    found on at least min_repeats pages is boilerplate, and only its first line is
+    kept. Fingerprints are split into max_distance + 1 bands, and only fingerprints
+    sharing a band are compared, as near-duplicates within max_distance bits share
+    at least one. Larger distances also group lines differing by a word or a typo,
+    but bands get narrower and more fingerprints are compared.
+
+    Attributes:
+        min_repeats (int): Minimum number of pages boilerplate lines are found on.
+        min_length (int): Minimum number of characters of boilerplate lines.
+        max_distance (int): Maximum number of differing fingerprint bits of
+            near-duplicate lines.
+        edge_lines (int): Number of lines at the top and at the bottom of every page
+            that may be boilerplate.
+        lines_removed (int): Number of lines removed so far.
+        tokens_saved (int): Number of tokens removed so far.
+    """
+
+    def __init__(
+        self,
+        min_repeats: int = global_config.getint(
+            "Boilerplate", "MIN_REPEATS", fallback=3
+        ),
+        min_length: int = global_config.getint("Boilerplate", "MIN_LENGTH", fallback=8),
+        max_distance: int = global_config.getint(
+            "Boilerplate", "MAX_DISTANCE", fallback=3
+        ),
+        edge_lines: int = global_config.getint("Boilerplate", "EDGE_LINES", fallback=2),
+    ):
+        """
+        Initialize the BoilerplateFilter.
+
+        Args:
+            min_repeats (int): Minimum number of pages boilerplate lines are found on.
+            min_length (int): Minimum number of characters of boilerplate lines.
+            max_distance (int): Maximum number of differing fingerprint bits of
+                near-duplicate lines.
+            edge_lines (int): Number of lines at the top and at the bottom of every
+                page that may be boilerplate.
+
+        Raises:
+            ValueError: If max_distance is not between 0 and 15.
+        """
+        if not 0 <= max_distance < 16:
+            raise ValueError("max_distance must be between 0 and 15")
+        self.min_repeats = min_repeats
+        self.min_length = min_length
+        self.max_distance = max_distance
+        self.edge_lines = edge_lines
+        self.lines_removed = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def group_fingerprints(self, fingerprints) -> dict:
+        """
+        Group near-duplicate fingerprints.
+
+        Groups do not chain: a fingerprint joins the group of the first fingerprint
+        within max_distance bits that started a group, so that distinct lines are
+        never grouped through a series of intermediate lines.
+
+        Args:
+            fingerprints (iterable): The distinct fingerprints, in order of
+                appearance.
+
+        Returns:
+            dict: Fingerprint -> representative fingerprint of its group.
+        """
+        bands = self.max_distance + 1
+        band_bits = 64 // bands
+        band_mask = (1 << band_bits) - 1
+        groups = {}
+        buckets = {}
+        for fingerprint in fingerprints:
+            keys = [
+                (band, fingerprint >> band * band_bits & band_mask)
+                for band in range(bands)
+            ]
+            groups[fingerprint] = next(
+                (
+                    representative
+                    for key in keys
+                    for representative in buckets.get(key, ())
+                    if bin(fingerprint ^ representative).count("1") <= self.max_distance
+                ),
+                fingerprint,
+            )
+            if groups[fingerprint] == fingerprint:
+                # only representatives are compared against
+                for key in keys:
+                    buckets.setdefault(key, []).append(fingerprint)
+        return groups
+
+    def edge_positions(self, lines: list) -> dict:
+        """
+        Get the lines of a page that may be boilerplate.
+
+        Args:
+            lines (list): The lines of the page.
+
+        Returns:
+            dict: Line index -> positions of the line, ("top", n) for the n-th
+                non-blank line from the top and ("bottom", n) from the bottom.
+        """
+        non_blank = [index for index, line in enumerate(lines) if line.strip()]
+        positions = {}
+        for rank, index in enumerate(non_blank[: self.edge_lines]):
+            positions.setdefault(index, []).append(("top", rank))
+        for rank, index in enumerate(
+            reversed(non_blank[max(len(non_blank) - self.edge_lines, 0) :])
+        ):
+            positions.setdefault(index, []).append(("bottom", rank))
+        return positions
+
+    def strip_pages(self, pages, token_counter=None) -> list:
+        """
+        Remove the repetitions of boilerplate lines from the pages of a document.
+
+        Args:
+            pages (iterable): The text of every page, e.g. from Parser.iter_pages.
+            token_counter (callable, optional): Counts the tokens of a text, to
+                record the tokens saved.
+
+        Returns:
+            list: The pages, with only the first line of each boilerplate group.
+        """
+        pages = [page.split("\n") for page in pages]
+        fingerprints = {}
+        # page -> line index -> (position, fingerprint) of the candidate lines
+        page_candidates = []
+        for lines in pages:
+            candidates = {}
+            for index, positions in self.edge_positions(lines).items():
+                normalised = normalise_line(lines[index])
+                if len(normalised) < self.min_length:
+                    continue
+                for position in positions:
+                    position_fingerprints = fingerprints.setdefault(position, {})
+                    if normalised not in position_fingerprints:
+                        position_fingerprints[normalised] = simhash(normalised)
+                    candidates.setdefault(index, []).append(
+                        (position, position_fingerprints[normalised])
+                    )
+            page_candidates.append(candidates)
+        groups = {
+            position: self.group_fingerprints(position_fingerprints.values())
+            for position, position_fingerprints in fingerprints.items()
+        }
+        group_pages = {}
+        for page_number, candidates in enumerate(page_candidates):
+            for position_candidates in candidates.values():
+                for position, fingerprint in position_candidates:
+                    group_pages.setdefault(
+                        (position, groups[position][fingerprint]), set()
+                    ).add(page_number)
+
+        stripped_pages = []
+        removed_lines = []
+        seen_groups = set()
+        for lines, candidates in zip(pages, page_candidates):
+            kept_lines = []
+            for index, line in enumerate(lines):
+                boilerplate_groups = [
+                    (position, groups[position][fingerprint])
+                    for position, fingerprint in candidates.get(index, ())
+                    if len(group_pages[position, groups[position][fingerprint]])
+                    >= self.min_repeats
+                ]
+                if boilerplate_groups:
+                    if seen_groups.issuperset(boilerplate_groups):
+                        removed_lines.append(line)
+                        continue
+                    seen_groups.update(boilerplate_groups)
+                kept_lines.append(line)
+            stripped_pages.append("\n".join(kept_lines))
+
+        tokens_saved = 0
+        if token_counter is not None:
+            # boilerplate lines are mostly identical, count each distinct line once
+            line_counts = {}
+            for line in removed_lines:
+                line_counts[line] = line_counts.get(line, 0) + 1
+            tokens_saved = sum(
+                token_counter(line) * count for line, count in line_counts.items()
+            )
+        with self._lock:
+            self.lines_removed += len(removed_lines)
+            self.tokens_saved += tokens_saved
+        return stripped_pages
+
+    def strip(self, text: str, token_counter=None) -> str:
+        """
+        Remove the repetitions of boilerplate lines from a parsed text.
+
+        Pages are told apart by PAGE_BREAK, texts without pages are left as they
+        are.
+
+        Args:
+            text (str): The text.
+            token_counter (callable, optional): Counts the tokens of a text, to
+                record the tokens saved.
+
+        Returns:
+            str: The text with only the first line of each boilerplate group.
+        """
+        return PAGE_BREAK.join(self.strip_pages(text.split(PAGE_BREAK), token_counter))
+
+    def stats(self) -> dict:
+        """
+        Get the boilerplate removed so far.
+
+        Returns:
+            dict: Lines removed and tokens saved.
+        """
+        with self._lock:
+            return {
+                "lines_removed": self.lines_removed,
+                "tokens_saved": self.tokens_saved,
+            }
+
+
+def build_boilerplate_filter(
+    enabled: bool = global_config.getboolean("Boilerplate", "ENABLED", fallback=False)
+):
+    """
+    Build the boilerplate filter from the configuration.
+
+    Args:
+        enabled (bool): Whether boilerplate is removed before summarisation.
+
+    Returns:
+        BoilerplateFilter | None: The boilerplate filter, None if disabled.
+    """
+    if enabled:
+        return BoilerplateFilter()
+    return None
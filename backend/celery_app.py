@@ -1,14 +1,28 @@
-from celery import Celery
+from celery import Celery, chord
+from celery.signals import worker_process_init, worker_process_shutdown
 from backend.summarise_gpt import GPTSummarisation
+from backend.blob_store import blob_store
+from backend.boilerplate import build_boilerplate_filter
+from backend.checkpoints import TaskCheckpoint
 from backend.configuration import global_config
-import requests
+from backend.db import connect_to_db
+from backend.models import User, UserTasks
+from backend.notification_channel import notification_channel
+from backend.logger import logger
+from backend.parse_cache import parse_cache
+from backend.publisher_pool import build_publisher_pool
+from backend.rate_limiter import get_rate_limiter
+from backend.scheduler import build_scheduler
+from backend.summary_cache import summary_cache
 
 # there is a memory leak in celery codebase
 # small thing but the reason broker pool is disabled
 # https://github.com/celery/celery/discussions/7028
+# task messages are published through the bounded PublisherPool instead
 celery_app = Celery(
     "celery_app",
-    backend="rpc://",
+    # chords need a result backend storing results, such as mongodb:// or redis://
+    backend=global_config.get("Celery", "RESULT_BACKEND", fallback="rpc://"),
     broker=global_config["Celery"]["BROKER"],
     broker_pool_limit=0,
     broker_transport_options={"confirm_publish": True},
@@ -16,75 +30,635 @@ celery_app = Celery(
 )
 
 
-def send_task_notification(
-    notification_body,
-    api_gateway=global_config["Application"]["API_GATEWAY"],
-):
-    requests.post(
-        api_gateway + "/notify/task",
-        json=notification_body,
-    )
+@worker_process_init.connect
+def connect_worker_to_db(**kwargs):
+    # the parsing stage reads uploads from and writes parsed texts to the db,
+    # connect after the fork as pymongo clients are not fork safe
+    connect_to_db()
+
+
+@worker_process_shutdown.connect
+def flush_worker_notifications(**kwargs):
+    # deliver the notifications still waiting for their batch before exiting
+    notification_channel.close()
 
 
 class CeleryApplication:
     def __init__(
         self,
         app=celery_app,
-        task_notifier=send_task_notification,
+        task_notifier=notification_channel.notify,
         notification_api_key=global_config["Notification"]["API_KEY"],
+        max_task_retries=global_config.getint("Celery", "MAX_RETRIES", fallback=3),
+        task_retry_delay=global_config.getint("Celery", "RETRY_DELAY", fallback=30),
+        checkpoint_class=TaskCheckpoint,
+        document_store=blob_store,
+        execution_mode=global_config.get("Celery", "EXECUTION_MODE", fallback="single"),
+        publisher_pool=None,
+        scheduler_factory=build_scheduler,
+        priority_queue=global_config.get("Scheduler", "PRIORITY_QUEUE", fallback=""),
     ):
+        if execution_mode == "chord" and str(app.conf.result_backend).startswith("rpc"):
+            raise ValueError(
+                "The chord execution mode needs a result backend storing results, such as mongodb or redis"
+            )
         self.task_notifier = task_notifier
         self.notification_api_key = notification_api_key
+        self.max_task_retries = max_task_retries
+        self.task_retry_delay = task_retry_delay
+        self.checkpoint_class = checkpoint_class
+        self.document_store = document_store
+        self.execution_mode = execution_mode
+        self.publisher_pool = publisher_pool
+        self.scheduler = scheduler_factory(self.dispatch_scheduled_task)
+        self.priority_queue = priority_queue
         self.app = app
 
     def enable_app(self):
-        @self.app.task(bind=True, track_started=True)
-        def generate_summary_celery_task(task_self, user_openai_key, read_docs):
+        @self.app.task(
+            bind=True,
+            track_started=True,
+            name="celery_app.parse_document_celery_task",
+        )
+        def parse_document_celery_task(
+            task_self,
+            user_task_id,
+            user_openai_key,
+            charge_free_tier,
+            use_summary_cache=True,
+        ):
+            """
+            Celery task parsing an uploaded document, the first stage of the summary pipeline.
+
+            Args:
+                self: Reference to the task instance.
+                user_task_id (str): ID of the user task the upload belongs to.
+                user_openai_key (str): OpenAI API key to summarise the document with.
+                charge_free_tier (bool): Whether the parsed length counts against the
+                    free summary generations of the user.
+                use_summary_cache (bool): Whether to use the shared chunk summary cache.
+
+            Returns:
+                None
+
+            Stores the parsed text in the blob store and its key in the user task, deletes the
+            raw upload from GridFS, then schedules the summary generation task with the key of
+            the text.
+
+            If the user has exhausted the free summary generations, or on failure, sends a
+            notification to the API gateway with the task_id and task_status as "FAILED".
+            """
+            try:
+                user_task = UserTasks.objects(user_task_id=user_task_id).first()
+                read_docs = parse_cache.get_or_parse(
+                    user_task.user_upload.get(),
+                    user_task.user_file_extension,
+                    user_task.user_upload_digest,
+                )
+                read_docs_ref = self.document_store.put(read_docs)
+                user_task.update(
+                    set__user_read_docs_ref=read_docs_ref, unset__user_upload=True
+                )
+                # the parsed text is all later stages and resumed tasks read
+                user_task.user_upload.delete()
+                if charge_free_tier:
+                    user = User.objects(user_email=user_task.user_email).modify(
+                        dec__user_docs_capacity=len(read_docs), new=True
+                    )
+                    if user.user_docs_capacity < 0:
+                        # no stage will read the text, nor release it
+                        self.document_store.release(read_docs_ref)
+                        self.task_notifier(
+                            {
+                                "notification_auth": self.notification_api_key,
+                                "task_id": user_task_id,
+                                "task_status": "FAILED",
+                                "task_error": "You have utilised all free summary generations",
+                            }
+                        )
+                        return
+                self.schedule_generate_task(
+                    user_task.user_email,
+                    user_openai_key,
+                    read_docs_ref,
+                    user_task_id,
+                    use_summary_cache,
+                    user_task.user_extractive_ratio,
+                    # users bringing their own key are not charged
+                    own_key=not charge_free_tier,
+                )
+            except Exception:
+                self.task_notifier(
+                    {
+                        "notification_auth": self.notification_api_key,
+                        "task_id": user_task_id,
+                        "task_status": "FAILED",
+                    }
+                )
+
+        @self.app.task(
+            bind=True,
+            track_started=True,
+            name="celery_app.generate_summary_celery_task",
+        )
+        def generate_summary_celery_task(
+            task_self,
+            user_openai_key,
+            read_docs_ref,
+            user_task_id=None,
+            use_summary_cache=True,
+            extractive_ratio=1.0,
+        ):
             """
             Celery task to generate a summary using GPT and send it to an API gateway.
 
             Args:
                 self: Reference to the task instance.
-                read_docs (str): Text content to be summarized.
+                read_docs_ref (str): Blob store key of the text content to be summarized.
+                user_task_id (str, optional): ID of the user task to report on, defaults
+                    to the ID of this task.
+                use_summary_cache (bool, optional): Whether to use the shared chunk summary
+                    cache, defaults to True.
+                extractive_ratio (float, optional): The fraction of long documents kept by
+                    the extractive stage, defaults to 1 to keep them whole.
 
             Returns:
                 None
 
             Sends a POST request to the configured API_GATEWAY endpoint with the generated summary.
 
+            Chunk summaries are checkpointed as they finish, so that retries only summarise the
+            chunks that are still missing. In the chord execution mode, the missing chunks are
+            instead summarised by chunk tasks spread across the workers, and a chord callback
+            assembles the summary once they are all finished.
+
             On success, sends a notification to the API gateway with the task_id, generated summary,
             and task_status as "SUCCESS".
 
-            On failure, sends a notification to the API gateway with the task_id and task_status as "FAILED".
+            On failure, the task is retried up to max_task_retries times, then sends a notification
+            to the API gateway with the task_id and task_status as "FAILED".
             """
-
+            task_id = user_task_id or task_self.request.id
+            checkpoint = self.checkpoint_class(task_id)
             try:
-                gpt_summariser = GPTSummarisation(user_openai_key)
-                summary = gpt_summariser.summarise_doc(read_docs)
+                read_docs = self.document_store.get(read_docs_ref)
+                gpt_summariser = self.build_summariser(
+                    user_openai_key, use_summary_cache, build_boilerplate_filter()
+                )
+                if self.execution_mode == "chord":
+                    self.fan_out_chunks(
+                        gpt_summariser,
+                        read_docs,
+                        read_docs_ref,
+                        task_id,
+                        user_openai_key,
+                        use_summary_cache,
+                        extractive_ratio,
+                    )
+                    return
+                summary = gpt_summariser.summarise_doc(
+                    read_docs,
+                    checkpoint=checkpoint,
+                    extractive_ratio=extractive_ratio,
+                )
+                self.notify_summary(
+                    task_id,
+                    summary,
+                    gpt_summariser.output_budget.stats(),
+                    (
+                        gpt_summariser.boilerplate_filter.tokens_saved
+                        if gpt_summariser.boilerplate_filter is not None
+                        else 0
+                    ),
+                )
+                checkpoint.clear()
+                # failed tasks keep their text to be resumed
+                self.document_store.release(read_docs_ref)
+            except Exception as error:
+                if task_self.request.retries < self.max_task_retries:
+                    raise task_self.retry(
+                        exc=error,
+                        countdown=self.task_retry_delay,
+                        max_retries=self.max_task_retries,
+                    )
                 self.task_notifier(
                     {
-                        "notification_auth": self.notification_api_key,
-                        "task_id": task_self.request.id,
-                        "generated_summary": summary,
-                        "task_status": "SUCCESS",
+                        "notification_auth": global_config["Notification"]["API_KEY"],
+                        "task_id": task_id,
+                        "task_status": "FAILED",
                     }
                 )
-            except:
+
+        @self.app.task(
+            bind=True,
+            track_started=True,
+            name="celery_app.summarise_chunk_celery_task",
+        )
+        def summarise_chunk_celery_task(
+            task_self,
+            user_openai_key,
+            user_task_id,
+            chunk_index,
+            chunk_ref,
+            use_summary_cache=True,
+        ):
+            """
+            Celery task summarising a single chunk of a document, in the chord execution mode.
+
+            Args:
+                self: Reference to the task instance.
+                user_openai_key (str): OpenAI API key to summarise the chunk with.
+                user_task_id (str): ID of the user task the chunk belongs to.
+                chunk_index (int): Index of the chunk in the document.
+                chunk_ref (str): Blob store key of the chunk.
+                use_summary_cache (bool, optional): Whether to use the shared chunk summary
+                    cache, defaults to True.
+
+            Returns:
+                dict | None: The output token usage of the chunk, None if it could not be
+                    summarised.
+
+            The summary is checkpointed for the chord callback to assemble. On failure, the
+            chunk alone is retried up to max_task_retries times, then given up on without
+            failing the chord, so that the callback can report the missing chunks.
+            """
+            try:
+                chunk = self.document_store.get(chunk_ref)
+                gpt_summariser = self.build_summariser(
+                    user_openai_key, use_summary_cache
+                )
+                summary = gpt_summariser.summarise_chunk(chunk)
+                self.checkpoint_class(user_task_id).save(chunk_index, chunk, summary)
+                return gpt_summariser.output_budget.stats()
+            except Exception as error:
+                if task_self.request.retries < self.max_task_retries:
+                    raise task_self.retry(
+                        exc=error,
+                        countdown=self.task_retry_delay,
+                        max_retries=self.max_task_retries,
+                    )
+                return None
+
+        @self.app.task(
+            bind=True,
+            track_started=True,
+            name="celery_app.assemble_summary_celery_task",
+        )
+        def assemble_summary_celery_task(
+            task_self,
+            chunk_usages,
+            user_openai_key,
+            user_task_id,
+            chunk_refs,
+            use_summary_cache=True,
+            boilerplate_tokens_saved=0,
+            read_docs_ref=None,
+            chunk_digests=(),
+        ):
+            """
+            Chord callback assembling the chunk summaries of a document into its summary.
+
+            Args:
+                self: Reference to the task instance.
+                chunk_usages (list): Results of the chunk tasks, in chunk order.
+                user_openai_key (str): OpenAI API key to reduce the summaries with.
+                user_task_id (str): ID of the user task to report on.
+                chunk_refs (list): Blob store keys of the chunks summarised by the chunk
+                    tasks, released once the chord is over.
+                use_summary_cache (bool, optional): Whether to use the shared chunk summary
+                    cache, defaults to True.
+                boilerplate_tokens_saved (int, optional): Tokens of boilerplate removed from
+                    the document before it was chunked.
+                read_docs_ref (str, optional): Blob store key of the text of the document,
+                    released once the summary is sent.
+                chunk_digests (list): Digests of all the chunks of the document, in order.
+
+            Returns:
+                None
+
+            Sends a notification to the API gateway with the summary and task_status as
+            "SUCCESS" once every chunk is summarised, otherwise with the number of missing
+            chunks and task_status as "FAILED", so that the task can be resumed.
+            """
+            checkpoint = self.checkpoint_class(user_task_id)
+            try:
+                summaries = checkpoint.load_digests(chunk_digests)
+                if len(summaries) < len(chunk_digests):
+                    self.release_chunks(chunk_refs)
+                    self.task_notifier(
+                        {
+                            "notification_auth": self.notification_api_key,
+                            "task_id": user_task_id,
+                            "task_status": "FAILED",
+                            "task_error": f"{len(chunk_digests) - len(summaries)} of {len(chunk_digests)} chunks could not be summarised, kindly resume the task",
+                        }
+                    )
+                    return
+                gpt_summariser = self.build_summariser(
+                    user_openai_key, use_summary_cache
+                )
+                summary = gpt_summariser.combine_summaries(
+                    [
+                        summaries[chunk_index]
+                        for chunk_index in range(len(chunk_digests))
+                    ]
+                )
+                usage = gpt_summariser.output_budget.stats()
+                for chunk_usage in chunk_usages:
+                    if chunk_usage is not None:
+                        for key in ("budgeted_tokens", "output_tokens", "truncated"):
+                            usage[key] += chunk_usage[key]
+                self.notify_summary(
+                    user_task_id, summary, usage, boilerplate_tokens_saved
+                )
+                checkpoint.clear()
+                self.release_chunks(chunk_refs)
+                if read_docs_ref is not None:
+                    self.document_store.release(read_docs_ref)
+            except Exception as error:
+                if task_self.request.retries < self.max_task_retries:
+                    raise task_self.retry(
+                        exc=error,
+                        countdown=self.task_retry_delay,
+                        max_retries=self.max_task_retries,
+                    )
+                self.release_chunks(chunk_refs)
                 self.task_notifier(
                     {
-                        "notification_auth": global_config["Notification"]["API_KEY"],
-                        "task_id": task_self.request.id,
+                        "notification_auth": self.notification_api_key,
+                        "task_id": user_task_id,
                         "task_status": "FAILED",
                     }
                 )
 
         return self
 
-    def run_generate_task(self, user_openai_key, read_docs):
-        return self.app.send_task(
+    def build_summariser(
+        self, user_openai_key, use_summary_cache=True, boilerplate_filter=None
+    ):
+        return GPTSummarisation(
+            user_openai_key,
+            summary_cache=summary_cache if use_summary_cache else None,
+            rate_limiter=get_rate_limiter(user_openai_key),
+            boilerplate_filter=boilerplate_filter,
+        )
+
+    def notify_summary(self, task_id, summary, usage, boilerplate_tokens_saved):
+        self.task_notifier(
+            {
+                "notification_auth": self.notification_api_key,
+                "task_id": task_id,
+                "generated_summary": summary,
+                "task_status": "SUCCESS",
+                "output_tokens_budgeted": usage["budgeted_tokens"],
+                "output_tokens_used": usage["output_tokens"],
+                "truncated_requests": usage["truncated"],
+                "boilerplate_tokens_saved": boilerplate_tokens_saved,
+            }
+        )
+
+    def fan_out_chunks(
+        self,
+        gpt_summariser,
+        read_docs,
+        read_docs_ref,
+        user_task_id,
+        user_openai_key,
+        use_summary_cache=True,
+        extractive_ratio=1.0,
+    ):
+        """
+        Summarise the chunks of a document missing from its checkpoint in chunk tasks,
+        with a chord callback assembling the summary once they are all finished.
+
+        Args:
+            gpt_summariser (GPTSummarisation): Splits the document into chunks.
+            read_docs (str): The text of the document.
+            read_docs_ref (str): Blob store key of the text of the document.
+            user_task_id (str): ID of the user task of the document.
+            user_openai_key (str): OpenAI API key to summarise the document with.
+            use_summary_cache (bool): Whether to use the shared chunk summary cache.
+            extractive_ratio (float): The fraction of long documents kept by the
+                extractive stage.
+
+        Returns:
+            str: The ID of the chord callback.
+        """
+        checkpoint = self.checkpoint_class(user_task_id)
+        chunks = gpt_summariser.split_doc(read_docs, extractive_ratio=extractive_ratio)
+        checkpoint.start(len(chunks))
+        summarised = checkpoint.load(chunks)
+        # chunks are passed by reference too, keeping the messages of the chunk tasks
+        # small, and only the chunks left to summarise are stored
+        chunk_refs = {
+            chunk_index: self.document_store.put(chunk)
+            for chunk_index, chunk in enumerate(chunks)
+            if chunk_index not in summarised
+        }
+        assemble_task = self.app.signature(
+            "celery_app.assemble_summary_celery_task",
+            kwargs={
+                "user_openai_key": user_openai_key,
+                "user_task_id": user_task_id,
+                "chunk_refs": list(chunk_refs.values()),
+                "chunk_digests": [checkpoint.chunk_digest(chunk) for chunk in chunks],
+                "use_summary_cache": use_summary_cache,
+                "boilerplate_tokens_saved": (
+                    gpt_summariser.boilerplate_filter.tokens_saved
+                    if gpt_summariser.boilerplate_filter is not None
+                    else 0
+                ),
+                "read_docs_ref": read_docs_ref,
+            },
+        )
+        chunk_tasks = [
+            self.app.signature(
+                "celery_app.summarise_chunk_celery_task",
+                kwargs={
+                    "user_openai_key": user_openai_key,
+                    "user_task_id": user_task_id,
+                    "chunk_index": chunk_index,
+                    "chunk_ref": chunk_ref,
+                    "use_summary_cache": use_summary_cache,
+                },
+            )
+            for chunk_index, chunk_ref in chunk_refs.items()
+        ]
+        if not chunk_tasks:
+            # every chunk was summarised by an earlier attempt
+            return assemble_task.apply_async(args=([],)).id
+        return chord(chunk_tasks)(assemble_task).id
+
+    def release_chunks(self, chunk_refs):
+        """
+        Release the chunks stored for the chunk tasks of a chord.
+
+        Args:
+            chunk_refs (list): Blob store keys of the chunks.
+        """
+        for chunk_ref in chunk_refs:
+            self.document_store.release(chunk_ref)
+
+    def send_task(self, name, **options):
+        if self.publisher_pool is None:
+            return self.app.send_task(name, **options)
+        # the pool retries on a new connection, celery retrying on the broken one as
+        # well would stack the delays and the duplicates of both
+        return self.publisher_pool.publish(
+            lambda producer: self.app.send_task(
+                name, producer=producer, retry=False, **options
+            )
+        )
+
+    def run_parse_task(
+        self, user_task_id, user_openai_key, charge_free_tier, use_summary_cache=True
+    ):
+        return self.send_task(
+            "celery_app.parse_document_celery_task",
+            kwargs={
+                "user_task_id": user_task_id,
+                "user_openai_key": user_openai_key,
+                "charge_free_tier": charge_free_tier,
+                "use_summary_cache": use_summary_cache,
+            },
+            task_id=user_task_id,
+        ).id
+
+    def run_generate_task(
+        self,
+        user_openai_key,
+        read_docs_ref,
+        user_task_id=None,
+        use_summary_cache=True,
+        extractive_ratio=1.0,
+        queue=None,
+    ):
+        # the default queue is used unless a queue is given
+        options = {"queue": queue} if queue else {}
+        return self.send_task(
             "celery_app.generate_summary_celery_task",
-            kwargs={"user_openai_key": user_openai_key, "read_docs": read_docs},
+            kwargs={
+                "user_openai_key": user_openai_key,
+                "read_docs_ref": read_docs_ref,
+                "user_task_id": user_task_id,
+                "use_summary_cache": use_summary_cache,
+                "extractive_ratio": extractive_ratio,
+            },
+            **options,
         ).id
 
+    def schedule_generate_task(
+        self,
+        user_email,
+        user_openai_key,
+        read_docs_ref,
+        user_task_id,
+        use_summary_cache=True,
+        extractive_ratio=1.0,
+        own_key=False,
+    ):
+        """
+        Queue a summary generation task with the fair scheduler, or send it to the
+        workers right away if fair scheduling is disabled.
+
+        Once the task is queued, errors dispatching it or the tasks of other users
+        are only logged: the tasks stay queued and are dispatched by the next
+        completion or enqueue.
+
+        Args:
+            user_email (str): Email of the user the task belongs to.
+            user_openai_key (str): OpenAI API key to summarise the document with.
+            read_docs_ref (str): Blob store key of the text to be summarized.
+            user_task_id (str): ID of the user task.
+            use_summary_cache (bool): Whether to use the shared chunk summary cache.
+            extractive_ratio (float): The fraction of long documents kept by the
+                extractive stage.
+            own_key (bool): Whether the key is the user's own, putting the task in
+                the priority lane.
+        """
+        if self.scheduler is None:
+            self.run_generate_task(
+                user_openai_key,
+                read_docs_ref,
+                user_task_id,
+                use_summary_cache,
+                extractive_ratio,
+            )
+            return
+        # keys are looked up when the task is dispatched rather than stored in the queue
+        self.scheduler.queue(
+            user_task_id,
+            user_email,
+            priority=own_key,
+            read_docs_ref=read_docs_ref,
+            use_summary_cache=use_summary_cache,
+            extractive_ratio=extractive_ratio,
+        )
+        try:
+            self.scheduler.dispatch()
+        except Exception:
+            logger.exception(
+                f"Dispatching queued tasks after queueing task {user_task_id} failed"
+            )
+
+    def dispatch_scheduled_task(
+        self,
+        user_task_id,
+        user_email,
+        priority,
+        read_docs_ref,
+        use_summary_cache=True,
+        extractive_ratio=1.0,
+    ):
+        """
+        Send a task dispatched by the fair scheduler to the workers, with the OpenAI
+        key of its user if the task is in the priority lane, else the shared key.
+
+        Args:
+            user_task_id (str): ID of the user task.
+            user_email (str): Email of the user the task belongs to.
+            priority (bool): Whether the task is in the priority lane.
+            read_docs_ref (str): Blob store key of the text to be summarized.
+            use_summary_cache (bool): Whether to use the shared chunk summary cache.
+            extractive_ratio (float): The fraction of long documents kept by the
+                extractive stage.
+        """
+        user_openai_key = global_config["OpenAI"]["API_KEY"]
+        if priority:
+            user = User.objects(user_email=user_email).only("user_openai_key").first()
+            if user is None or user.user_openai_key is None:
+                # the task was not charged to the free summary generations
+                self.task_notifier(
+                    {
+                        "notification_auth": self.notification_api_key,
+                        "task_id": user_task_id,
+                        "task_status": "FAILED",
+                        "task_error": "Your OpenAI key was removed before the task could run, kindly resume the task",
+                    }
+                )
+                return
+            user_openai_key = user.user_openai_key
+        self.run_generate_task(
+            user_openai_key,
+            read_docs_ref,
+            user_task_id,
+            use_summary_cache,
+            extractive_ratio,
+            queue=self.priority_queue if priority else None,
+        )
+
+    def complete_scheduled_tasks(self, user_task_ids):
+        """
+        Report completed tasks to the fair scheduler, dispatching the tasks they were
+        holding back.
+
+        Args:
+            user_task_ids (list): IDs of the completed user tasks.
+        """
+        if self.scheduler is not None:
+            self.scheduler.complete(user_task_ids)
+
 
-celery_application = CeleryApplication(celery_app).enable_app()
+celery_application = CeleryApplication(
+    celery_app, publisher_pool=build_publisher_pool(celery_app)
+).enable_app()
@@ -0,0 +1,134 @@
+from backend.models import ChunkSummaryCheckpoint, UserTasks
+from datetime import datetime
+import hashlib
+
+
+class TaskCheckpoint:
+    """
+    Chunk summaries of a summarisation task, persisted as they finish.
+
+    When a task fails part way, its retries and resumptions only summarise the chunks
+    missing from the checkpoint. Checkpoints are keyed by task and chunk index, and
+    only reused if the chunk at that index is unchanged.
+
+    Attributes:
+        task_id (str): ID of the user task.
+        document_class: Mongo document class holding the checkpoints.
+        task_class: Mongo document class of the user tasks.
+    """
+
+    def __init__(
+        self,
+        task_id: str,
+        document_class=ChunkSummaryCheckpoint,
+        task_class=UserTasks,
+    ):
+        """
+        Initialize the TaskCheckpoint.
+
+        Args:
+            task_id (str): ID of the user task.
+            document_class: Mongo document class holding the checkpoints.
+            task_class: Mongo document class of the user tasks.
+        """
+        self.task_id = task_id
+        self.document_class = document_class
+        self.task_class = task_class
+
+    @staticmethod
+    def chunk_digest(chunk: str) -> str:
+        """
+        Hash a chunk.
+
+        Args:
+            chunk (str): The chunk.
+
+        Returns:
+            str: The SHA-256 hex digest of the chunk.
+        """
+        return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+    def start(self, chunks_total: int):
+        """
+        Record the number of chunks of the task, for progress reporting.
+
+        Args:
+            chunks_total (int): The number of chunks of the document.
+        """
+        self.task_class.objects(user_task_id=self.task_id).update(
+            set__user_task_chunks_total=chunks_total
+        )
+
+    def load(self, chunks) -> dict:
+        """
+        Load the checkpointed summaries of the chunks of the task.
+
+        Args:
+            chunks (list): The chunks of the document.
+
+        Returns:
+            dict: Chunk index -> summary, for the chunks already summarised.
+        """
+        return self.load_digests([self.chunk_digest(chunk) for chunk in chunks])
+
+    def load_digests(self, chunk_digests) -> dict:
+        """
+        Load the checkpointed summaries of the chunks of the task from their digests,
+        when the chunks themselves are not at hand.
+
+        Args:
+            chunk_digests (list): The digests of the chunks of the document.
+
+        Returns:
+            dict: Chunk index -> summary, for the chunks already summarised.
+        """
+        summaries = {}
+        for checkpoint in self.document_class.objects(task_id=self.task_id):
+            index = checkpoint.chunk_index
+            if (
+                index < len(chunk_digests)
+                and checkpoint.chunk_digest == chunk_digests[index]
+            ):
+                summaries[index] = checkpoint.summary
+        return summaries
+
+    def save(self, chunk_index: int, chunk: str, summary: str):
+        """
+        Persist the summary of a chunk.
+
+        Args:
+            chunk_index (int): Index of the chunk in the document.
+            chunk (str): The chunk.
+            summary (str): The summary of the chunk.
+        """
+        self.document_class.objects(
+            task_id=self.task_id, chunk_index=chunk_index
+        ).update_one(
+            set__chunk_digest=self.chunk_digest(chunk),
+            set__summary=summary,
+            # the TTL index expires checkpoints from their creation
+            set_on_insert__created_at=datetime.utcnow(),
+            upsert=True,
+        )
+
+    def progress(self) -> tuple:
+        """
+        Get the summaries checkpointed so far.
+
+        Returns:
+            tuple: The number of summarised chunks, and their summaries joined in
+                document order.
+        """
+        checkpoints = (
+            self.document_class.objects(task_id=self.task_id)
+            .only("summary")
+            .order_by("chunk_index")
+        )
+        summaries = [checkpoint.summary for checkpoint in checkpoints]
+        return len(summaries), "\n".join(summaries)
+
+    def clear(self):
+        """
+        Delete the checkpoints of the task, once its summary is stored.
+        """
+        self.document_class.objects(task_id=self.task_id).delete()
@@ -0,0 +1,207 @@
+from functools import lru_cache
+import math
+import re
+
+# a blank line, possibly holding whitespace, separates paragraphs
+PARAGRAPH_SEPARATOR = re.compile(r"\n\s*\n")
+# whitespace following sentence ending punctuation separates sentences
+SENTENCE_SEPARATOR = re.compile(r"(?<=[.!?])\s+")
+
+
+class Tokenizer:
+    """
+    Local token counter for an OpenAI model.
+
+    Uses the tiktoken encoding of the model. If tiktoken or the encoding is not
+    available, falls back to an estimate of four characters per token.
+
+    Attributes:
+        encoding: The tiktoken encoding, None when estimating.
+    """
+
+    def __init__(self, model: str):
+        """
+        Initialize the Tokenizer for a model.
+
+        Args:
+            model (str): Name of the OpenAI model.
+        """
+        try:
+            # imported on first use, loading tiktoken slows down process start
+            import tiktoken
+
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # tiktoken downloads encodings on first use, which can fail offline
+            self.encoding = None
+
+    def count(self, text: str) -> int:
+        """
+        Count the tokens of a text.
+
+        Args:
+            text (str): The text to count the tokens of.
+
+        Returns:
+            int: The number of tokens of the text.
+        """
+        if self.encoding is None:
+            return math.ceil(len(text) / 4)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model: str) -> Tokenizer:
+    """
+    Get the shared Tokenizer of a model.
+
+    Args:
+        model (str): Name of the OpenAI model.
+
+    Returns:
+        Tokenizer: The tokenizer of the model.
+    """
+    return Tokenizer(model)
+
+
+class TokenChunker:
+    """
+    Splits text into chunks of whole paragraphs and sentences measured in tokens.
+
+    Paragraphs are kept whole whenever they fit in a chunk, otherwise they are split
+    into sentences, and sentences longer than a chunk are split between words.
+    Units are then packed greedily into chunks of at most max_tokens tokens.
+
+    A last chunk shorter than min_tokens is rebalanced with the chunk before it. If
+    the units are too coarse for that, it is merged into the chunk before it, which
+    may then exceed max_tokens by less than min_tokens.
+
+    Attributes:
+        token_counter (callable): Function counting the tokens of a text.
+        max_tokens (int): Token budget of a chunk.
+        min_tokens (int): Minimum number of tokens of the last chunk.
+    """
+
+    def __init__(self, token_counter, max_tokens: int, min_tokens: int = 0):
+        """
+        Initialize the TokenChunker.
+
+        Args:
+            token_counter (callable): Function counting the tokens of a text.
+            max_tokens (int): Token budget of a chunk.
+            min_tokens (int): Minimum number of tokens of the last chunk, at most
+                half of max_tokens.
+
+        Raises:
+            ValueError: If min_tokens is more than half of max_tokens.
+        """
+        if not 0 <= min_tokens <= max_tokens // 2:
+            raise ValueError("min_tokens must be between 0 and half of max_tokens")
+        self.token_counter = token_counter
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+
+    def _split_words(self, sentence: str):
+        """
+        Split a sentence longer than the token budget between words.
+
+        Args:
+            sentence (str): The sentence to be split.
+
+        Returns:
+            list: (text, tokens, separator) units of at most max_tokens tokens.
+        """
+        units = []
+        words = []
+        tokens = 0
+        for word in sentence.split():
+            word_tokens = self.token_counter(word)
+            if words and tokens + word_tokens > self.max_tokens:
+                units.append((" ".join(words), tokens, " "))
+                words, tokens = [], 0
+            words.append(word)
+            tokens += word_tokens
+        if words:
+            units.append((" ".join(words), tokens, " "))
+        return units
+
+    def split_units(self, text: str):
+        """
+        Split a text into units that each fit in a chunk.
+
+        Args:
+            text (str): The text to be split.
+
+        Returns:
+            list: (text, tokens, separator) tuples, where separator joins the unit
+                to the unit before it.
+        """
+        units = []
+        for paragraph in PARAGRAPH_SEPARATOR.split(text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            tokens = self.token_counter(paragraph)
+            if tokens <= self.max_tokens:
+                units.append((paragraph, tokens, "\n\n"))
+                continue
+            sentence_units = []
+            for sentence in SENTENCE_SEPARATOR.split(paragraph):
+                tokens = self.token_counter(sentence)
+                if tokens <= self.max_tokens:
+                    sentence_units.append((sentence, tokens, " "))
+                else:
+                    sentence_units.extend(self._split_words(sentence))
+            # the first sentence of a paragraph starts a new paragraph
+            sentence_units[0] = sentence_units[0][:2] + ("\n\n",)
+            units.extend(sentence_units)
+        return units
+
+    @staticmethod
+    def _join(units) -> str:
+        return units[0][0] + "".join(
+            separator + unit for unit, _, separator in units[1:]
+        )
+
+    def chunk(self, text: str):
+        """
+        Split a text into chunks.
+
+        Args:
+            text (str): The text to be split.
+
+        Returns:
+            list: The chunks of the text, as strings.
+        """
+        chunks = []
+        current, current_tokens = [], 0
+        for unit in self.split_units(text):
+            if current and current_tokens + unit[1] > self.max_tokens:
+                chunks.append(current)
+                current, current_tokens = [], 0
+            current.append(unit)
+            current_tokens += unit[1]
+        if current:
+            chunks.append(current)
+
+        if len(chunks) > 1 and sum(unit[1] for unit in chunks[-1]) < self.min_tokens:
+            merged = chunks.pop(-2) + chunks.pop()
+            total_tokens = sum(unit[1] for unit in merged)
+            # cut the merged units where both halves are as balanced as possible
+            best_cut, best_tail, tokens = None, 0, 0
+            for cut in range(len(merged) - 1, 0, -1):
+                tokens += merged[cut][1]
+                if tokens > self.max_tokens or total_tokens - tokens > self.max_tokens:
+                    continue
+                if tokens >= self.min_tokens and tokens > best_tail:
+                    best_cut, best_tail = cut, tokens
+                if tokens * 2 >= total_tokens:
+                    break
+            if best_cut is None or total_tokens <= self.max_tokens:
+                chunks.append(merged)
+            else:
+                chunks.extend([merged[:best_cut], merged[best_cut:]])
+        return [TokenChunker._join(units) for units in chunks]
@@ -0,0 +1,173 @@
+from backend.chunker import PARAGRAPH_SEPARATOR, SENTENCE_SEPARATOR
+from backend.configuration import global_config
+import numpy as np
+import re
+
+WORD = re.compile(r"\w+")
+
+
+class ExtractiveCompressor:
+    """
+    Keeps the most central sentences of long documents before they are summarised.
+
+    Sentences are ranked with TextRank over the cosine similarities of their TF-IDF
+    vectors, and the best ranked sentences are kept, in document order, up to a
+    fraction of the document. The similarity matrix is never built: the sparse TF-IDF
+    matrix is held as coordinate arrays and PageRank iterates on products with it, so
+    time and memory grow with the number of words rather than the square of the
+    number of sentences.
+
+    Attributes:
+        min_tokens (int): Documents shorter than this are kept as they are.
+        damping (float): Damping factor of TextRank.
+        iterations (int): Maximum number of power iterations.
+        tolerance (float): Convergence threshold of the power iterations.
+    """
+
+    def __init__(
+        self,
+        min_tokens: int = global_config.getint(
+            "Extractive", "MIN_TOKENS", fallback=50000
+        ),
+        damping: float = 0.85,
+        iterations: int = 50,
+        tolerance: float = 1e-6,
+    ):
+        """
+        Initialize the ExtractiveCompressor.
+
+        Args:
+            min_tokens (int): Documents shorter than this are kept as they are.
+            damping (float): Damping factor of TextRank.
+            iterations (int): Maximum number of power iterations.
+            tolerance (float): Convergence threshold of the power iterations.
+        """
+        self.min_tokens = min_tokens
+        self.damping = damping
+        self.iterations = iterations
+        self.tolerance = tolerance
+
+    @staticmethod
+    def split_sentences(text: str) -> list:
+        """
+        Split a text into sentences, like the chunker does.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            list: (paragraph index, sentence) tuples, in document order.
+        """
+        return [
+            (paragraph_index, sentence)
+            for paragraph_index, paragraph in enumerate(PARAGRAPH_SEPARATOR.split(text))
+            for sentence in SENTENCE_SEPARATOR.split(paragraph.strip())
+            if sentence
+        ]
+
+    @staticmethod
+    def tfidf(sentences) -> tuple:
+        """
+        Build the L2 normalised TF-IDF matrix of sentences, in coordinate format.
+
+        Args:
+            sentences (list): The sentences.
+
+        Returns:
+            tuple: Row, column and value arrays of the non-zero entries.
+        """
+        vocabulary = {}
+        rows = []
+        columns = []
+        for row, sentence in enumerate(sentences):
+            for word in WORD.findall(sentence.lower()):
+                rows.append(row)
+                columns.append(vocabulary.setdefault(word, len(vocabulary)))
+        if not rows:
+            return np.zeros(0, int), np.zeros(0, int), np.zeros(0)
+        # merge repeated words of a sentence into term frequencies
+        keys, counts = np.unique(
+            np.array(rows, dtype=np.int64) * len(vocabulary) + np.array(columns),
+            return_counts=True,
+        )
+        rows, columns = np.divmod(keys, len(vocabulary))
+        document_frequencies = np.bincount(columns, minlength=len(vocabulary))
+        values = counts * (np.log(len(sentences) / document_frequencies[columns]) + 1)
+        norms = np.sqrt(np.bincount(rows, weights=values**2, minlength=len(sentences)))
+        return rows, columns, values / norms[rows]
+
+    def rank(self, sentences) -> np.ndarray:
+        """
+        Rank sentences with TextRank.
+
+        Args:
+            sentences (list): The sentences.
+
+        Returns:
+            np.ndarray: The score of every sentence.
+        """
+        sentence_count = len(sentences)
+        rows, columns, values = self.tfidf(sentences)
+        vocabulary_size = columns.max() + 1 if len(columns) else 0
+        has_words = np.bincount(rows, minlength=sentence_count) > 0
+
+        def similarity_product(vector):
+            # S v = X (X^T v) - v, excluding the similarity of sentences to themselves
+            terms = np.bincount(
+                columns, weights=values * vector[rows], minlength=vocabulary_size
+            )
+            product = np.bincount(
+                rows, weights=values * terms[columns], minlength=sentence_count
+            )
+            return product - vector * has_words
+
+        weights = similarity_product(np.ones(sentence_count))
+        linked = weights > 1e-12
+        scores = np.full(sentence_count, 1 / sentence_count)
+        for _ in range(self.iterations):
+            # sentences similar to no other one pass their score on to every sentence
+            spread = np.where(linked, scores / np.where(linked, weights, 1), 0)
+            dangling = scores[~linked].sum() / sentence_count
+            new_scores = (1 - self.damping) / sentence_count + self.damping * (
+                similarity_product(spread) + dangling
+            )
+            converged = np.abs(new_scores - scores).sum() < self.tolerance
+            scores = new_scores
+            if converged:
+                break
+        return scores
+
+    def compress(self, text: str, ratio: float, token_counter=None) -> str:
+        """
+        Keep the best ranked sentences of a text, up to a fraction of its length.
+
+        Args:
+            text (str): The text.
+            ratio (float): The fraction of the text to keep, 1 to keep it all.
+            token_counter (callable, optional): Counts the tokens of a text, texts of
+                less than min_tokens tokens are kept as they are. Words are counted
+                if not given.
+
+        Returns:
+            str: The kept sentences in document order, in their paragraphs.
+        """
+        if ratio >= 1:
+            return text
+        token_counter = token_counter or (lambda text: len(text.split()))
+        if token_counter(text) < self.min_tokens:
+            return text
+        paragraph_sentences = self.split_sentences(text)
+        if not paragraph_sentences:
+            return text
+        sentences = [sentence for _, sentence in paragraph_sentences]
+        scores = self.rank(sentences)
+        lengths = np.array([len(sentence) for sentence in sentences])
+        order = np.argsort(-scores, kind="stable")
+        # keep the best sentences while they fit in the budget
+        kept = order[np.cumsum(lengths[order]) <= ratio * lengths.sum()]
+        kept = np.sort(kept if len(kept) else order[:1])
+        paragraphs = {}
+        for index in kept:
+            paragraph_index, sentence = paragraph_sentences[index]
+            paragraphs.setdefault(paragraph_index, []).append(sentence)
+        return "\n\n".join(" ".join(paragraph) for paragraph in paragraphs.values())
@@ -0,0 +1,213 @@
+from abc import ABC, abstractmethod
+from backend.configuration import global_config
+from backend.openai_pool import openai_client_pool
+import hashlib
+import httpx
+import itertools
+import math
+import openai
+import random
+import threading
+import time
+from typing import NamedTuple
+
+
+class Completion(NamedTuple):
+    """
+    Completion of a prompt.
+
+    Attributes:
+        text (str): The completion.
+        output_tokens (int): Number of tokens of the completion.
+        truncated (bool): Whether the completion was cut short by its token budget.
+    """
+
+    text: str
+    output_tokens: int
+    truncated: bool
+
+
+class LLMBackend(ABC):
+    """
+    Abstract base class of the language model backends completing prompts.
+    """
+
+    @abstractmethod
+    def complete(self, prompt: str, max_tokens: int) -> Completion:
+        """
+        Complete a prompt.
+
+        Args:
+            prompt (str): The prompt.
+            max_tokens (int): Maximum length of the completion in tokens.
+
+        Returns:
+            Completion: The completion and its usage.
+        """
+        pass
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Backend completing prompts with the OpenAI chat completions API.
+
+    Attributes:
+        api_key (str): The API key for accessing OpenAI services.
+        model (str): The GPT model completing the prompts.
+        client_pool (OpenAIClientPool): Pool the OpenAI clients are borrowed from.
+    """
+
+    def __init__(self, api_key: str, model: str, client_pool=openai_client_pool):
+        """
+        Initialize the OpenAIBackend.
+
+        Args:
+            api_key (str): The API key for accessing OpenAI services.
+            model (str): The GPT model completing the prompts.
+            client_pool (OpenAIClientPool): Pool the OpenAI clients are borrowed from.
+        """
+        self.api_key = api_key
+        self.model = model
+        self.client_pool = client_pool
+
+    def complete(self, prompt: str, max_tokens: int) -> Completion:
+        with self.client_pool.borrow(self.api_key, self.model) as client:
+            response = client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+            )
+        choice = response.choices[0]
+        return Completion(
+            choice.message.content.strip(),
+            response.usage.completion_tokens,
+            choice.finish_reason == "length",
+        )
+
+
+class LocalBackend(LLMBackend):
+    """
+    Deterministic stand-in for a language model, to load test and benchmark the
+    pipeline without a paid API.
+
+    Completions are made of the words of the prompt, so they only depend on the prompt
+    and its token budget. Latencies follow a log-normal distribution, and a fraction
+    of the requests fail with a server error that the retry logic handles like one
+    from OpenAI. Latencies and errors are drawn from a generator seeded with seed.
+
+    Attributes:
+        latency_mean (float): Mean latency of a completion in seconds.
+        latency_sigma (float): Shape of the log-normal latency distribution, 0 for
+            constant latencies.
+        error_rate (float): Fraction of the completions failing.
+        output_tokens (int): Length of the completions in tokens, bounded by the
+            token budget of each completion.
+        sleep (callable): Waits for the latency of a completion.
+    """
+
+    def __init__(
+        self,
+        latency_mean: float = global_config.getfloat(
+            "LLM", "LATENCY_MEAN", fallback=1.0
+        ),
+        latency_sigma: float = global_config.getfloat(
+            "LLM", "LATENCY_SIGMA", fallback=0.5
+        ),
+        error_rate: float = global_config.getfloat("LLM", "ERROR_RATE", fallback=0.0),
+        output_tokens: int = global_config.getint("LLM", "OUTPUT_TOKENS", fallback=100),
+        seed: int = global_config.getint("LLM", "SEED", fallback=0),
+        sleep=time.sleep,
+    ):
+        """
+        Initialize the LocalBackend.
+
+        Args:
+            latency_mean (float): Mean latency of a completion in seconds.
+            latency_sigma (float): Shape of the log-normal latency distribution, 0 for
+                constant latencies.
+            error_rate (float): Fraction of the completions failing.
+            output_tokens (int): Length of the completions in tokens.
+            seed (int): Seed of the latency and error generator.
+            sleep (callable): Waits for the latency of a completion.
+        """
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.output_tokens = output_tokens
+        self.sleep = sleep
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self) -> tuple:
+        """
+        Draw the latency and the outcome of a completion.
+
+        Returns:
+            tuple: The latency in seconds, and whether the completion fails.
+        """
+        with self._lock:
+            if self.latency_mean <= 0:
+                latency = 0.0
+            else:
+                # mu such that the mean of the distribution is latency_mean
+                mu = math.log(self.latency_mean) - self.latency_sigma**2 / 2
+                latency = self._random.lognormvariate(mu, self.latency_sigma)
+            return latency, self._random.random() < self.error_rate
+
+    @staticmethod
+    def build_completion(prompt: str, length: int) -> str:
+        """
+        Build a deterministic completion out of the words of a prompt.
+
+        Args:
+            prompt (str): The prompt.
+            length (int): Number of words of the completion.
+
+        Returns:
+            str: The completion.
+        """
+        words = prompt.split()
+        if not words:
+            return ""
+        # start at a prompt dependent word, so that completions of similar prompts differ
+        start = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16) % len(words)
+        cycle = itertools.cycle(words[start:] + words[:start])
+        return " ".join(itertools.islice(cycle, length))
+
+    def complete(self, prompt: str, max_tokens: int) -> Completion:
+        latency, failed = self._draw()
+        self.sleep(latency)
+        if failed:
+            request = httpx.Request("POST", "http://local-backend/chat/completions")
+            raise openai.InternalServerError(
+                "Simulated local backend error",
+                response=httpx.Response(500, request=request),
+                body=None,
+            )
+        output_tokens = min(self.output_tokens, max_tokens)
+        return Completion(
+            self.build_completion(prompt, output_tokens),
+            output_tokens,
+            self.output_tokens > max_tokens,
+        )
+
+
+def build_llm_backend(
+    api_key: str,
+    model: str,
+    backend: str = global_config.get("LLM", "BACKEND", fallback="openai"),
+) -> LLMBackend:
+    """
+    Build the language model backend from the configuration.
+
+    Args:
+        api_key (str): The API key for accessing OpenAI services.
+        model (str): The GPT model completing the prompts.
+        backend (str): "local" for the deterministic local backend, "openai" otherwise.
+
+    Returns:
+        LLMBackend: The language model backend.
+    """
+    if backend == "local":
+        return LocalBackend()
+    return OpenAIBackend(api_key, model)
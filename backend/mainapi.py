@@ -1,4 +1,5 @@
 from fastapi import FastAPI, HTTPException, UploadFile, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
 from typing import Annotated
 import uvicorn
@@ -18,7 +19,9 @@ from backend.pydantic_models import (
     VerifyUser,
     LoginUser,
     PasswordResetRequestModel,
+    TaskCompletion,
     TaskCompletionNotification,
+    TaskCompletionNotifications,
 )
 from backend.configuration import global_config
 from backend.models import User, PotentialUser, PasswordRecoveryRequest, UserTasks
@@ -26,8 +29,12 @@ from datetime import datetime, timedelta
 from backend.password_hasher import PasswordHasher
 from backend.middleware import custom_middleware
 from backend.celery_app import celery_application
+from backend.checkpoints import TaskCheckpoint
 from backend.parser import ParserFactory
+from backend.upload import UploadBuffer, UploadTooLargeError
+from pymongo import UpdateOne
 import tempfile
+import uuid
 from backend.db import connect_to_db
 
 
@@ -303,61 +310,96 @@ class Application:
         async def generate_summary(
             current_user: Annotated[User, Depends(get_current_user_secure_external)],
             file: UploadFile,
+            extractive_ratio: float = global_config.getfloat(
+                "Extractive", "RATIO", fallback=1.0
+            ),
         ):
             """
             This endpoint allows authenticated users to upload a file, which will be parsed and summarized using GPT.
-            The summary generation task is enqueued in background using Celery, and the task ID is
-            returned to the user for tracking.
+            The upload is stored and the parsing and summary generation tasks are enqueued in background using
+            Celery, and the task ID is returned to the user for tracking.
 
             Args:
                 current_user (User): The current authenticated user obtained from JWT token.
                 file (UploadFile): The file to be summarized.
+                extractive_ratio (float): The fraction of the most central sentences of long
+                    documents kept before summarisation, 1 to summarise them whole.
 
             Returns:
                 dict: A message indicating successful task enqueuing and the task ID.
 
             Raises:
                 HTTPException(402): If the user has exhausted the free summary generations limit.
-                HTTPException(400): If the uploaded file type is not supported.
+                HTTPException(400): If the uploaded file type is not supported, or the extractive
+                ratio is not between 0 and 1.
+                HTTPException(413): If the uploaded file is larger than the maximum upload size.
 
             Note:
-                - Supported file types for summary generation include .txt.
+                - Supported file types for summary generation include .txt, .docx and .pdf.
                 - The user's available free summary generations are tracked, and they may need to upgrade their
-                plan if the limit is exceeded.
+                plan if the limit is exceeded. As the parsed length is only known once the parsing task has run,
+                a task exceeding the limit fails with the reason recorded in the task.
             """
-            file_extension = get_file_extension(file.filename)
-            source_stream = await file.read()
-            user_openai_key = (global_config["OpenAI"]["API_KEY"],)
-            try:
-                parser = ParserFactory(source_stream, file_extension).build()
-            except NotImplementedError:
+            if not 0 < extractive_ratio <= 1:
                 raise HTTPException(
-                    status_code=400, detail="Please enter a valid supported file type"
-                )
-            read_docs = parser.read()
-            if current_user.user_openai_key is None:
-                current_user.update(
-                    set__user_docs_capacity=current_user.user_docs_capacity
-                    - len(read_docs)
+                    status_code=400,
+                    detail="The extractive ratio must be between 0 and 1",
                 )
-                if current_user.user_docs_capacity < 0:
+            file_extension = get_file_extension(file.filename)
+            user_openai_key = global_config["OpenAI"]["API_KEY"]
+            charge_free_tier = current_user.user_openai_key is None
+            if charge_free_tier:
+                if current_user.user_docs_capacity <= 0:
                     raise HTTPException(
                         status_code=402,
                         detail="You have utilised all free summary generations",
                     )
             else:
                 user_openai_key = current_user.user_openai_key
-            task_id = self.celery_application.run_generate_task(
-                user_openai_key, read_docs
-            )
-            user_task = UserTasks(
-                user_email=current_user.user_email,
-                user_task_id=task_id,
-                user_read_docs=read_docs,
-                user_task_completed=None,
-                user_generated_summary=None,
+            try:
+                upload_buffer = await UploadBuffer.from_upload_file(file)
+            except UploadTooLargeError:
+                raise HTTPException(
+                    status_code=413, detail="The uploaded file is too large"
+                )
+            try:
+                try:
+                    # cheap check, parsing itself happens in the background
+                    ParserFactory(
+                        upload_buffer.source, file_extension
+                    ).detect_file_type()
+                except NotImplementedError:
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Please enter a valid supported file type",
+                    )
+                task_id = str(uuid.uuid4())
+                user_task = UserTasks(
+                    user_email=current_user.user_email,
+                    user_task_id=task_id,
+                    user_file_extension=file_extension,
+                    user_upload_digest=upload_buffer.digest,
+                    user_extractive_ratio=extractive_ratio,
+                    user_task_completed=None,
+                    user_generated_summary=None,
+                )
+                # GridFS writes block, keep them off the event loop
+                await run_in_threadpool(
+                    user_task.user_upload.put,
+                    upload_buffer.source,
+                    filename=file.filename,
+                )
+                user_task.save()
+            finally:
+                upload_buffer.close()
+            # publishing to the broker blocks
+            await run_in_threadpool(
+                self.celery_application.run_parse_task,
+                task_id,
+                user_openai_key,
+                charge_free_tier,
+                not current_user.user_summary_cache_opt_out,
             )
-            user_task.save()
             return {
                 "message": "Your task for summary generation has been enqued",
                 "task_id": task_id,
@@ -381,20 +423,64 @@ class Application:
                 raise HTTPException(
                     status_code=401, detail="Notification request unauthorised"
                 )
-            task = UserTasks.objects(user_task_id=notify_task.task_id).first()
-            if task is None:
+            updated = UserTasks.objects(user_task_id=notify_task.task_id).update_one(
+                **{
+                    "set__" + field: value
+                    for field, value in self.task_completion_fields(notify_task).items()
+                }
+            )
+            if not updated:
                 raise HTTPException(status_code=404, detail="Task not found")
-            task.update(
-                set__user_generated_summary=notify_task.generated_summary,
-                set__user_task_status=notify_task.task_status,
-                set__user_task_completed=datetime.now(),
+            # dispatching the tasks held back publishes to the broker, which blocks
+            await run_in_threadpool(
+                self.celery_application.complete_scheduled_tasks,
+                [notify_task.task_id],
             )
             return {"message": "Task completed"}
 
+        @self.app.post("/notify/tasks")
+        async def notify_tasks(notify_tasks: TaskCompletionNotifications):
+            """
+            Endpoint to notify the completion of a batch of tasks by a celery worker, in a single
+            bulk write. Needs internal API key to authorise
+
+            Args:
+                notify_tasks (TaskCompletionNotifications): Notification data of every task.
+
+            Returns:
+                dict: Message indicating successful notification, and the number of tasks found.
+            """
+            if (
+                notify_tasks.notification_auth
+                != global_config["Notification"]["API_KEY"]
+            ):
+                raise HTTPException(
+                    status_code=401, detail="Notification request unauthorised"
+                )
+            if not notify_tasks.notifications:
+                return {"message": "Tasks completed", "tasks_updated": 0}
+            result = await run_in_threadpool(
+                UserTasks._get_collection().bulk_write,
+                [
+                    UpdateOne(
+                        {"user_task_id": notification.task_id},
+                        {"$set": self.task_completion_fields(notification)},
+                    )
+                    for notification in notify_tasks.notifications
+                ],
+                ordered=False,
+            )
+            await run_in_threadpool(
+                self.celery_application.complete_scheduled_tasks,
+                [notification.task_id for notification in notify_tasks.notifications],
+            )
+            return {"message": "Tasks completed", "tasks_updated": result.matched_count}
+
         @self.app.get("/user/get_summary")
         async def get_summary(
             current_user: Annotated[User, Depends(get_current_user_secure_external)],
             task_id: str,
+            partial: bool = False,
         ):
             """
             Endpoint to get summary for a specific task if task is completed.
@@ -402,28 +488,46 @@ class Application:
             Args:
                 current_user (User): Current user obtained from JWT token.
                 task_id (str): ID of the task to get summary for.
+                partial (bool): Whether to include the summary of the chunks summarised so
+                    far for tasks that are pending or have failed.
 
             Returns:
-                dict: Summary of the specified task.
+                dict: Summary of the specified task, or its status and progress if the task
+                is not completed.
             """
-            task = UserTasks.objects(
-                user_email=current_user.user_email, user_task_id=task_id
-            ).first()
+            task = (
+                UserTasks.objects(
+                    user_email=current_user.user_email, user_task_id=task_id
+                )
+                .exclude("user_upload", "user_read_docs")
+                .first()
+            )
             if task is None:
                 raise HTTPException(
                     status_code=401,
                     detail="The task can only be checked by the user to which the task belongs",
                 )
             if task.user_task_status == "PENDING":
-                return {
+                response = {
                     "message": "Task is still running, please wait",
                     "status": "PENDING",
                 }
-            if task.user_task_status == "FAILED":
-                return {
-                    "message": "Task has failed, kindly resend the task or contact the team for further support",
+            elif task.user_task_status == "FAILED":
+                response = {
+                    "message": task.user_task_error
+                    or "Task has failed, kindly resume or resend the task or contact the team for further support",
                     "status": "FAILED",
                 }
+            if task.user_task_status in ["PENDING", "FAILED"]:
+                if task.user_task_chunks_total:
+                    chunks_done, partial_summary = TaskCheckpoint(task_id).progress()
+                    response["progress"] = {
+                        "chunks_done": chunks_done,
+                        "chunks_total": task.user_task_chunks_total,
+                    }
+                    if partial:
+                        response["partial_summary"] = partial_summary
+                return response
             # Create a temporary file
             with tempfile.NamedTemporaryFile(mode="w+", delete=False) as temp_file:
                 temp_file.write(task.user_generated_summary)
@@ -433,6 +537,87 @@ class Application:
                 temp_file.name, filename=f"{task_id}.txt", media_type="text/plain"
             )
 
+        @self.app.post("/user/resume_task")
+        async def resume_task(
+            current_user: Annotated[User, Depends(get_current_user_secure_external)],
+            task_id: str,
+        ):
+            """
+            Endpoint to resume a failed task, summarising only the chunks its earlier attempts
+            did not summarise.
+
+            Args:
+                current_user (User): Current user obtained from JWT token.
+                task_id (str): ID of the task to resume.
+
+            Returns:
+                dict: A message indicating successful task enqueuing and the task ID.
+
+            Raises:
+                HTTPException(401): If the task does not belong to the user.
+                HTTPException(409): If the task has not failed, or failed before its document was parsed.
+                HTTPException(402): If the user has exhausted the free summary generations limit.
+            """
+            task = (
+                UserTasks.objects(
+                    user_email=current_user.user_email, user_task_id=task_id
+                )
+                .exclude("user_upload")
+                .first()
+            )
+            if task is None:
+                raise HTTPException(
+                    status_code=401,
+                    detail="The task can only be resumed by the user to which the task belongs",
+                )
+            if task.user_task_status != "FAILED":
+                raise HTTPException(
+                    status_code=409, detail="Only failed tasks can be resumed"
+                )
+            read_docs_ref = task.user_read_docs_ref
+            if read_docs_ref is None and task.user_read_docs is not None:
+                # tasks parsed before the blob store keep their text inline
+                read_docs_ref = await run_in_threadpool(
+                    self.celery_application.document_store.put, task.user_read_docs
+                )
+            if read_docs_ref is None or not await run_in_threadpool(
+                self.celery_application.document_store.exists, read_docs_ref
+            ):
+                # the text of tasks failed long ago has expired
+                raise HTTPException(
+                    status_code=409,
+                    detail="The document of the task could not be read, kindly resend the task",
+                )
+            user_openai_key = current_user.user_openai_key
+            if user_openai_key is None:
+                # the document was charged when parsed, resuming does not charge it again
+                if current_user.user_docs_capacity < 0:
+                    raise HTTPException(
+                        status_code=402,
+                        detail="You have utilised all free summary generations",
+                    )
+                user_openai_key = global_config["OpenAI"]["API_KEY"]
+            task.update(
+                set__user_task_status="PENDING",
+                set__user_task_error=None,
+                set__user_task_completed=None,
+                set__user_read_docs_ref=read_docs_ref,
+            )
+            await run_in_threadpool(
+                self.celery_application.schedule_generate_task,
+                current_user.user_email,
+                user_openai_key,
+                read_docs_ref,
+                task_id,
+                not current_user.user_summary_cache_opt_out,
+                task.user_extractive_ratio,
+                own_key=current_user.user_openai_key is not None,
+            )
+            return {
+                "message": "Your task for summary generation has been resumed",
+                "task_id": task_id,
+            }
+
         @self.app.get("/user/pending_tasks")
         async def pending_tasks(
             current_user: Annotated[User, Depends(get_current_user_secure_external)]
@@ -448,7 +633,7 @@ class Application:
             """
             tasks = UserTasks.objects(
                 user_email=current_user.user_email, user_task_status="PENDING"
-            )
+            ).exclude("user_upload")
             tasks_list = []
             for task in tasks:
                 task = task.to_mongo().to_dict()
@@ -470,7 +655,9 @@ class Application:
                 list: List of tasks for the current user.
             """
 
-            tasks = UserTasks.objects(user_email=current_user.user_email)
+            tasks = UserTasks.objects(user_email=current_user.user_email).exclude(
+                "user_upload"
+            )
             tasks_list = []
             for task in tasks:
                 task = task.to_mongo().to_dict()
@@ -495,7 +682,7 @@ class Application:
             tasks = UserTasks.objects(
                 user_email=current_user.user_email,
                 user_task_status__in=["SUCCESS", "FAILED"],
-            )
+            ).exclude("user_upload")
             tasks_list = []
             for task in tasks:
                 task = task.to_mongo().to_dict()
@@ -520,8 +707,48 @@ class Application:
             current_user.update(set__user_openai_key=openai_api_key)
             return {"message": "User openai key updated successfully"}
 
+        @self.app.post("/user/summary_cache")
+        async def update_summary_cache_opt_out(
+            current_user: Annotated[User, Depends(get_current_user_secure_external)],
+            opt_out: bool,
+        ):
+            """
+            Endpoint to opt the current user in or out of the chunk summary cache shared across users.
+
+            Args:
+                current_user (User): Current user obtained from JWT token.
+                opt_out (bool): Whether to keep the documents of the user out of the shared cache.
+
+            Returns:
+                dict: Message indicating successful update of the preference.
+            """
+            current_user.update(set__user_summary_cache_opt_out=opt_out)
+            return {"message": "User summary cache preference updated successfully"}
+
         return self
 
+    @staticmethod
+    def task_completion_fields(task_completion: TaskCompletion) -> dict:
+        """
+        Get the fields of a user task set by the notification of its completion.
+
+        Args:
+            task_completion (TaskCompletion): The completion of the task.
+
+        Returns:
+            dict: Field name -> value.
+        """
+        return {
+            "user_generated_summary": task_completion.generated_summary,
+            "user_task_status": task_completion.task_status,
+            "user_task_error": task_completion.task_error,
+            "user_task_output_tokens_budgeted": task_completion.output_tokens_budgeted,
+            "user_task_output_tokens_used": task_completion.output_tokens_used,
+            "user_task_truncated_requests": task_completion.truncated_requests,
+            "user_task_boilerplate_tokens_saved": task_completion.boilerplate_tokens_saved,
+            "user_task_completed": datetime.now(),
+        }
+
     def get_app(self):
         return self.app
 
@@ -1,12 +1,26 @@
+from backend.configuration import global_config
 from backend.logger import logger
 from fastapi import Request
+from fastapi.responses import JSONResponse
 import time
 import traceback
 
 
+# Allowance for the multipart boundaries, part headers and form fields sent along
+# with an uploaded file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
 class CustomMiddleware:
-    def __init__(self, logger):
+    def __init__(
+        self,
+        logger,
+        max_upload_size: int = global_config.getint(
+            "Upload", "MAX_SIZE", fallback=50 * 1024 * 1024
+        ),
+    ):
         self.logger = logger
+        self.max_upload_size = max_upload_size
 
     def generate_middleware(self):
         async def custom_middleware(request: Request, call_next):
@@ -35,12 +49,32 @@ class CustomMiddleware:
             try:
                 self.logger.info(f"Request received: {request.method} {request.url}")
                 self.logger.info(f"Headers: {request.headers}")
-                body = await request.body()
-                # for non utf-8 decodable file bodies
-                try:
-                    self.logger.info(f"Request Body: {body.decode()}")
-                except:
-                    pass
+                # file uploads are not logged, reading them here would pull the
+                # whole upload into memory
+                content_type = request.headers.get("content-type", "")
+                if content_type.startswith("multipart/form-data"):
+                    # reject oversized uploads before the multipart parser spools
+                    # their body to disk
+                    content_length = request.headers.get("content-length", "")
+                    if (
+                        content_length.isdigit()
+                        and int(content_length)
+                        > self.max_upload_size + MULTIPART_OVERHEAD
+                    ):
+                        self.logger.info(
+                            f"Response: 413, upload of {content_length} bytes rejected"
+                        )
+                        return JSONResponse(
+                            status_code=413,
+                            content={"detail": "The uploaded file is too large"},
+                        )
+                else:
+                    body = await request.body()
+                    # for non utf-8 decodable file bodies
+                    try:
+                        self.logger.info(f"Request Body: {body.decode()}")
+                    except:
+                        pass
 
                 response = await call_next(request)
 
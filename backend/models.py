@@ -8,6 +8,9 @@ from mongoengine import (
     ListField,
     BooleanField,
     EmbeddedDocumentField,
+    FileField,
+    FloatField,
+    DictField,
 )
 from datetime import datetime
 from backend.configuration import global_config
@@ -21,11 +24,27 @@ class PasswordRecoveryRequest(EmbeddedDocument):
 class UserTasks(Document):
     user_email = StringField(required=True)
     user_task_id = StringField(required=True, unique=True)
-    user_read_docs = StringField(required=True)
+    # raw upload, parsed into the blob store by the parsing stage of the pipeline
+    user_upload = FileField()
+    user_file_extension = StringField()
+    user_upload_digest = StringField()
+    # fraction of long documents kept by the extractive stage, 1 keeps them whole
+    user_extractive_ratio = FloatField(default=1.0)
+    # blob store key of the parsed text
+    user_read_docs_ref = StringField()
+    # parsed text of the tasks created before the blob store, no longer written
+    user_read_docs = StringField()
     user_generated_summary = StringField()
     user_task_generated = DateTimeField(default=datetime.now())
     user_task_completed = DateTimeField()
     user_task_status = StringField(default="PENDING", options=["SUCCESS", "FAILED"])
+    user_task_error = StringField()
+    # number of chunks of the document, their summaries are checkpointed as they finish
+    user_task_chunks_total = IntField()
+    user_task_output_tokens_budgeted = IntField()
+    user_task_output_tokens_used = IntField()
+    user_task_truncated_requests = IntField()
+    user_task_boilerplate_tokens_saved = IntField()
 
 
 class User(Document):
@@ -38,6 +57,8 @@ class User(Document):
     )
     user_password_recovery_request = EmbeddedDocumentField(PasswordRecoveryRequest)
     user_openai_key = StringField()
+    # keep the summaries of the documents of the user out of the shared chunk cache
+    user_summary_cache_opt_out = BooleanField(default=False)
     jwt_invalidated_at = DateTimeField()
 
 
@@ -48,3 +69,84 @@ class PotentialUser(Document):
     user_hashed_password = StringField(required=True)
     user_otp_sent = IntField(required=True)
     user_otp_sent_at = DateTimeField(default=datetime.now())
+
+
+class ChunkSummaryCache(Document):
+    cache_key = StringField(required=True, unique=True)
+    summary = StringField(required=True)
+    created_at = DateTimeField(default=datetime.utcnow)
+    meta = {
+        "indexes": [
+            {
+                "fields": ["created_at"],
+                "expireAfterSeconds": global_config.getint(
+                    "SummaryCache", "TTL", fallback=30 * 24 * 60 * 60
+                ),
+            }
+        ]
+    }
+
+
+class RateLimitBucket(Document):
+    bucket_key = StringField(required=True, unique=True)
+    tokens = FloatField(required=True)
+    updated_at = FloatField(required=True)
+
+
+class ChunkSummaryCheckpoint(Document):
+    task_id = StringField(required=True)
+    chunk_index = IntField(required=True)
+    # hash of the chunk, so that checkpoints are not reused if chunking changed
+    chunk_digest = StringField(required=True)
+    summary = StringField(required=True)
+    created_at = DateTimeField(default=datetime.utcnow)
+    meta = {
+        "indexes": [
+            {"fields": ["task_id", "chunk_index"], "unique": True},
+            {
+                "fields": ["created_at"],
+                "expireAfterSeconds": global_config.getint(
+                    "Checkpoint", "TTL", fallback=7 * 24 * 60 * 60
+                ),
+            },
+        ]
+    }
+
+
+class BatchJob(Document):
+    job_id = StringField(required=True, unique=True)
+    # ids of the batches of the job in the batch service, one per request file
+    batch_ids = ListField(StringField())
+    ingested_batch_ids = ListField(StringField())
+    task_ids = ListField(StringField())
+    model = StringField(required=True)
+    chunk_tokens = IntField(required=True)
+    min_chunk_tokens = IntField(required=True)
+    strip_boilerplate = BooleanField(default=False)
+    job_status = StringField(default="PENDING", options=["SUCCESS"])
+    created_at = DateTimeField(default=datetime.utcnow)
+
+
+class QueuedTask(Document):
+    task_id = StringField(required=True, unique=True)
+    user_email = StringField(required=True)
+    # tasks of users bringing their own OpenAI key are dispatched first
+    priority = BooleanField(default=False)
+    # arguments of the summary generation task, sent once the task is dispatched
+    dispatch_kwargs = DictField()
+    status = StringField(default="QUEUED", options=["DISPATCHED"])
+    enqueued_at = DateTimeField(default=datetime.utcnow)
+    dispatched_at = DateTimeField()
+    meta = {
+        "indexes": [
+            ("status", "user_email", "-priority", "enqueued_at"),
+            ("status", "dispatched_at"),
+        ]
+    }
+
+
+class UserSchedulerState(Document):
+    user_email = StringField(required=True, unique=True)
+    # number of dispatched tasks of the user that have not completed yet
+    running = IntField(default=0)
+    last_dispatched_at = DateTimeField()
@@ -0,0 +1,195 @@
+from backend.configuration import global_config
+from backend.logger import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atexit
+import os
+import queue
+import requests
+import threading
+import time
+
+# tells the sending thread to flush its batch and stop
+_STOP = object()
+
+
+def build_session(
+    max_retries: int = global_config.getint("Notification", "MAX_RETRIES", fallback=5),
+    backoff_factor: float = global_config.getfloat(
+        "Notification", "BACKOFF_FACTOR", fallback=0.5
+    ),
+) -> requests.Session:
+    """
+    Build an HTTP session keeping its connections to the API gateway alive, and
+    retrying failed requests with exponential backoff.
+
+    Notifications set the state of their tasks, so posting them again is safe.
+
+    Args:
+        max_retries (int): Maximum number of retries of a request.
+        backoff_factor (float): Base delay of the exponential backoff, in seconds.
+
+    Returns:
+        requests.Session: The session.
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST"],
+        respect_retry_after_header=True,
+    )
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(max_retries=retry))
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    return session
+
+
+class NotificationChannel:
+    """
+    Sends the task completion notifications of a worker process to the API gateway.
+
+    Notifications are queued and sent by a background thread, which batches the
+    notifications arriving within batch_window seconds of each other, up to
+    max_batch, into a single request to the bulk notification endpoint. Requests go
+    through a session reusing its connections and retrying with backoff. Queued
+    notifications are flushed when the channel is closed, and at the latest when the
+    process exits.
+
+    Attributes:
+        api_gateway (str): URL of the API gateway.
+        batch_window (float): Seconds to wait for more notifications to batch.
+        max_batch (int): Maximum number of notifications of a request.
+        timeout (float): Timeout of a request, in seconds.
+        session (requests.Session): The session sending the requests.
+        sent (int): Number of notifications delivered.
+        failed (int): Number of notifications that could not be delivered.
+    """
+
+    def __init__(
+        self,
+        api_gateway: str = global_config["Application"]["API_GATEWAY"],
+        batch_window: float = global_config.getfloat(
+            "Notification", "BATCH_WINDOW", fallback=0.2
+        ),
+        max_batch: int = global_config.getint(
+            "Notification", "MAX_BATCH", fallback=100
+        ),
+        timeout: float = global_config.getfloat("Notification", "TIMEOUT", fallback=10),
+        session=None,
+    ):
+        """
+        Initialize the NotificationChannel, its thread starts with the first
+        notification.
+
+        Args:
+            api_gateway (str): URL of the API gateway.
+            batch_window (float): Seconds to wait for more notifications to batch.
+            max_batch (int): Maximum number of notifications of a request.
+            timeout (float): Timeout of a request, in seconds.
+            session (requests.Session, optional): The session sending the requests,
+                defaults to a retrying session.
+        """
+        self.api_gateway = api_gateway
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.session = session or build_session()
+        self.sent = 0
+        self.failed = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def notify(self, notification_body: dict):
+        """
+        Queue a task completion notification.
+
+        Args:
+            notification_body (dict): The notification, with its notification_auth.
+        """
+        with self._lock:
+            # threads do not survive forks, celery workers start their own
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(
+                    target=self._run, args=(self._queue,), daemon=True
+                )
+                self._thread.start()
+            self._queue.put(notification_body)
+
+    def _run(self, notifications: queue.Queue):
+        while True:
+            notification = notifications.get()
+            if notification is _STOP:
+                return
+            batch = [notification]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    notification = notifications.get(
+                        timeout=max(deadline - time.monotonic(), 0)
+                    )
+                except queue.Empty:
+                    break
+                if notification is _STOP:
+                    self.send(batch)
+                    return
+                batch.append(notification)
+            self.send(batch)
+
+    def send(self, batch: list):
+        """
+        Send notifications to the bulk notification endpoint, one request per
+        notification key.
+
+        Args:
+            batch (list): The notifications, with their notification_auth.
+        """
+        batches = {}
+        for notification in batch:
+            notification = dict(notification)
+            batches.setdefault(notification.pop("notification_auth"), []).append(
+                notification
+            )
+        for notification_auth, notifications in batches.items():
+            try:
+                response = self.session.post(
+                    self.api_gateway + "/notify/tasks",
+                    json={
+                        "notification_auth": notification_auth,
+                        "notifications": notifications,
+                    },
+                    timeout=self.timeout,
+                )
+                response.raise_for_status()
+                self.sent += len(notifications)
+            except requests.RequestException:
+                self.failed += len(notifications)
+                logger.exception(
+                    "Could not notify the completion of tasks "
+                    + ", ".join(
+                        notification["task_id"] for notification in notifications
+                    )
+                )
+
+    def close(self, timeout: float = None):
+        """
+        Send the queued notifications, then stop the thread of the channel.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the queued notifications
+                to be sent.
+        """
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            thread, self._thread = self._thread, None
+            self._queue.put(_STOP)
+        thread.join(timeout)
+
+
+notification_channel = NotificationChannel()
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from backend.configuration import global_config
+from openai import OpenAI
+import httpx
+import threading
+import time
+
+
+def build_openai_client(
+    api_key: str,
+    max_connections: int = global_config.getint(
+        "OpenAIPool", "MAX_CONNECTIONS", fallback=32
+    ),
+    keepalive_expiry: float = global_config.getfloat(
+        "OpenAIPool", "KEEPALIVE_EXPIRY", fallback=300.0
+    ),
+) -> OpenAI:
+    """
+    Build an OpenAI client keeping its HTTPS connections alive between requests.
+
+    Args:
+        api_key (str): The API key of the client.
+        max_connections (int): Maximum number of connections of the client.
+        keepalive_expiry (float): Seconds an idle connection is kept alive for.
+
+    Returns:
+        OpenAI: The OpenAI client.
+    """
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(600.0, connect=5.0),
+    )
+    # retries are handled by call_with_retries, in step with the rate limiter
+    return OpenAI(api_key=api_key, max_retries=0, http_client=http_client)
+
+
+class PooledClient:
+    """
+    Client held by an OpenAIClientPool.
+
+    Attributes:
+        client: The OpenAI client.
+        borrowers (int): Number of tasks currently using the client.
+        last_used (float): Time the client was last returned to the pool.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.borrowers = 0
+        self.last_used = time.monotonic()
+
+
+class OpenAIClientPool:
+    """
+    Per-process pool of OpenAI clients keyed by API key and model.
+
+    Tasks borrow clients instead of building their own, so that documents summarised
+    with the same key reuse warm connections instead of paying TLS handshakes again.
+    Clients idle for longer than idle_timeout are closed. Once the pool holds
+    max_size clients, the least recently used idle client is closed to make room;
+    if every client is in use the pool grows beyond max_size until they are returned.
+
+    Attributes:
+        max_size (int): Maximum number of pooled clients.
+        idle_timeout (float): Seconds after which an unused client is closed.
+        client_factory (callable): Builds a client from an API key.
+    """
+
+    def __init__(
+        self,
+        max_size: int = global_config.getint("OpenAIPool", "MAX_SIZE", fallback=16),
+        idle_timeout: float = global_config.getfloat(
+            "OpenAIPool", "IDLE_TIMEOUT", fallback=600.0
+        ),
+        client_factory=build_openai_client,
+    ):
+        """
+        Initialize an empty OpenAIClientPool.
+
+        Args:
+            max_size (int): Maximum number of pooled clients.
+            idle_timeout (float): Seconds after which an unused client is closed.
+            client_factory (callable): Builds a client from an API key.
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.client_factory = client_factory
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def _close(self, key):
+        self._clients.pop(key).client.close()
+
+    def _evict(self):
+        """
+        Close idle clients, then the least recently used ones beyond max_size.
+        """
+        now = time.monotonic()
+        for key, pooled_client in list(self._clients.items()):
+            if (
+                pooled_client.borrowers == 0
+                and now - pooled_client.last_used > self.idle_timeout
+            ):
+                self._close(key)
+        for key, pooled_client in list(self._clients.items()):
+            if len(self._clients) < self.max_size:
+                break
+            if pooled_client.borrowers == 0:
+                self._close(key)
+
+    @contextmanager
+    def borrow(self, api_key: str, model: str):
+        """
+        Borrow the client of an API key and model, building it if needed.
+
+        Args:
+            api_key (str): The API key of the client.
+            model (str): The model the client is used with.
+
+        Yields:
+            The OpenAI client, returned to the pool on exit.
+        """
+        key = (api_key, model)
+        with self._lock:
+            pooled_client = self._clients.get(key)
+            if pooled_client is None:
+                self._evict()
+                pooled_client = PooledClient(self.client_factory(api_key))
+                self._clients[key] = pooled_client
+            self._clients.move_to_end(key)
+            pooled_client.borrowers += 1
+        try:
+            yield pooled_client.client
+        finally:
+            with self._lock:
+                pooled_client.borrowers -= 1
+                pooled_client.last_used = time.monotonic()
+
+    def close(self):
+        """
+        Close every client of the pool.
+        """
+        with self._lock:
+            for key in list(self._clients):
+                self._close(key)
+
+
+openai_client_pool = OpenAIClientPool()
@@ -0,0 +1,115 @@
+from backend.configuration import global_config
+import math
+import threading
+
+
+class OutputBudget:
+    """
+    Controls the output token budget of summary requests.
+
+    Output tokens dominate the latency of a completion, so each request is allowed a
+    budget proportional to the tokens of its input, targeting a compression ratio and
+    bounded on both sides. The budgets and the output tokens actually used are
+    recorded, along with the requests cut short by their budget.
+
+    Attributes:
+        compression_ratio (float): Target ratio of output to input tokens.
+        min_tokens (int): Lower bound of a budget, so short inputs are not cut short.
+        max_tokens (int): Upper bound of a budget.
+        requests (int): Number of recorded requests.
+        budgeted_tokens (int): Sum of the budgets of the recorded requests.
+        output_tokens (int): Sum of the output tokens of the recorded requests.
+        truncated (int): Number of recorded requests that exhausted their budget.
+    """
+
+    def __init__(
+        self,
+        compression_ratio: float = global_config.getfloat(
+            "OpenAI", "COMPRESSION_RATIO", fallback=0.25
+        ),
+        min_tokens: int = global_config.getint(
+            "OpenAI", "MIN_OUTPUT_TOKENS", fallback=64
+        ),
+        max_tokens: int = global_config.getint(
+            "OpenAI", "MAX_OUTPUT_TOKENS", fallback=1024
+        ),
+    ):
+        """
+        Initialize the OutputBudget.
+
+        Args:
+            compression_ratio (float): Target ratio of output to input tokens.
+            min_tokens (int): Lower bound of a budget.
+            max_tokens (int): Upper bound of a budget.
+
+        Raises:
+            ValueError: If the ratio is not positive or the bounds are inconsistent.
+        """
+        if compression_ratio <= 0 or not 0 < min_tokens <= max_tokens:
+            raise ValueError(
+                "compression_ratio must be positive and 0 < min_tokens <= max_tokens"
+            )
+        self.compression_ratio = compression_ratio
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.requests = 0
+        self.budgeted_tokens = 0
+        self.output_tokens = 0
+        self.truncated = 0
+        self._lock = threading.Lock()
+
+    def budget(self, input_tokens: int, max_tokens: int = None) -> int:
+        """
+        Compute the output budget of a request.
+
+        Args:
+            input_tokens (int): Number of tokens of the text to summarise.
+            max_tokens (int, optional): Upper bound overriding the configured one,
+                e.g. the target length of a summary.
+
+        Returns:
+            int: The maximum number of output tokens of the request.
+        """
+        budget = math.ceil(input_tokens * self.compression_ratio)
+        # a summary is never allowed to be longer than its input
+        budget = max(budget, min(self.min_tokens, input_tokens))
+        budget = min(budget, self.max_tokens)
+        if max_tokens is not None:
+            budget = min(budget, max_tokens)
+        return max(budget, 1)
+
+    def record(self, budgeted_tokens: int, output_tokens: int, truncated: bool):
+        """
+        Record the output tokens used by a request.
+
+        Args:
+            budgeted_tokens (int): The budget of the request.
+            output_tokens (int): The output tokens used by the request.
+            truncated (bool): Whether the output was cut short by the budget.
+        """
+        with self._lock:
+            self.requests += 1
+            self.budgeted_tokens += budgeted_tokens
+            self.output_tokens += output_tokens
+            self.truncated += truncated
+
+    def stats(self) -> dict:
+        """
+        Get the usage recorded so far.
+
+        Returns:
+            dict: Requests, budgeted and output tokens, truncated requests, and the
+                fraction of the budgets used.
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "budgeted_tokens": self.budgeted_tokens,
+                "output_tokens": self.output_tokens,
+                "truncated": self.truncated,
+                "utilisation": (
+                    self.output_tokens / self.budgeted_tokens
+                    if self.budgeted_tokens
+                    else 0.0
+                ),
+            }
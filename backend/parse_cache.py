@@ -0,0 +1,322 @@
+from collections import OrderedDict
+from backend.configuration import global_config
+from backend.parser import ParserFactory, PARSER_VERSION
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+
+
+class MemoryCacheTier:
+    """
+    Bounded in-process LRU tier of the parse cache.
+
+    Attributes:
+        max_bytes (int): Maximum total size of the cached texts.
+        current_bytes (int): Current total size of the cached texts.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Initialize the MemoryCacheTier.
+
+        Args:
+            max_bytes (int): Maximum total size of the cached texts.
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        Get a cached text and mark it as most recently used.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            str | None: The cached text, or None on a miss.
+        """
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def put(self, key: str, text: str):
+        """
+        Cache a text, evicting the least recently used texts to stay in bounds.
+
+        Texts larger than the whole tier are not cached.
+
+        Args:
+            key (str): The cache key.
+            text (str): The text to be cached.
+        """
+        size = sys.getsizeof(text)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= sys.getsizeof(self._entries.pop(key))
+            self._entries[key] = text
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= sys.getsizeof(evicted)
+
+
+class DiskCacheTier:
+    """
+    Persistent on-disk tier of the parse cache, shared by every process of a host.
+
+    Entries are evicted least recently used first, based on file modification time,
+    once the total size of the tier exceeds max_bytes.
+
+    Attributes:
+        path (str): Directory holding the cached texts.
+        max_bytes (int): Maximum total size of the cached texts.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        """
+        Initialize the DiskCacheTier, creating its directory if needed.
+
+        Args:
+            path (str): Directory holding the cached texts.
+            max_bytes (int): Maximum total size of the cached texts.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key + ".txt")
+
+    def get(self, key: str):
+        """
+        Get a cached text and mark it as most recently used.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            str | None: The cached text, or None on a miss.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, "r", encoding="utf-8") as entry:
+                text = entry.read()
+            os.utime(entry_path)
+        except FileNotFoundError:
+            # the entry may also have been evicted by another process meanwhile
+            return None
+        return text
+
+    def put(self, key: str, text: str):
+        """
+        Cache a text, then evict the least recently used texts to stay in bounds.
+
+        Args:
+            key (str): The cache key.
+            text (str): The text to be cached.
+        """
+        # write to a temporary file first so readers never see partial entries
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as entry:
+            entry.write(text)
+        os.replace(temp_path, self._entry_path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the tier fits in max_bytes.
+        """
+        entries = []
+        total_bytes = 0
+        with os.scandir(self.path) as directory:
+            for entry in directory:
+                if not entry.name.endswith(".txt"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_bytes += stat.st_size
+        entries.sort()
+        for _, size, entry_path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+
+class ParseCache:
+    """
+    Content-addressed cache of parsed documents.
+
+    Parsed texts are keyed by the SHA-256 of the uploaded bytes, the file type and
+    the parser version, and looked up in a memory tier first and a disk tier second.
+    A hit on either tier skips parsing entirely.
+
+    Attributes:
+        memory_tier (MemoryCacheTier): The in-process LRU tier.
+        disk_tier (DiskCacheTier | None): The persistent tier, if enabled.
+        memory_hits (int): Number of lookups served by the memory tier.
+        disk_hits (int): Number of lookups served by the disk tier.
+        misses (int): Number of lookups that required parsing.
+    """
+
+    def __init__(self, memory_tier, disk_tier=None):
+        """
+        Initialize the ParseCache.
+
+        Args:
+            memory_tier (MemoryCacheTier): The in-process LRU tier.
+            disk_tier (DiskCacheTier, optional): The persistent tier.
+        """
+        self.memory_tier = memory_tier
+        self.disk_tier = disk_tier
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def build_key(digest: str, file_type: str) -> str:
+        """
+        Build the cache key of a document.
+
+        Args:
+            digest (str): Hex SHA-256 digest of the document bytes.
+            file_type (str): The type of the document.
+
+        Returns:
+            str: The cache key.
+        """
+        return f"{PARSER_VERSION}-{file_type}-{digest}"
+
+    def get(self, key: str):
+        """
+        Look a parsed text up in the memory tier, then in the disk tier.
+
+        Disk hits are promoted to the memory tier.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            str | None: The cached text, or None on a miss.
+        """
+        text = self.memory_tier.get(key)
+        if text is not None:
+            self.memory_hits += 1
+            return text
+        if self.disk_tier is not None:
+            text = self.disk_tier.get(key)
+            if text is not None:
+                self.disk_hits += 1
+                self.memory_tier.put(key, text)
+                return text
+        self.misses += 1
+        return None
+
+    def put(self, key: str, text: str):
+        """
+        Store a parsed text in every tier.
+
+        Args:
+            key (str): The cache key.
+            text (str): The parsed text.
+        """
+        self.memory_tier.put(key, text)
+        if self.disk_tier is not None:
+            self.disk_tier.put(key, text)
+
+    def get_or_parse(self, source, file_extension: str, digest: str = None) -> str:
+        """
+        Get the parsed text of a document from the cache, parsing it on a miss.
+
+        Args:
+            source: The document content, as bytes or a binary file object. The
+                content is always read from the object, never opened by its name.
+            file_extension (str): The extension of the document.
+            digest (str, optional): Hex SHA-256 digest of the document content,
+                computed from the source if not given.
+
+        Returns:
+            str: The parsed text of the document.
+
+        Raises:
+            NotImplementedError: If the file type is not supported.
+        """
+        parser_factory = ParserFactory(source, file_extension)
+        file_type = parser_factory.detect_file_type()
+        if digest is None:
+            if isinstance(source, (bytes, bytearray)):
+                digest = hashlib.sha256(source).hexdigest()
+            else:
+                hash_object = hashlib.sha256()
+                source.seek(0)
+                while chunk := source.read(1024 * 1024):
+                    hash_object.update(chunk)
+                digest = hash_object.hexdigest()
+        key = ParseCache.build_key(digest, file_type)
+        text = self.get(key)
+        if text is None:
+            text = parser_factory.build().read()
+            self.put(key, text)
+        return text
+
+    def stats(self) -> dict:
+        """
+        Get the hit and miss counters of the cache.
+
+        Returns:
+            dict: Hits per tier, misses and the overall hit rate.
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0,
+        }
+
+
+def build_parse_cache(
+    memory_max_bytes: int = global_config.getint(
+        "ParseCache", "MEMORY_MAX_BYTES", fallback=64 * 1024 * 1024
+    ),
+    disk_path: str = global_config.get(
+        "ParseCache",
+        "DISK_PATH",
+        fallback=os.path.join(tempfile.gettempdir(), "pdf_gpt_parse_cache"),
+    ),
+    disk_max_bytes: int = global_config.getint(
+        "ParseCache", "DISK_MAX_BYTES", fallback=1024 * 1024 * 1024
+    ),
+) -> ParseCache:
+    """
+    Build a ParseCache from the configuration.
+
+    Args:
+        memory_max_bytes (int): Maximum size of the memory tier.
+        disk_path (str): Directory of the disk tier.
+        disk_max_bytes (int): Maximum size of the disk tier, 0 disables it.
+
+    Returns:
+        ParseCache: The configured parse cache.
+    """
+    disk_tier = None
+    if disk_max_bytes > 0:
+        disk_tier = DiskCacheTier(disk_path, disk_max_bytes)
+    return ParseCache(MemoryCacheTier(memory_max_bytes), disk_tier)
+
+
+parse_cache = build_parse_cache()
@@ -1,44 +1,173 @@
-from docx import Document
 from abc import ABC, abstractmethod
-import fitz
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+from backend.configuration import global_config
+from xml.etree.ElementTree import iterparse
+import codecs
 import io
+import math
+import os
+import re
+import tempfile
+import threading
+import zipfile
+
+# Bump whenever a change to the parsers changes the text they extract, so that
+# cached parse results from older versions are not served anymore
+PARSER_VERSION = "5"
+
+# Separates the pages of the parsed text of paginated documents
+PAGE_BREAK = "\f"
+
+# WordprocessingML namespaces of the transitional and strict OOXML flavours
+WORDPROCESSINGML_NAMESPACES = (
+    "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}",
+    "{http://purl.oclc.org/ooxml/wordprocessingml/main}",
+)
+DOCX_BODY_PART = "word/document.xml"
+DOCX_HEADER_PART = re.compile(r"word/header\d*\.xml")
+DOCX_NOTES_PARTS = ("word/footnotes.xml", "word/endnotes.xml")
+DOCX_FOOTER_PART = re.compile(r"word/footer\d*\.xml")
+
+
+# Number of leading bytes file type detection looks at
+SNIFF_SIZE = 8 * 1024
+
+
+class ParserRegistration(NamedTuple):
+    """
+    Registration of a parser for a file type.
+
+    Attributes:
+        parser_class (type): The parser class.
+        extensions (tuple): Lowercase file extensions of the file type.
+        sniffer (callable | None): Function telling from a rewound binary stream
+            whether the content is of the file type.
+    """
+
+    parser_class: type
+    extensions: tuple
+    sniffer: object = None
+
+
+# file type -> ParserRegistration, in registration order
+PARSER_REGISTRY = {}
+
+
+def register_parser(file_type: str, extensions, sniffer=None):
+    """
+    Class decorator registering a parser for a file type.
+
+    Args:
+        file_type (str): Name of the file type.
+        extensions (iterable): File extensions of the file type.
+        sniffer (callable, optional): Function telling from a rewound binary stream
+            whether the content is of the file type.
+
+    Returns:
+        callable: The decorator.
+    """
+
+    def decorator(parser_class):
+        PARSER_REGISTRY[file_type] = ParserRegistration(
+            parser_class, tuple(extension.lower() for extension in extensions), sniffer
+        )
+        return parser_class
+
+    return decorator
+
+
+def open_stream(source):
+    """
+    Get content as a rewound binary stream, without copying it.
+
+    Args:
+        source: The content, as bytes or a binary file object.
+
+    Returns:
+        A binary file object over the content.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    source.seek(0)
+    return source
+
+
+def looks_like_text(prefix: bytes) -> bool:
+    """
+    Tell whether content looks like text from its first bytes.
+
+    Args:
+        prefix (bytes): The first bytes of the content.
+
+    Returns:
+        bool: False if the prefix holds NUL bytes outside of a UTF-16/32 text.
+    """
+    return b"\x00" not in prefix or sniff_encoding(prefix) in ("utf-16", "utf-32")
 
 
 class ParserFactory:
     """
-    Factory class to create parsers based on file extension.
+    Factory class to create parsers based on file content and extension.
+
+    The file type is detected from the magic bytes of the content, with the file
+    extension as a fallback. Content without an extension that looks like text is
+    parsed as text.
     """
 
-    def __init__(self, file_like_object, file_extension):
+    def __init__(self, file_like_object, file_extension, path: str = None):
         """
         Initialize the ParserFactory with a file-like object and its extension.
 
         Args:
             file_like_object: The file-like object to be parsed.
             file_extension (str): The extension of the file to determine the parser type.
+            path (str, optional): Path of a file holding the same content, passed on
+                to the parser.
         """
 
         self.file_like_object = file_like_object
         self.file_extension = file_extension
+        self.path = path
+
+    def detect_file_type(self) -> str:
+        """
+        Detect the type of the file.
+
+        Returns:
+            str: The detected file type.
+
+        Raises:
+            NotImplementedError: If the file type is not supported.
+        """
+        for file_type, registration in PARSER_REGISTRY.items():
+            if registration.sniffer is not None and registration.sniffer(
+                open_stream(self.file_like_object)
+            ):
+                return file_type
+        file_extension = (self.file_extension or "").lower()
+        for file_type, registration in PARSER_REGISTRY.items():
+            if file_extension in registration.extensions:
+                return file_type
+        if not file_extension and looks_like_text(
+            open_stream(self.file_like_object).read(SNIFF_SIZE)
+        ):
+            return "txt"
+        raise NotImplementedError
 
     def build(self):
         """
-        Build and return the appropriate parser based on the file extension.
+        Build and return the appropriate parser based on the detected file type.
 
         Returns:
-            Parser: An instance of the appropriate parser based on the file extension.
+            Parser: An instance of the appropriate parser for the file type.
 
         Raises:
-            NotImplementedError: If the file extension is not supported.
-        """
-        if self.file_extension == "docx":
-            return DocxParser(self.file_like_object)
-        elif self.file_extension == "txt":
-            return TxtParser(self.file_like_object)
-        elif self.file_extension == "pdf":
-            return PDFParser(self.file_like_object)
-        else:
-            raise NotImplementedError
+            NotImplementedError: If the file type is not supported.
+        """
+        return PARSER_REGISTRY[self.detect_file_type()].parser_class(
+            self.file_like_object, path=self.path
+        )
 
 
 class Parser(ABC):
@@ -46,84 +175,538 @@ class Parser(ABC):
     Abstract base class for file parsers.
     """
 
-    def __init__(self, file_like_object):
+    def __init__(self, file_like_object, path: str = None):
         """
         Initialize the Parser with a file-like object.
 
         Args:
             file_like_object: The file-like object to be parsed.
+            path (str, optional): Path of a file holding the same content, which
+                parsers may open instead of reading the file-like object. Only ever
+                given by the owner of the file, never taken from the file-like
+                object, whose name may come from the client.
         """
         self.file_like_object = file_like_object
+        self.path = path
+
+    def _open_stream(self):
+        """
+        Get the content to be parsed as a rewound binary stream, without copying it.
+
+        Returns:
+            A binary file object over the content to be parsed.
+        """
+        return open_stream(self.file_like_object)
 
     @abstractmethod
-    def read(self):
+    def iter_pages(self):
         """
-        Abstract method to read and parse the file content.
+        Abstract method to lazily parse the file content page by page.
+
+        Yields:
+            str: The text content of the next page of the file.
         """
         raise NotImplementedError
 
+    def iter_blocks(self):
+        """
+        Lazily parse the file content in blocks finer grained than pages.
+
+        Parsers without a natural notion of blocks fall back to their pages.
 
+        Yields:
+            str: The text content of the next block of the file.
+        """
+        yield from self.iter_pages()
+
+    def read(self):
+        """
+        Read and parse the whole file content.
+
+        Returns:
+            str: The parsed text content of the file.
+        """
+        return "".join(self.iter_pages())
+
+
+def iter_ooxml_paragraphs(xml_stream, skip_empty: bool = False):
+    """
+    Incrementally parse the paragraphs of a WordprocessingML part in document order.
+
+    Every row of a table is yielded as one paragraph with its cells tab separated.
+    Processed elements are discarded as parsing goes, so memory use does not grow
+    with the size of the part.
+
+    Args:
+        xml_stream: Binary file object over the XML part.
+        skip_empty (bool): Whether to leave out empty paragraphs.
+
+    Yields:
+        str: The text of the next paragraph or table row.
+    """
+    # text of the paragraphs being parsed, nested for text boxes
+    paragraphs = []
+    # cells of the table rows being parsed, nested for nested tables
+    rows = []
+    cells = []
+    # depth of the runs being parsed, as tabs outside runs are tab stop definitions
+    runs = 0
+    body = None
+    for event, element in iterparse(xml_stream, events=("start", "end")):
+        namespace, _, tag = element.tag.rpartition("}")
+        if namespace + "}" not in WORDPROCESSINGML_NAMESPACES:
+            continue
+        if event == "start":
+            if tag == "p":
+                paragraphs.append([])
+            elif tag == "tr":
+                rows.append([])
+            elif tag == "tc":
+                cells.append([])
+            elif tag == "r":
+                runs += 1
+            elif tag == "body":
+                body = element
+            continue
+
+        if tag == "t" and paragraphs:
+            paragraphs[-1].append(element.text or "")
+        elif tag == "tab" and runs and paragraphs:
+            paragraphs[-1].append("\t")
+        elif tag in ("br", "cr") and paragraphs:
+            paragraphs[-1].append("\n")
+        elif tag == "r":
+            runs -= 1
+            continue
+        elif tag == "p":
+            text = "".join(paragraphs.pop())
+            if cells:
+                cells[-1].append(text)
+            elif text or not skip_empty:
+                yield text
+        elif tag == "tc":
+            rows[-1].append("\n".join(cells.pop()))
+        elif tag == "tr":
+            text = "\t".join(rows.pop())
+            if cells:
+                cells[-1].append(text)
+            elif text.strip() or not skip_empty:
+                yield text
+        else:
+            continue
+        element.clear()
+        if body is not None and not paragraphs and not rows:
+            # drop the top level elements already processed
+            body.clear()
+
+
+def is_docx(file_stream) -> bool:
+    """
+    Tell whether content is a .docx file from its zip magic bytes and main part.
+
+    Args:
+        file_stream: Rewound binary stream over the content.
+
+    Returns:
+        bool: True if the content is a .docx file.
+    """
+    if file_stream.read(4) != b"PK\x03\x04":
+        return False
+    file_stream.seek(0)
+    try:
+        # only reads the central directory at the end of the archive
+        with zipfile.ZipFile(file_stream) as archive:
+            return DOCX_BODY_PART in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+
+
+@register_parser("docx", ["docx"], is_docx)
 class DocxParser(Parser):
     """
     Parser class for .docx files.
+
+    The WordprocessingML parts are read straight from the zip archive and parsed
+    incrementally. Headers come first, then the body, footnotes, endnotes and
+    footers. A .docx file has no fixed pagination, so every paragraph is treated
+    as a page.
     """
 
-    def read(self):
+    def iter_blocks(self):
         """
-        Read and parse the content of a .docx file.
+        Lazily parse the paragraphs and table rows of a .docx file.
 
-        Returns:
-            str: The parsed text content of the .docx file.
+        Yields:
+            str: The text content of the next paragraph of the .docx file.
+        """
+        with zipfile.ZipFile(self._open_stream()) as archive:
+            part_names = archive.namelist()
+            parts = (
+                [name for name in part_names if DOCX_HEADER_PART.fullmatch(name)]
+                + [DOCX_BODY_PART]
+                + [name for name in DOCX_NOTES_PARTS if name in part_names]
+                + [name for name in part_names if DOCX_FOOTER_PART.fullmatch(name)]
+            )
+            for part in parts:
+                with archive.open(part) as xml_stream:
+                    # empty paragraphs are kept in the body only, the other parts
+                    # are full of them, e.g. footnote separators
+                    yield from iter_ooxml_paragraphs(
+                        xml_stream, skip_empty=part != DOCX_BODY_PART
+                    )
+
+    def iter_pages(self):
+        """
+        Lazily parse the content of a .docx file.
+
+        Yields:
+            str: The text content of the next paragraph, newline separated from
+                the paragraph before it.
         """
-        file_stream = io.BytesIO(self.file_like_object)
-        doc = Document(file_stream)
-        text = "\n".join(paragraph.text for paragraph in doc.paragraphs)
-        return text
+        blocks = self.iter_blocks()
+        yield next(blocks, "")
+        for block in blocks:
+            yield "\n" + block
+
+
+def sniff_encoding(prefix: bytes) -> str:
+    """
+    Guess the encoding of a text file from the first bytes of its content.
+
+    Byte order marks take precedence. Otherwise the prefix is tried as UTF-8, then
+    as Windows-1252, and Latin-1 is the last resort as it can decode any byte.
 
+    Args:
+        prefix (bytes): The first bytes of the text file.
 
+    Returns:
+        str: The name of the guessed encoding.
+    """
+    # the UTF-32 LE byte order mark starts with the UTF-16 LE one, so check it first
+    if prefix.startswith((codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE)):
+        return "utf-32"
+    if prefix.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    if prefix.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    for encoding in ("utf-8", "cp1252"):
+        try:
+            # not final, the prefix may end in the middle of a character
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            pass
+    return "latin-1"
+
+
+@register_parser("txt", ["txt"])
 class TxtParser(Parser):
     """
     Parser class for .txt files.
+
+    The content is decoded incrementally in fixed-size blocks, so memory use does
+    not depend on the size of the file. The encoding is sniffed from a prefix of
+    the content.
     """
 
-    def read(self):
+    def __init__(
+        self,
+        file_like_object,
+        path: str = None,
+        block_size: int = global_config.getint(
+            "Parser", "TXT_BLOCK_SIZE", fallback=1024 * 1024
+        ),
+        sniff_size: int = 64 * 1024,
+    ):
         """
-        Read and parse the content of a .txt file.
+        Initialize the TxtParser with a file-like object.
 
-        Returns:
-            str: The parsed text content of the .txt file.
+        Args:
+            file_like_object: The file-like object to be parsed.
+            path (str, optional): Path of a file holding the same content.
+            block_size (int): Number of bytes decoded at a time.
+            sniff_size (int): Number of leading bytes the encoding is sniffed from.
+        """
+        super().__init__(file_like_object, path)
+        self.block_size = block_size
+        self.sniff_size = sniff_size
+
+    def iter_pages(self):
+        """
+        Lazily parse the content of a .txt file block by block.
+
+        Yields:
+            str: The decoded text of the next block of the .txt file.
+        """
+        file_stream = self._open_stream()
+        prefix = file_stream.read(max(self.block_size, self.sniff_size))
+        encoding = sniff_encoding(prefix[: self.sniff_size])
+        # bytes the sniffed prefix did not cover may still be invalid
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        block = prefix
+        while block:
+            text = decoder.decode(block)
+            if text:
+                yield text
+            block = file_stream.read(self.block_size)
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+
+    def iter_blocks(self):
+        """
+        Lazily parse the lines of a .txt file.
+
+        Yields:
+            str: The next line of the .txt file, including its line ending.
         """
-        return self.file_like_object.decode()
+        incomplete_line = ""
+        for page in self.iter_pages():
+            lines = (incomplete_line + page).splitlines(keepends=True)
+            # the last line may continue in the next block
+            incomplete_line = lines.pop()
+            yield from lines
+        if incomplete_line:
+            yield incomplete_line
 
 
+def is_pdf(file_stream) -> bool:
+    """
+    Tell whether content is a .pdf file from its magic bytes.
+
+    Args:
+        file_stream: Rewound binary stream over the content.
+
+    Returns:
+        bool: True if the content is a .pdf file.
+    """
+    # the header does not have to be at the very start of the file
+    return b"%PDF-" in file_stream.read(1024)
+
+
+def open_pdf(source):
+    """
+    Open a PDF document from its content or from its path on disk.
+
+    Args:
+        source (bytes | str): The PDF document content, or its path.
+
+    Returns:
+        fitz.Document: The opened PDF document.
+    """
+    # imported on first use, loading PyMuPDF slows down the start of every process
+    import fitz
+
+    if isinstance(source, str):
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=source, filetype="pdf")
+
+
+# Worker processes extracting the pages of large PDF documents, shared by all the
+# parsers of the process
+_page_executor = None
+_page_executor_workers = 0
+_page_executor_pid = None
+_page_executor_lock = threading.Lock()
+
+
+def get_page_executor(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Get the process pool extracting the pages of PDF documents, starting it on first
+    use.
+
+    The pool is kept for the lifetime of the process so that worker processes, and
+    PyMuPDF loaded in them, are reused across parses. It is started again if the
+    number of workers changes, or in a forked child which cannot use the pool of its
+    parent.
+
+    Args:
+        max_workers (int): Number of worker processes.
+
+    Returns:
+        ProcessPoolExecutor: The process pool.
+    """
+    global _page_executor, _page_executor_workers, _page_executor_pid
+    with _page_executor_lock:
+        if _page_executor_pid != os.getpid():
+            _page_executor = None
+        if _page_executor is None or _page_executor_workers != max_workers:
+            if _page_executor is not None:
+                # slices already submitted by other parsers still complete
+                _page_executor.shutdown(wait=False)
+            _page_executor = ProcessPoolExecutor(max_workers=max_workers)
+            _page_executor_workers = max_workers
+            _page_executor_pid = os.getpid()
+        return _page_executor
+
+
+def extract_page_range(source, start: int, stop: int):
+    """
+    Extract the text of a contiguous range of pages of a PDF document.
+
+    Runs inside a worker process of the parallel extraction pool, so it opens its
+    own handle on the document.
+
+    Args:
+        source (bytes | str): The PDF document content, or its path.
+        start (int): Index of the first page to extract.
+        stop (int): Index one past the last page to extract.
+
+    Returns:
+        list: The text content of each page in the range, in order.
+    """
+    doc = open_pdf(source)
+    try:
+        return [doc[page_number].get_text() for page_number in range(start, stop)]
+    finally:
+        doc.close()
+
+
+@register_parser("pdf", ["pdf"], is_pdf)
 class PDFParser(Parser):
     """
-    Parser class for .txt files.
+    Parser class for .pdf files.
+
+    Documents with at least parallel_page_threshold pages are extracted by a pool
+    of worker processes, each handling a contiguous slice of the page range.
     """
 
-    def read(self):
+    def __init__(
+        self,
+        file_like_object,
+        path: str = None,
+        parallel_page_threshold: int = global_config.getint(
+            "Parser", "PARALLEL_PAGE_THRESHOLD", fallback=200
+        ),
+        parallel_workers: int = global_config.getint(
+            "Parser", "PARALLEL_WORKERS", fallback=os.cpu_count() or 1
+        ),
+    ):
+        """
+        Initialize the PDFParser with a file-like object.
+
+        Args:
+            file_like_object: The file-like object to be parsed.
+            path (str, optional): Path of a file holding the same content, opened
+                instead of reading the file-like object into memory.
+            parallel_page_threshold (int): Minimum page count for which extraction
+                is parallelised across processes.
+            parallel_workers (int): Number of worker processes used for parallel
+                extraction. Parallel extraction is disabled if less than 2.
         """
-        Read and parse the content of a .pdf file.
+        super().__init__(file_like_object, path)
+        self.parallel_page_threshold = parallel_page_threshold
+        self.parallel_workers = parallel_workers
+
+    def _source(self):
+        """
+        Get the PDF document as something fitz can open without extra copies.
 
         Returns:
-            str: The parsed text content of the .pdf file.
+            bytes | str: The document content, or its path if it was given.
         """
+        if self.path is not None:
+            return self.path
+        if isinstance(self.file_like_object, (bytes, bytearray)):
+            return bytes(self.file_like_object)
+        if isinstance(self.file_like_object, io.BytesIO):
+            # getvalue shares the buffer of the BytesIO instead of copying it
+            return self.file_like_object.getvalue()
+        return self._open_stream().read()
+
+    def _open(self):
         """
-        Read and parse the content of a .pdf file.
+        Open the PDF document held by the parser.
 
         Returns:
-            str: The parsed text content of the .pdf file.
-        """
-        file_stream = self.file_like_object  # Assuming this is a file-like object
-        # Open the PDF file
-        doc = fitz.open(stream=file_stream, filetype="pdf")
-        text = ""
-        # Iterate through each page of the PDF
-        for page in doc:
-            # Extract text from the page and add it to the text variable
-            text += page.get_text()
-
-        # Close the document after reading
-        doc.close()
+            fitz.Document: The opened PDF document.
+        """
+        return open_pdf(self._source())
 
-        return text
+    def iter_pages(self):
+        """
+        Lazily parse the content of a .pdf file page by page.
+
+        Yields:
+            str: The text content of the next page of the .pdf file.
+        """
+        doc = self._open()
+        try:
+            page_count = doc.page_count
+            if self.parallel_workers < 2 or page_count < self.parallel_page_threshold:
+                for page in doc:
+                    yield page.get_text()
+                return
+        finally:
+            # Close the document even if the consumer stops iterating early
+            doc.close()
+        yield from self._iter_pages_parallel(page_count)
+
+    def read(self):
+        """
+        Read and parse the whole content of a .pdf file.
+
+        Returns:
+            str: The text content of the pages, separated by PAGE_BREAK so that
+                page boundaries survive parsing.
+        """
+        return PAGE_BREAK.join(self.iter_pages())
+
+    def _iter_pages_parallel(self, page_count: int):
+        """
+        Extract pages across a pool of worker processes.
+
+        The page range is cut into more slices than workers so that the first
+        pages are available early and slow slices do not leave workers idle.
+        Workers are given the path of the document rather than its content, so a
+        document held in memory is spooled to a temporary file once instead of
+        being pickled to every slice.
+
+        Args:
+            page_count (int): Number of pages of the document.
+
+        Yields:
+            str: The text content of the next page of the .pdf file, in order.
+        """
+        source = self._source()
+        spooled_path = None
+        if not isinstance(source, str):
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spooled:
+                spooled.write(source)
+            source = spooled_path = spooled.name
+        try:
+            slice_size = math.ceil(page_count / (self.parallel_workers * 4))
+            starts = range(0, page_count, slice_size)
+            stops = [min(start + slice_size, page_count) for start in starts]
+            executor = get_page_executor(self.parallel_workers)
+            page_slices = [
+                executor.submit(extract_page_range, source, start, stop)
+                for start, stop in zip(starts, stops)
+            ]
+            try:
+                for page_slice in page_slices:
+                    yield from page_slice.result()
+            finally:
+                # the consumer may stop early, leave the pool to other parses
+                for page_slice in page_slices:
+                    page_slice.cancel()
+        finally:
+            if spooled_path is not None:
+                os.remove(spooled_path)
+
+    def iter_blocks(self):
+        """
+        Lazily parse the text blocks of a .pdf file in reading order.
+
+        Yields:
+            str: The text content of the next text block of the .pdf file.
+        """
+        doc = self._open()
+        try:
+            for page in doc:
+                for block in page.get_text("blocks", sort=True):
+                    # block type 0 is text, 1 is image
+                    if block[6] == 0:
+                        yield block[4]
+        finally:
+            doc.close()
@@ -0,0 +1,334 @@
+from backend.configuration import global_config
+from kombu.exceptions import OperationalError
+import os
+import threading
+import time
+
+
+class PooledPublisher:
+    """
+    A broker connection of the publisher pool, with its producer.
+
+    Attributes:
+        connection (kombu.Connection): The broker connection.
+        producer (kombu.Producer): The producer publishing on the connection.
+        created_at (float): Monotonic time the connection was opened.
+        last_checked (float): Monotonic time of the last health check.
+        publishes (int): Number of messages published on the connection.
+    """
+
+    def __init__(self, connection, producer, created_at: float):
+        self.connection = connection
+        self.producer = producer
+        self.created_at = created_at
+        self.last_checked = created_at
+        self.publishes = 0
+
+
+class PublisherPool:
+    """
+    Bounded pool of broker connections and producers publishing task messages.
+
+    Opening a connection with publisher confirms for every message costs tens of
+    milliseconds, while keeping connections forever is what leaks memory with the
+    broker pool of celery. Connections are therefore reused, but recycled after
+    max_publishes messages or max_age seconds. Connections idle for more than
+    health_check_interval seconds are checked before being reused, and a publish
+    failing on a broken connection is retried once on a new connection. Connections
+    are dropped when the process forks, as they cannot be shared with the child.
+
+    A publish failing on a broken connection may still have reached the broker, so
+    a retried message can be delivered twice: tasks published through the pool
+    must be idempotent, and the senders must not retry on their own.
+
+    Attributes:
+        connection_factory (callable): Opens a broker connection.
+        producer_factory (callable): Builds the producer of a connection.
+        max_connections (int): Maximum number of open connections.
+        health_check_interval (float): Seconds after which idle connections are
+            checked before being reused.
+        max_publishes (int): Number of messages after which connections are recycled.
+        max_age (float): Seconds after which connections are recycled.
+        acquire_timeout (float): Seconds to wait for a free connection.
+        created (int): Number of connections opened.
+        reused (int): Number of publishes on an already open connection.
+        recycled (int): Number of connections closed for their age or publishes.
+        unhealthy (int): Number of connections closed by a failed health check.
+        failures (int): Number of publishes failed by a broken connection.
+        publishes (int): Number of messages published.
+    """
+
+    def __init__(
+        self,
+        connection_factory,
+        producer_factory,
+        max_connections: int = global_config.getint(
+            "PublisherPool", "MAX_CONNECTIONS", fallback=4
+        ),
+        health_check_interval: float = global_config.getfloat(
+            "PublisherPool", "HEALTH_CHECK_INTERVAL", fallback=30
+        ),
+        max_publishes: int = global_config.getint(
+            "PublisherPool", "MAX_PUBLISHES", fallback=10000
+        ),
+        max_age: float = global_config.getfloat(
+            "PublisherPool", "MAX_AGE", fallback=3600
+        ),
+        acquire_timeout: float = global_config.getfloat(
+            "PublisherPool", "ACQUIRE_TIMEOUT", fallback=10
+        ),
+        clock=time.monotonic,
+    ):
+        """
+        Initialize the PublisherPool, connections are opened when first needed.
+
+        Args:
+            connection_factory (callable): Opens a broker connection.
+            producer_factory (callable): Builds the producer of a connection.
+            max_connections (int): Maximum number of open connections.
+            health_check_interval (float): Seconds after which idle connections are
+                checked before being reused.
+            max_publishes (int): Number of messages after which connections are
+                recycled.
+            max_age (float): Seconds after which connections are recycled.
+            acquire_timeout (float): Seconds to wait for a free connection.
+            clock (callable): Monotonic clock, in seconds.
+
+        Raises:
+            ValueError: If max_connections is not positive.
+        """
+        if max_connections < 1:
+            raise ValueError("max_connections must be positive")
+        self.connection_factory = connection_factory
+        self.producer_factory = producer_factory
+        self.max_connections = max_connections
+        self.health_check_interval = health_check_interval
+        self.max_publishes = max_publishes
+        self.max_age = max_age
+        self.acquire_timeout = acquire_timeout
+        self.clock = clock
+        self.created = 0
+        self.reused = 0
+        self.recycled = 0
+        self.unhealthy = 0
+        self.failures = 0
+        self.publishes = 0
+        self._idle = []
+        self._size = 0
+        self._pid = os.getpid()
+        self._condition = threading.Condition()
+
+    def _reset_after_fork(self):
+        # the sockets of the parent must neither be used nor closed by the child
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+            self._size = 0
+
+    def _open(self) -> PooledPublisher:
+        connection = self.connection_factory()
+        try:
+            connection.ensure_connection(max_retries=1)
+            producer = self.producer_factory(connection)
+        except BaseException:
+            self._close(connection)
+            raise
+        with self._condition:
+            self.created += 1
+        return PooledPublisher(connection, producer, self.clock())
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            # the connection is discarded anyway
+            pass
+
+    def _is_reusable(self, publisher: PooledPublisher) -> bool:
+        now = self.clock()
+        if (
+            publisher.publishes >= self.max_publishes
+            or now - publisher.created_at >= self.max_age
+        ):
+            with self._condition:
+                self.recycled += 1
+            return False
+        if now - publisher.last_checked < self.health_check_interval:
+            return True
+        publisher.last_checked = now
+        try:
+            healthy = publisher.connection.connected
+            if healthy:
+                # raises if the broker missed its heartbeats
+                publisher.connection.heartbeat_check()
+        except Exception:
+            healthy = False
+        if not healthy:
+            with self._condition:
+                self.unhealthy += 1
+        return healthy
+
+    def acquire(self) -> PooledPublisher:
+        """
+        Take a connection out of the pool, opening one if none is idle.
+
+        Returns:
+            PooledPublisher: The connection, to be released or discarded.
+
+        Raises:
+            TimeoutError: If all the connections stay in use for acquire_timeout.
+        """
+        deadline = self.clock() + self.acquire_timeout
+        with self._condition:
+            self._reset_after_fork()
+            while not self._idle and self._size >= self.max_connections:
+                remaining = deadline - self.clock()
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    raise TimeoutError("No broker connection became free in time")
+            publisher = self._idle.pop() if self._idle else None
+            if publisher is None:
+                self._size += 1
+        if publisher is not None:
+            if self._is_reusable(publisher):
+                with self._condition:
+                    self.reused += 1
+                return publisher
+            # its slot is taken over by a new connection
+            self._close(publisher.connection)
+        try:
+            return self._open()
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, publisher: PooledPublisher):
+        """
+        Give a healthy connection back to the pool.
+
+        Args:
+            publisher (PooledPublisher): The connection.
+        """
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+            self._idle.append(publisher)
+            self._condition.notify()
+
+    def discard(self, publisher: PooledPublisher):
+        """
+        Close a broken connection and free its slot in the pool.
+
+        Args:
+            publisher (PooledPublisher): The connection.
+        """
+        self._close(publisher.connection)
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+            self._size -= 1
+            self._condition.notify()
+
+    def publish(self, send, attempts: int = 2):
+        """
+        Publish with a producer of the pool, retrying on a new connection if the
+        connection turns out to be broken.
+
+        As the failed attempt may have reached the broker, the message can be
+        delivered twice and the task it sends must be idempotent.
+
+        Args:
+            send (callable): Publishes with the producer it is given, without
+                retrying itself.
+            attempts (int): Maximum number of connections to try.
+
+        Returns:
+            The result of send.
+
+        Raises:
+            kombu.exceptions.OperationalError: If the last attempt failed to publish.
+        """
+        for attempt in range(attempts):
+            publisher = self.acquire()
+            connection_errors = (
+                OperationalError,
+                *publisher.connection.connection_errors,
+                *publisher.connection.channel_errors,
+            )
+            try:
+                result = send(publisher.producer)
+            except connection_errors:
+                self.discard(publisher)
+                with self._condition:
+                    self.failures += 1
+                if attempt == attempts - 1:
+                    raise
+                continue
+            except BaseException:
+                # the state of the channel is unknown
+                self.discard(publisher)
+                raise
+            publisher.publishes += 1
+            with self._condition:
+                self.publishes += 1
+            self.release(publisher)
+            return result
+
+    def close(self):
+        """
+        Close the idle connections of the pool.
+        """
+        with self._condition:
+            self._reset_after_fork()
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for publisher in idle:
+            self._close(publisher.connection)
+
+    def stats(self) -> dict:
+        """
+        Get the metrics of the pool.
+
+        Returns:
+            dict: Open and idle connections, and counts of opened, reused, recycled
+                and unhealthy connections, failed publishes and publishes.
+        """
+        with self._condition:
+            return {
+                "connections": self._size,
+                "idle": len(self._idle),
+                "created": self.created,
+                "reused": self.reused,
+                "recycled": self.recycled,
+                "unhealthy": self.unhealthy,
+                "failures": self.failures,
+                "publishes": self.publishes,
+            }
+
+
+def build_publisher_pool(
+    app,
+    max_connections: int = global_config.getint(
+        "PublisherPool", "MAX_CONNECTIONS", fallback=4
+    ),
+):
+    """
+    Build the publisher pool of a celery app from the configuration.
+
+    Args:
+        app (Celery): The celery app, whose broker settings the connections use.
+        max_connections (int): Maximum number of open connections, 0 to open a
+            connection for every message instead.
+
+    Returns:
+        PublisherPool | None: The publisher pool, None if disabled.
+    """
+    if max_connections < 1:
+        return None
+    return PublisherPool(
+        app.connection_for_write,
+        app.amqp.Producer,
+        max_connections=max_connections,
+    )
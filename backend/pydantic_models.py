@@ -23,8 +23,22 @@ class PasswordResetRequestModel(BaseModel):
     user_new_password: str
 
 
-class TaskCompletionNotification(BaseModel):
-    notification_auth: str
+class TaskCompletion(BaseModel):
     task_id: str
     generated_summary: None | str = None
     task_status: str
+    task_error: None | str = None
+    # output tokens budgeted for and used by the summary requests of the task
+    output_tokens_budgeted: None | int = None
+    output_tokens_used: None | int = None
+    truncated_requests: None | int = None
+    boilerplate_tokens_saved: None | int = None
+
+
+class TaskCompletionNotification(TaskCompletion):
+    notification_auth: str
+
+
+class TaskCompletionNotifications(BaseModel):
+    notification_auth: str
+    notifications: list[TaskCompletion]
@@ -0,0 +1,268 @@
+from backend.configuration import global_config
+from backend.models import RateLimitBucket
+from mongoengine.errors import NotUniqueError
+import hashlib
+import openai
+import random
+import threading
+import time
+
+# errors worth retrying: rate limits, server errors and network failures
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+)
+
+
+class LocalBucketStore:
+    """
+    Token bucket store local to a process.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty LocalBucketStore.
+        """
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, bucket_key: str, amount: float, capacity: float, rate: float):
+        """
+        Take tokens from a bucket if it holds enough of them.
+
+        Args:
+            bucket_key (str): Key of the bucket.
+            amount (float): Number of tokens to take.
+            capacity (float): Maximum number of tokens of the bucket.
+            rate (float): Number of tokens the bucket is refilled with per second.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the number of seconds to
+                wait before the bucket holds enough of them.
+        """
+        with self._lock:
+            now = time.time()
+            tokens, updated_at = self._buckets.get(bucket_key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens < amount:
+                self._buckets[bucket_key] = (tokens, now)
+                return (amount - tokens) / rate
+            self._buckets[bucket_key] = (tokens - amount, now)
+            return 0
+
+
+class MongoBucketStore:
+    """
+    Token bucket store shared by every worker process through Mongo.
+
+    Buckets are updated with compare-and-set writes, so concurrent takes from
+    different processes never spend the same tokens twice.
+    """
+
+    def __init__(self, document_class=RateLimitBucket):
+        """
+        Initialize the MongoBucketStore.
+
+        Args:
+            document_class: Mongo document class holding the buckets.
+        """
+        self.document_class = document_class
+
+    def take(self, bucket_key: str, amount: float, capacity: float, rate: float):
+        """
+        Take tokens from a bucket if it holds enough of them.
+
+        Args:
+            bucket_key (str): Key of the bucket.
+            amount (float): Number of tokens to take.
+            capacity (float): Maximum number of tokens of the bucket.
+            rate (float): Number of tokens the bucket is refilled with per second.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the number of seconds to
+                wait before the bucket holds enough of them.
+        """
+        while True:
+            now = time.time()
+            bucket = self.document_class.objects(bucket_key=bucket_key).first()
+            if bucket is None:
+                try:
+                    self.document_class(
+                        bucket_key=bucket_key, tokens=capacity - amount, updated_at=now
+                    ).save()
+                    return 0
+                except NotUniqueError:
+                    # created by another process meanwhile
+                    continue
+            tokens = min(capacity, bucket.tokens + (now - bucket.updated_at) * rate)
+            if tokens < amount:
+                return (amount - tokens) / rate
+            updated = self.document_class.objects(
+                bucket_key=bucket_key,
+                tokens=bucket.tokens,
+                updated_at=bucket.updated_at,
+            ).update_one(set__tokens=tokens - amount, set__updated_at=now)
+            if updated:
+                return 0
+
+
+class RateLimiter:
+    """
+    Paces the requests made with an API key with two token buckets, one for the
+    requests per minute and one for the tokens per minute.
+
+    Attributes:
+        store: The store of the token buckets.
+        bucket_prefix (str): Prefix of the bucket keys, derived from the API key.
+        requests_per_minute (int): Maximum number of requests per minute.
+        tokens_per_minute (int): Maximum number of tokens per minute.
+    """
+
+    def __init__(
+        self, store, api_key: str, requests_per_minute: int, tokens_per_minute: int
+    ):
+        """
+        Initialize the RateLimiter.
+
+        Args:
+            store: The store of the token buckets.
+            api_key (str): The API key the requests are made with.
+            requests_per_minute (int): Maximum number of requests per minute.
+            tokens_per_minute (int): Maximum number of tokens per minute.
+        """
+        self.store = store
+        # the API key itself is never stored
+        self.bucket_prefix = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+    def _wait_for(self, bucket: str, amount: float, per_minute: int):
+        """
+        Block until tokens could be taken from a bucket.
+        """
+        amount = min(amount, per_minute)
+        while True:
+            wait = self.store.take(
+                f"{self.bucket_prefix}:{bucket}", amount, per_minute, per_minute / 60
+            )
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def acquire(self, tokens: int):
+        """
+        Block until a request of the given number of tokens can be made.
+
+        Args:
+            tokens (int): Number of tokens of the request, prompt and completion.
+        """
+        self._wait_for("requests", 1, self.requests_per_minute)
+        self._wait_for("tokens", tokens, self.tokens_per_minute)
+
+
+def get_retry_after(error) -> float:
+    """
+    Get the delay requested by the server through the Retry-After headers of an error.
+
+    Args:
+        error (Exception): The error raised by the OpenAI client.
+
+    Returns:
+        float | None: The requested delay in seconds, None if there is none.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        retry_after_ms = response.headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            return float(retry_after_ms) / 1000
+        retry_after = response.headers.get("retry-after")
+        if retry_after is not None:
+            return float(retry_after)
+    except ValueError:
+        # Retry-After may also be an HTTP date, fall back to backoff then
+        pass
+    return None
+
+
+def call_with_retries(
+    function,
+    max_retries: int = global_config.getint("RateLimit", "MAX_RETRIES", fallback=6),
+    base_delay: float = global_config.getfloat("RateLimit", "BASE_DELAY", fallback=1.0),
+    max_delay: float = global_config.getfloat("RateLimit", "MAX_DELAY", fallback=60.0),
+    sleep=time.sleep,
+):
+    """
+    Call a function, retrying it on rate limits and transient errors.
+
+    Waits for the delay requested through Retry-After when there is one, otherwise
+    for an exponential backoff with full jitter.
+
+    Args:
+        function (callable): The function to call, without arguments.
+        max_retries (int): Maximum number of retries.
+        base_delay (float): Backoff delay of the first retry in seconds.
+        max_delay (float): Maximum backoff delay in seconds.
+        sleep (callable): Function sleeping for a number of seconds.
+
+    Returns:
+        The return value of the function.
+
+    Raises:
+        Exception: The last error once retries are exhausted, or any error that is
+            not worth retrying.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return function()
+        except RETRYABLE_ERRORS as error:
+            if attempt == max_retries:
+                raise
+            retry_after = get_retry_after(error)
+            if retry_after is None:
+                delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            else:
+                # a little jitter keeps processes told the same delay apart
+                delay = retry_after + random.uniform(0, base_delay)
+            sleep(delay)
+
+
+def build_bucket_store(
+    store: str = global_config.get("RateLimit", "STORE", fallback="mongo")
+):
+    """
+    Build the token bucket store from the configuration.
+
+    Args:
+        store (str): "mongo" to share buckets across processes, "local" otherwise.
+
+    Returns:
+        The token bucket store.
+    """
+    if store == "local":
+        return LocalBucketStore()
+    return MongoBucketStore()
+
+
+bucket_store = build_bucket_store()
+
+
+def get_rate_limiter(
+    api_key: str,
+    requests_per_minute: int = global_config.getint("RateLimit", "RPM", fallback=3500),
+    tokens_per_minute: int = global_config.getint("RateLimit", "TPM", fallback=90000),
+) -> RateLimiter:
+    """
+    Get the RateLimiter of an API key, backed by the configured bucket store.
+
+    Args:
+        api_key (str): The API key.
+        requests_per_minute (int): Maximum number of requests per minute.
+        tokens_per_minute (int): Maximum number of tokens per minute.
+
+    Returns:
+        RateLimiter: The rate limiter of the API key.
+    """
+    return RateLimiter(bucket_store, api_key, requests_per_minute, tokens_per_minute)
@@ -0,0 +1,429 @@
+from backend.configuration import global_config
+from backend.models import QueuedTask, UserSchedulerState
+from datetime import datetime, timedelta
+
+
+class MongoSchedulerStore:
+    """
+    Queued tasks and per-user dispatch state of the fair scheduler, shared by the API
+    and every worker process through Mongo.
+
+    Slots and tasks are claimed with atomic find-and-modify writes, so concurrent
+    dispatches from different processes never exceed the cap of a user nor send the
+    same task twice.
+    """
+
+    def __init__(self, task_class=QueuedTask, state_class=UserSchedulerState):
+        """
+        Initialize the MongoSchedulerStore.
+
+        Args:
+            task_class: Mongo document class holding the queued tasks.
+            state_class: Mongo document class holding the per-user state.
+        """
+        self.task_class = task_class
+        self.state_class = state_class
+
+    def add(self, task_id: str, user_email: str, priority: bool, dispatch_kwargs):
+        """
+        Queue a task, replacing the queued task left over by an earlier attempt of
+        the same user task, if any.
+
+        Args:
+            task_id (str): ID of the user task.
+            user_email (str): Email of the user the task belongs to.
+            priority (bool): Whether the task goes in the priority lane.
+            dispatch_kwargs (dict): Arguments to dispatch the task with.
+        """
+        self.task_class.objects(task_id=task_id).update_one(
+            set__user_email=user_email,
+            set__priority=priority,
+            set__dispatch_kwargs=dispatch_kwargs,
+            set__status="QUEUED",
+            unset__dispatched_at=True,
+            # defaults are not applied by upserts
+            set_on_insert__enqueued_at=datetime.utcnow(),
+            upsert=True,
+        )
+
+    def queued_users(self) -> list:
+        """
+        Get the users with queued tasks.
+
+        Returns:
+            list: (user email, whether a task of the user is in the priority lane,
+                time of the last dispatch of the user or None) tuples.
+        """
+        queued = {
+            group["_id"]: group["priority"]
+            for group in self.task_class.objects(status="QUEUED").aggregate(
+                [{"$group": {"_id": "$user_email", "priority": {"$max": "$priority"}}}]
+            )
+        }
+        last_dispatched = {
+            state.user_email: state.last_dispatched_at
+            for state in self.state_class.objects(user_email__in=list(queued)).only(
+                "user_email", "last_dispatched_at"
+            )
+        }
+        return [
+            (user_email, priority, last_dispatched.get(user_email))
+            for user_email, priority in queued.items()
+        ]
+
+    def claim_slot(self, user_email: str, cap: int, now: datetime) -> bool:
+        """
+        Take a running slot of a user, unless the user is at the cap.
+
+        Args:
+            user_email (str): Email of the user.
+            cap (int): Maximum number of running tasks of the user.
+            now (datetime): The current time, recorded as the last dispatch.
+
+        Returns:
+            bool: Whether a slot was taken.
+        """
+        self.state_class.objects(user_email=user_email).update_one(
+            set_on_insert__running=0, upsert=True
+        )
+        return (
+            self.state_class.objects(user_email=user_email, running__lt=cap).modify(
+                inc__running=1, set__last_dispatched_at=now
+            )
+            is not None
+        )
+
+    def release_slot(self, user_email: str):
+        """
+        Give a running slot of a user back.
+
+        Args:
+            user_email (str): Email of the user.
+        """
+        self.state_class.objects(user_email=user_email, running__gt=0).update_one(
+            dec__running=1
+        )
+
+    def claim_task(self, user_email: str, now: datetime):
+        """
+        Mark the next queued task of a user as dispatched, priority lane first.
+
+        Args:
+            user_email (str): Email of the user.
+            now (datetime): The current time.
+
+        Returns:
+            dict | None: The task_id, priority and dispatch_kwargs of the task, None
+                if the user has no queued task.
+        """
+        task = (
+            self.task_class.objects(user_email=user_email, status="QUEUED")
+            .order_by("-priority", "enqueued_at")
+            .modify(set__status="DISPATCHED", set__dispatched_at=now, new=True)
+        )
+        if task is None:
+            return None
+        return {
+            "task_id": task.task_id,
+            "priority": task.priority,
+            "dispatch_kwargs": task.dispatch_kwargs,
+        }
+
+    def requeue(self, task_id: str):
+        """
+        Put a task that could not be dispatched back in the queue.
+
+        Args:
+            task_id (str): ID of the user task.
+        """
+        self.task_class.objects(task_id=task_id).update_one(
+            set__status="QUEUED", unset__dispatched_at=True
+        )
+
+    def finish(self, task_id: str):
+        """
+        Remove a dispatched task.
+
+        Args:
+            task_id (str): ID of the user task.
+
+        Returns:
+            str | None: Email of the user of the task, None if the task was not
+                dispatched by the scheduler or was already finished.
+        """
+        task = self.task_class.objects(task_id=task_id, status="DISPATCHED").modify(
+            remove=True
+        )
+        return task.user_email if task is not None else None
+
+    def dispatched_before(self, before: datetime) -> list:
+        """
+        Get the tasks dispatched before a time.
+
+        Args:
+            before (datetime): The time.
+
+        Returns:
+            list: The IDs of the tasks.
+        """
+        return list(
+            self.task_class.objects(
+                status="DISPATCHED", dispatched_at__lt=before
+            ).distinct("task_id")
+        )
+
+    def dispatched_count(self) -> int:
+        """
+        Count the dispatched tasks that have not completed yet.
+
+        Returns:
+            int: The number of tasks.
+        """
+        return self.task_class.objects(status="DISPATCHED").count()
+
+
+class FairScheduler:
+    """
+    Dispatches summary generation tasks fairly between users.
+
+    Tasks are queued per user instead of being sent straight to the broker, and
+    dispatched round-robin: one task of every user with queued tasks per round,
+    users dispatched least recently first. No user has more than
+    max_running_per_user tasks dispatched and not completed, so a user uploading
+    thousands of documents only ever holds a few places in the broker queue. Users
+    bringing their own OpenAI key form a priority lane: they come first in every
+    round and are allowed priority_max_running_per_user tasks. With max_dispatched,
+    the dispatched tasks of all users are bounded too, so that the order of the
+    rounds decides who runs next. Tasks are dispatched when queued and whenever a
+    task completes; tasks never reported as completed free their slot after
+    dispatch_timeout seconds.
+
+    Attributes:
+        dispatch_task (callable): Sends a task to the workers.
+        store (MongoSchedulerStore): Queued tasks and per-user state.
+        max_running_per_user (int): Maximum dispatched tasks of a user.
+        priority_max_running_per_user (int): Maximum dispatched tasks of a user in
+            the priority lane.
+        max_dispatched (int): Maximum dispatched tasks of all users, 0 for no limit.
+        dispatch_timeout (float): Seconds after which dispatched tasks free their slot.
+    """
+
+    def __init__(
+        self,
+        dispatch_task,
+        store=None,
+        max_running_per_user: int = global_config.getint(
+            "Scheduler", "MAX_RUNNING_PER_USER", fallback=2
+        ),
+        priority_max_running_per_user: int = global_config.getint(
+            "Scheduler", "PRIORITY_MAX_RUNNING_PER_USER", fallback=4
+        ),
+        max_dispatched: int = global_config.getint(
+            "Scheduler", "MAX_DISPATCHED", fallback=0
+        ),
+        dispatch_timeout: float = global_config.getfloat(
+            "Scheduler", "DISPATCH_TIMEOUT", fallback=6 * 60 * 60
+        ),
+        clock=datetime.utcnow,
+    ):
+        """
+        Initialize the FairScheduler.
+
+        Args:
+            dispatch_task (callable): Sends a task to the workers, called with the task
+                ID, the email of its user, whether it is in the priority lane, and its
+                dispatch arguments.
+            store (MongoSchedulerStore, optional): Queued tasks and per-user state,
+                defaults to the Mongo store.
+            max_running_per_user (int): Maximum dispatched tasks of a user.
+            priority_max_running_per_user (int): Maximum dispatched tasks of a user in
+                the priority lane.
+            max_dispatched (int): Maximum dispatched tasks of all users, 0 for no
+                limit.
+            dispatch_timeout (float): Seconds after which dispatched tasks free their
+                slot.
+            clock (callable): Current UTC time.
+
+        Raises:
+            ValueError: If a per-user cap is not positive.
+        """
+        if max_running_per_user < 1 or priority_max_running_per_user < 1:
+            raise ValueError("The per-user caps must be positive")
+        self.dispatch_task = dispatch_task
+        self.store = store or MongoSchedulerStore()
+        self.max_running_per_user = max_running_per_user
+        self.priority_max_running_per_user = priority_max_running_per_user
+        self.max_dispatched = max_dispatched
+        self.dispatch_timeout = dispatch_timeout
+        self.clock = clock
+
+    def enqueue(
+        self, task_id: str, user_email: str, priority: bool = False, **dispatch_kwargs
+    ):
+        """
+        Queue a task, then dispatch the tasks that may run.
+
+        Args:
+            task_id (str): ID of the user task.
+            user_email (str): Email of the user the task belongs to.
+            priority (bool): Whether the task goes in the priority lane.
+            **dispatch_kwargs: Arguments to dispatch the task with, stored in the
+                queue, so they must not hold secrets.
+        """
+        self.queue(task_id, user_email, priority, **dispatch_kwargs)
+        self.dispatch()
+
+    def queue(
+        self, task_id: str, user_email: str, priority: bool = False, **dispatch_kwargs
+    ):
+        """
+        Queue a task without dispatching it.
+
+        A resumed task whose earlier dispatch was never reported as completed frees
+        the slot of that dispatch first.
+
+        Args:
+            task_id (str): ID of the user task.
+            user_email (str): Email of the user the task belongs to.
+            priority (bool): Whether the task goes in the priority lane.
+            **dispatch_kwargs: Arguments to dispatch the task with, stored in the
+                queue, so they must not hold secrets.
+        """
+        self.finish(task_id)
+        self.store.add(task_id, user_email, priority, dispatch_kwargs)
+
+    def round_robin_order(self) -> list:
+        """
+        Order the users with queued tasks for a dispatch round.
+
+        Returns:
+            list: (user email, priority) tuples, priority lane first, then users
+                dispatched least recently first.
+        """
+        queued_users = self.store.queued_users()
+        queued_users.sort(
+            key=lambda user: (
+                not user[1],
+                user[2] is not None,
+                user[2] or datetime.min,
+            )
+        )
+        return [(user_email, priority) for user_email, priority, _ in queued_users]
+
+    def dispatch_next(self, user_email: str, priority: bool) -> bool:
+        """
+        Dispatch the next queued task of a user, unless the user is at the cap.
+
+        Args:
+            user_email (str): Email of the user.
+            priority (bool): Whether the user has tasks in the priority lane.
+
+        Returns:
+            bool: Whether a task was dispatched.
+        """
+        cap = (
+            self.priority_max_running_per_user
+            if priority
+            else self.max_running_per_user
+        )
+        now = self.clock()
+        if not self.store.claim_slot(user_email, cap, now):
+            return False
+        task = self.store.claim_task(user_email, now)
+        if task is None:
+            self.store.release_slot(user_email)
+            return False
+        try:
+            self.dispatch_task(
+                task["task_id"], user_email, task["priority"], **task["dispatch_kwargs"]
+            )
+        except Exception:
+            self.store.requeue(task["task_id"])
+            self.store.release_slot(user_email)
+            raise
+        return True
+
+    def dispatch(self) -> int:
+        """
+        Dispatch queued tasks in rounds, until no user may run another task.
+
+        Returns:
+            int: The number of tasks dispatched.
+        """
+        self.expire_stale()
+        dispatched = 0
+        while True:
+            dispatched_in_round = 0
+            for user_email, priority in self.round_robin_order():
+                if (
+                    self.max_dispatched
+                    and self.store.dispatched_count() >= self.max_dispatched
+                ):
+                    return dispatched + dispatched_in_round
+                dispatched_in_round += self.dispatch_next(user_email, priority)
+            if not dispatched_in_round:
+                return dispatched
+            dispatched += dispatched_in_round
+
+    def finish(self, task_id: str) -> bool:
+        """
+        Remove a dispatched task and free the slot of its user.
+
+        Args:
+            task_id (str): ID of the user task.
+
+        Returns:
+            bool: Whether the task was dispatched and not finished yet.
+        """
+        user_email = self.store.finish(task_id)
+        if user_email is None:
+            return False
+        self.store.release_slot(user_email)
+        return True
+
+    def expire_stale(self):
+        """
+        Free the slots of the tasks dispatched more than dispatch_timeout seconds ago,
+        whose completion was lost.
+        """
+        before = self.clock() - timedelta(seconds=self.dispatch_timeout)
+        for task_id in self.store.dispatched_before(before):
+            self.finish(task_id)
+
+    def complete(self, task_ids) -> int:
+        """
+        Free the slots of completed tasks, then dispatch the tasks that may run.
+
+        Completing a task twice, or a task not dispatched by the scheduler, does
+        nothing.
+
+        Args:
+            task_ids (list): IDs of the completed tasks.
+
+        Returns:
+            int: The number of tasks dispatched.
+        """
+        finished = sum(self.finish(task_id) for task_id in task_ids)
+        if not finished:
+            return 0
+        return self.dispatch()
+
+
+def build_scheduler(
+    dispatch_task,
+    enabled: bool = global_config.getboolean("Scheduler", "ENABLED", fallback=True),
+):
+    """
+    Build the fair scheduler from the configuration.
+
+    Args:
+        dispatch_task (callable): Sends a task to the workers.
+        enabled (bool): Whether tasks are scheduled fairly between users, rather
+            than sent to the workers in the order they arrive.
+
+    Returns:
+        FairScheduler | None: The fair scheduler, None if disabled.
+    """
+    if enabled:
+        return FairScheduler(dispatch_task)
+    return None
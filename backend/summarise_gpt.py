@@ -1,5 +1,39 @@
-from openai import OpenAI
+from backend.chunker import TokenChunker, get_tokenizer
 from backend.configuration import global_config
+from backend.extractive import ExtractiveCompressor
+from backend.llm_backends import build_llm_backend
+from backend.output_budget import OutputBudget
+from backend.rate_limiter import call_with_retries
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import threading
+
+# Bump whenever the prompt templates change, so that cached chunk summaries generated
+# with older prompts are not served anymore
+PROMPT_VERSION = "1"
+
+# api key -> semaphore bounding the concurrent requests made with the key by all
+# the tasks of a process
+_key_semaphores = {}
+_key_semaphores_lock = threading.Lock()
+
+
+def get_key_semaphore(api_key: str, limit: int) -> threading.BoundedSemaphore:
+    """
+    Get the semaphore bounding the concurrent requests made with an API key.
+
+    Args:
+        api_key (str): The API key.
+        limit (int): Maximum number of concurrent requests with the key, only used
+            when the semaphore of the key is created.
+
+    Returns:
+        threading.BoundedSemaphore: The semaphore of the API key.
+    """
+    with _key_semaphores_lock:
+        if api_key not in _key_semaphores:
+            _key_semaphores[api_key] = threading.BoundedSemaphore(limit)
+        return _key_semaphores[api_key]
 
 
 class GPTSummarisation:
@@ -11,13 +45,35 @@ class GPTSummarisation:
     Attributes:
         api_key (str): The API key for accessing OpenAI services.
         model (str): The GPT model to use for summarization.
-        client: The OpenAI client instance.
+        backend (LLMBackend): The language model backend completing the prompts.
+        tokenizer (Tokenizer): Local token counter of the model.
+        concurrency (int): Maximum number of concurrent requests of a document.
+        key_semaphore (threading.BoundedSemaphore): Bounds the concurrent requests
+            made with the API key across documents.
+        summary_cache (SummaryCache | None): Shared cache of chunk summaries.
+        rate_limiter (RateLimiter | None): Paces the requests made with the API key.
+        output_budget (OutputBudget): Output token budgets of the requests and their
+            recorded usage.
+        boilerplate_filter (BoilerplateFilter | None): Removes repeated boilerplate
+            from documents before they are chunked.
+        extractive_compressor (ExtractiveCompressor): Keeps the most central
+            sentences of long documents before they are chunked.
     """
 
     def __init__(
         self,
         api_key=global_config["OpenAI"]["API_KEY"],
         model=global_config["OpenAI"]["MODEL"],
+        concurrency: int = global_config.getint("OpenAI", "CONCURRENCY", fallback=8),
+        key_concurrency: int = global_config.getint(
+            "OpenAI", "KEY_CONCURRENCY", fallback=16
+        ),
+        summary_cache=None,
+        rate_limiter=None,
+        backend=None,
+        output_budget=None,
+        boilerplate_filter=None,
+        extractive_compressor=None,
     ):
         """
         Initialize the GPTSummarisation instance.
@@ -25,27 +81,51 @@ class GPTSummarisation:
         Args:
             api_key (str): The API key for accessing OpenAI services.
             model (str): The GPT model to use for summarization.
+            concurrency (int): Maximum number of concurrent requests of a document.
+            key_concurrency (int): Maximum number of concurrent requests made with
+                the API key by all the documents summarised in this process.
+            summary_cache (SummaryCache, optional): Shared cache of chunk summaries,
+                chunks are always sent to the model without it.
+            rate_limiter (RateLimiter, optional): Paces the requests made with the API
+                key, requests are not paced without it.
+            backend (LLMBackend, optional): The language model backend, defaults to the
+                one selected in the configuration.
+            output_budget (OutputBudget, optional): Output token budgets of the
+                requests, defaults to the configured compression ratio.
+            boilerplate_filter (BoilerplateFilter, optional): Removes repeated
+                boilerplate from documents before they are chunked, documents are
+                summarised as they are without it.
+            extractive_compressor (ExtractiveCompressor, optional): Keeps the most
+                central sentences of long documents, defaults to the configured one.
         """
-        self.client = OpenAI(api_key=api_key)
+        self.backend = backend or build_llm_backend(api_key, model)
         self.model = model
+        self.tokenizer = get_tokenizer(model)
+        self.concurrency = concurrency
+        self.key_semaphore = get_key_semaphore(api_key, key_concurrency)
+        self.summary_cache = summary_cache
+        self.rate_limiter = rate_limiter
+        self.output_budget = output_budget or OutputBudget()
+        self.boilerplate_filter = boilerplate_filter
+        self.extractive_compressor = extractive_compressor or ExtractiveCompressor()
 
     def call_open_api(self, prompt: str, prompt_length: int) -> str:
         """
-        Call the OpenAI API to generate a summary based on the provided prompt.
+        Call the language model backend to generate a summary based on the provided prompt,
+        recording the output tokens used against the budget.
 
         Args:
             prompt (str): The prompt to be used for generating the summary.
-            prompt_length (int): The length of the prompt.
+            prompt_length (int): The output token budget of the summary.
 
         Returns:
             str: The generated summary.
         """
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=prompt_length,  # summary can not be longer than original
+        completion = self.backend.complete(prompt, max_tokens=prompt_length)
+        self.output_budget.record(
+            prompt_length, completion.output_tokens, completion.truncated
         )
-        return response.choices[0].message.content.strip()
+        return completion.text
 
     @staticmethod
     def get_subset(text, i: int, j: int):
@@ -81,27 +161,258 @@ class GPTSummarisation:
         addition = "Can you please summarise the following texts as simply and concisely without losing any information as possible\n"
         return addition + prompt
 
-    def summarise_doc(self, text: str, page_size: int = 1000):
+    @staticmethod
+    def format_reduce_prompt(prompt: str):
+        """
+        Format the prompt for combining the summaries of consecutive parts of a document.
+
+        Args:
+            prompt (str): The summaries to be combined.
+
+        Returns:
+            str: The formatted prompt.
+        """
+        addition = "Can you please combine the following summaries of consecutive parts of a document into a single summary as simply and concisely as possible without losing any key information\n"
+        return addition + prompt
+
+    def summarise_doc(
+        self,
+        text: str,
+        chunk_tokens: int = global_config.getint(
+            "OpenAI", "CHUNK_TOKENS", fallback=2000
+        ),
+        min_chunk_tokens: int = global_config.getint(
+            "OpenAI", "MIN_CHUNK_TOKENS", fallback=200
+        ),
+        target_tokens: int = global_config.getint(
+            "OpenAI", "SUMMARY_TARGET_TOKENS", fallback=0
+        ),
+        checkpoint=None,
+        extractive_ratio: float = 1.0,
+    ):
         """
         Summarize a document using the OpenAI GPT model.
 
+        Headers and footers repeated on the pages of the document are removed first,
+        if there is a boilerplate filter, and long documents are cut down to their
+        most central sentences with an extractive ratio below 1. The document is then
+        split into chunks of whole paragraphs and sentences that are summarised
+        concurrently. With a target length, the chunk summaries are then reduced
+        level by level until the summary fits in it. With a checkpoint, chunk
+        summaries are persisted as they finish and the chunks already summarised by
+        an earlier attempt are not summarised again.
+
         Args:
             text (str): The document text to be summarized.
-            page_size (int): The size of each page for summarization (default is 1000).
+            chunk_tokens (int): The token budget of each chunk (default is 2000).
+            min_chunk_tokens (int): The minimum number of tokens of the last chunk
+                (default is 200).
+            target_tokens (int): The target length of the summary in tokens, 0 to
+                join the chunk summaries as they are (default is 0).
+            checkpoint (TaskCheckpoint, optional): Checkpoint of the chunk summaries.
+            extractive_ratio (float): The fraction of long documents kept by the
+                extractive stage, 1 to keep them whole (default is 1).
+
+        Returns:
+            str: The summarized document.
+        """
+        chunks = self.split_doc(text, chunk_tokens, min_chunk_tokens, extractive_ratio)
+        if checkpoint is not None:
+            checkpoint.start(len(chunks))
+        summaries = self.summarise_chunks(chunks, checkpoint=checkpoint)
+        return self.combine_summaries(
+            summaries, chunk_tokens, min_chunk_tokens, target_tokens
+        )
+
+    def split_doc(
+        self,
+        text: str,
+        chunk_tokens: int = global_config.getint(
+            "OpenAI", "CHUNK_TOKENS", fallback=2000
+        ),
+        min_chunk_tokens: int = global_config.getint(
+            "OpenAI", "MIN_CHUNK_TOKENS", fallback=200
+        ),
+        extractive_ratio: float = 1.0,
+    ) -> list:
+        """
+        Split a document into the chunks to be summarised, once its boilerplate is
+        removed and it is cut down by the extractive stage.
+
+        Args:
+            text (str): The document text.
+            chunk_tokens (int): The token budget of each chunk (default is 2000).
+            min_chunk_tokens (int): The minimum number of tokens of the last chunk
+                (default is 200).
+            extractive_ratio (float): The fraction of long documents kept by the
+                extractive stage, 1 to keep them whole (default is 1).
+
+        Returns:
+            list: The chunks, in document order.
+        """
+        if self.boilerplate_filter is not None:
+            text = self.boilerplate_filter.strip(text, self.tokenizer.count)
+        text = self.extractive_compressor.compress(
+            text, extractive_ratio, self.tokenizer.count
+        )
+        chunker = TokenChunker(self.tokenizer.count, chunk_tokens, min_chunk_tokens)
+        return chunker.chunk(text)
+
+    def combine_summaries(
+        self,
+        summaries,
+        chunk_tokens: int = global_config.getint(
+            "OpenAI", "CHUNK_TOKENS", fallback=2000
+        ),
+        min_chunk_tokens: int = global_config.getint(
+            "OpenAI", "MIN_CHUNK_TOKENS", fallback=200
+        ),
+        target_tokens: int = global_config.getint(
+            "OpenAI", "SUMMARY_TARGET_TOKENS", fallback=0
+        ),
+    ) -> str:
+        """
+        Combine the chunk summaries of a document into its summary.
+
+        Args:
+            summaries (list): The chunk summaries, in document order.
+            chunk_tokens (int): The token budget of each group of summaries reduced
+                together (default is 2000).
+            min_chunk_tokens (int): The minimum number of tokens of the last group
+                (default is 200).
+            target_tokens (int): The target length of the summary in tokens, 0 to
+                join the chunk summaries as they are (default is 0).
 
         Returns:
             str: The summarized document.
         """
-        generated_summaries = []
-        i = 0
-        j = page_size
-        while GPTSummarisation.get_subset(text, i, j) != "":
-            generated_summaries.append(
-                self.call_open_api(
-                    prompt=GPTSummarisation.format_prompt(text[i:j]),
-                    prompt_length=j - i + 1,
-                )
+        if target_tokens > 0:
+            chunker = TokenChunker(self.tokenizer.count, chunk_tokens, min_chunk_tokens)
+            summaries = self.reduce_summaries(summaries, chunker, target_tokens)
+        return "\n".join(summaries)
+
+    def reduce_summaries(
+        self, summaries, chunker: TokenChunker, target_tokens: int, max_levels: int = 8
+    ) -> list:
+        """
+        Summarize summaries again, level by level, until they fit in the target length.
+
+        At every level consecutive summaries are packed into groups of at most the
+        chunk token budget, and the groups are summarised concurrently. As each level
+        shrinks the number of summaries by the ratio of the chunk budget to the summary
+        length, the number of levels grows logarithmically with the document length.
+
+        Args:
+            summaries (list): The summaries of consecutive parts of a document.
+            chunker (TokenChunker): The chunker grouping summaries.
+            target_tokens (int): The target length of the summary in tokens.
+            max_levels (int): The maximum number of reduction levels.
+
+        Returns:
+            list: The reduced summaries, in document order.
+        """
+        for _ in range(max_levels):
+            if self.tokenizer.count("\n".join(summaries)) <= target_tokens:
+                break
+            groups = chunker.chunk("\n\n".join(summaries))
+            summaries = self.summarise_chunks(
+                groups,
+                prompt_formatter=GPTSummarisation.format_reduce_prompt,
+                # the last level produces a single summary of at most the target
+                max_tokens=target_tokens,
+            )
+        return summaries
+
+    def summarise_chunk(
+        self, chunk: str, prompt_formatter=None, max_tokens: int = None
+    ) -> str:
+        """
+        Summarize a single chunk of a document, from the summary cache if possible,
+        otherwise with the API, retrying transient errors.
+
+        Args:
+            chunk (str): The chunk to be summarized.
+            prompt_formatter (callable, optional): Formats the prompt of the chunk,
+                defaults to format_prompt.
+            max_tokens (int, optional): Upper bound on the length of the summary.
+
+        Returns:
+            str: The summary of the chunk.
+        """
+        prompt_formatter = prompt_formatter or GPTSummarisation.format_prompt
+        prompt_length = self.output_budget.budget(
+            self.tokenizer.count(chunk), max_tokens
+        )
+        prompt = prompt_formatter(chunk)
+        if self.summary_cache is not None:
+            cache_key = self.summary_cache.build_key(
+                self.model, PROMPT_VERSION, prompt, prompt_length
+            )
+            summary = self.summary_cache.get(cache_key)
+            if summary is not None:
+                return summary
+        summary = call_with_retries(
+            partial(self.rate_limited_call, prompt, prompt_length)
+        )
+        if self.summary_cache is not None:
+            self.summary_cache.put(cache_key, summary)
+        return summary
+
+    def rate_limited_call(self, prompt: str, prompt_length: int) -> str:
+        """
+        Call the OpenAI API once the rate limiter allows for the request and a
+        request slot of the API key is free. The slot is only held for the request
+        itself, not while waiting on the rate limiter or backing off between retries.
+
+        Args:
+            prompt (str): The prompt to be used for generating the summary.
+            prompt_length (int): The output token budget of the summary.
+
+        Returns:
+            str: The generated summary.
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self.tokenizer.count(prompt) + prompt_length)
+        with self.key_semaphore:
+            return self.call_open_api(prompt=prompt, prompt_length=prompt_length)
+
+    def summarise_chunks(self, chunks, checkpoint=None, **kwargs) -> list:
+        """
+        Summarize chunks concurrently, with at most concurrency requests in flight.
+
+        Args:
+            chunks (list): The chunks to be summarized.
+            checkpoint (TaskCheckpoint, optional): Checkpoint the summaries are loaded
+                from and saved to as they finish.
+            **kwargs: Arguments passed on to summarise_chunk.
+
+        Returns:
+            list: The summaries of the chunks, in the order of the chunks.
+
+        Raises:
+            Exception: The first error raised while summarizing a chunk. The chunks
+                not started yet are cancelled, those in flight finish in the background.
+        """
+        summaries = checkpoint.load(chunks) if checkpoint is not None else {}
+        missing = [index for index in range(len(chunks)) if index not in summaries]
+
+        def summarise(index):
+            summary = self.summarise_chunk(chunks[index], **kwargs)
+            if checkpoint is not None:
+                checkpoint.save(index, chunks[index], summary)
+            return summary
+
+        if missing:
+            executor = ThreadPoolExecutor(
+                max_workers=min(self.concurrency, len(missing))
             )
-            i += page_size
-            j += page_size
-        return "\n".join(generated_summaries)
+            futures = {executor.submit(summarise, index): index for index in missing}
+            try:
+                for future in as_completed(futures):
+                    summaries[futures[future]] = future.result()
+            except BaseException:
+                # the task fails anyway, stop paying for the chunks not started yet
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            executor.shutdown()
+        return [summaries[index] for index in range(len(chunks))]
@@ -0,0 +1,131 @@
+from backend.configuration import global_config
+from backend.models import ChunkSummaryCache
+from mongoengine.errors import NotUniqueError
+import hashlib
+import threading
+
+
+class SummaryCache:
+    """
+    Persistent chunk summary cache shared by all users and workers.
+
+    Summaries are keyed by the model, the prompt template version and a hash of the
+    prompt, so identical chunks are only ever summarised once. Entries expire after
+    a TTL enforced by a Mongo TTL index, and the oldest entries are evicted once the
+    cache holds more than max_entries.
+
+    Attributes:
+        max_entries (int): Maximum number of cached summaries.
+        eviction_interval (int): Number of insertions of a process between checks
+            of the cache size.
+        hits (int): Number of lookups served by the cache.
+        misses (int): Number of lookups that required a request to the model.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = global_config.getint(
+            "SummaryCache", "MAX_ENTRIES", fallback=1000000
+        ),
+        eviction_interval: int = 100,
+        document_class=ChunkSummaryCache,
+    ):
+        """
+        Initialize the SummaryCache.
+
+        Args:
+            max_entries (int): Maximum number of cached summaries.
+            eviction_interval (int): Number of insertions of a process between checks
+                of the cache size.
+            document_class: Mongo document class holding the cached summaries.
+        """
+        self.max_entries = max_entries
+        self.eviction_interval = eviction_interval
+        self.document_class = document_class
+        self.hits = 0
+        self.misses = 0
+        self._insertions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_key(model: str, prompt_version: str, prompt: str, max_tokens: int) -> str:
+        """
+        Build the cache key of a summary.
+
+        Args:
+            model (str): The model generating the summary.
+            prompt_version (str): Version of the prompt templates.
+            prompt (str): The formatted prompt holding the chunk.
+            max_tokens (int): The output token budget of the summary, as a summary
+                generated with a smaller budget may be cut short.
+
+        Returns:
+            str: The cache key.
+        """
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return f"{model}:{prompt_version}:{max_tokens}:{prompt_hash}"
+
+    def get(self, key: str):
+        """
+        Look a summary up.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            str | None: The cached summary, or None on a miss.
+        """
+        entry = self.document_class.objects(cache_key=key).only("summary").first()
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry.summary
+
+    def put(self, key: str, summary: str):
+        """
+        Cache a summary, evicting the oldest entries every eviction_interval insertions.
+
+        Args:
+            key (str): The cache key.
+            summary (str): The summary to be cached.
+        """
+        try:
+            self.document_class(cache_key=key, summary=summary).save()
+        except NotUniqueError:
+            # another worker summarised the same chunk meanwhile
+            return
+        with self._lock:
+            self._insertions += 1
+            evict = self._insertions % self.eviction_interval == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the oldest entries until the cache holds at most max_entries.
+        """
+        excess = self.document_class.objects.count() - self.max_entries
+        if excess > 0:
+            oldest = self.document_class.objects.order_by("created_at").only("id")
+            self.document_class.objects(
+                id__in=[entry.id for entry in oldest.limit(excess)]
+            ).delete()
+
+    def stats(self) -> dict:
+        """
+        Get the hit and miss counters of the cache in this process.
+
+        Returns:
+            dict: Hits, misses and the hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+        }
+
+
+summary_cache = SummaryCache()
@@ -0,0 +1,224 @@
+from unittest.mock import MagicMock, patch
+import json
+import os
+import pytest
+from backend.batch import (
+    BulkSummarisation,
+    LocalBatchService,
+    get_result_summary,
+)
+from backend.blob_store import BlobStore
+from backend.llm_backends import Completion, LLMBackend
+
+
+class InMemoryCheckpoints:
+    def __init__(self):
+        self.summaries = {}
+        self.chunks_total = {}
+
+    def __call__(self, task_id):
+        checkpoints = self
+        checkpoint = MagicMock()
+        checkpoint.start.side_effect = lambda total: checkpoints.chunks_total.update(
+            {task_id: total}
+        )
+        checkpoint.save.side_effect = (
+            lambda index, chunk, summary: checkpoints.summaries.setdefault(
+                task_id, {}
+            ).update({index: summary})
+        )
+        checkpoint.load.side_effect = lambda chunks: dict(
+            checkpoints.summaries.get(task_id, {})
+        )
+        return checkpoint
+
+
+class FailingBackend(LLMBackend):
+    def complete(self, prompt, max_tokens):
+        if "fail" in prompt:
+            raise RuntimeError("request failed")
+        return Completion("summary", 1, False)
+
+
+class InMemoryBlobStore(BlobStore):
+    def __init__(self):
+        super().__init__()
+        self.blobs = {}
+        self.refs = {}
+
+    def acquire(self, key, content):
+        self.blobs.setdefault(key, content)
+        self.refs[key] = self.refs.get(key, 0) + 1
+
+    def release(self, key):
+        self.refs[key] -= 1
+        if self.refs[key] > 0:
+            return False
+        self.delete(key)
+        return True
+
+    def delete(self, key):
+        self.blobs.pop(key, None)
+        self.refs.pop(key, None)
+
+    def expire(self, before):
+        return 0
+
+    def exists(self, key):
+        return key in self.blobs
+
+    def get(self, key):
+        return self.blobs[key].decode("utf-8")
+
+
+document_store = InMemoryBlobStore()
+
+
+def build_user_task(task_id, text):
+    return MagicMock(user_task_id=task_id, user_read_docs_ref=document_store.put(text))
+
+
+def build_bulk_summarisation(
+    batch_service, tmp_path, max_requests=3, max_bytes=1024 * 1024
+):
+    bulk_summarisation = BulkSummarisation(
+        batch_service,
+        directory=str(tmp_path / "requests"),
+        max_requests=max_requests,
+        max_bytes=max_bytes,
+        chunk_tokens=3,
+        min_chunk_tokens=0,
+        checkpoint_class=InMemoryCheckpoints(),
+        document_store=document_store,
+    )
+    bulk_summarisation.tokenizer = MagicMock()
+    bulk_summarisation.tokenizer.count.side_effect = lambda text: len(text.split())
+    return bulk_summarisation
+
+
+def test_write_request_files(tmp_path):
+    bulk_summarisation = build_bulk_summarisation(MagicMock(), tmp_path)
+    user_tasks = [
+        build_user_task("task1", "One two three.\n\nFour five six.\n\nSeven."),
+        build_user_task("task2", "Eight nine ten.\n\nEleven twelve thirteen."),
+    ]
+    paths = bulk_summarisation.write_request_files("job", user_tasks)
+    requests = [
+        [json.loads(line) for line in open(path).read().splitlines()] for path in paths
+    ]
+    assert [len(file_requests) for file_requests in requests] == [3, 2]
+    custom_ids = [
+        request["custom_id"] for file_requests in requests for request in file_requests
+    ]
+    assert custom_ids == ["task1:0", "task1:1", "task1:2", "task2:0", "task2:1"]
+    first_request = requests[0][0]
+    assert first_request["url"] == "/v1/chat/completions"
+    assert first_request["body"]["messages"][0]["content"].endswith("One two three.")
+    assert first_request["body"]["max_tokens"] == 3
+    assert bulk_summarisation.checkpoint_class.chunks_total == {"task1": 3, "task2": 2}
+
+
+def test_write_request_files_splits_by_size(tmp_path):
+    bulk_summarisation = build_bulk_summarisation(MagicMock(), tmp_path)
+    request_size = len(
+        json.dumps(bulk_summarisation.build_request("task1", 0, "One two three."))
+        + "\n"
+    )
+    # two requests of about the same size fit in a file, three do not
+    bulk_summarisation = build_bulk_summarisation(
+        MagicMock(), tmp_path, max_requests=100, max_bytes=request_size * 2 + 8
+    )
+    user_tasks = [
+        build_user_task("task1", "One two three.\n\nFour five six.\n\nSeven."),
+        build_user_task("task2", "Eight nine ten.\n\nEleven twelve thirteen."),
+    ]
+    paths = bulk_summarisation.write_request_files("job", user_tasks)
+    assert [len(open(path).read().splitlines()) for path in paths] == [2, 2, 1]
+    assert all(os.path.getsize(path) <= request_size * 2 + 8 for path in paths)
+
+
+def test_local_batch_service(tmp_path):
+    requests_path = tmp_path / "requests.jsonl"
+    requests_path.write_text(
+        "\n".join(
+            json.dumps(
+                {
+                    "custom_id": custom_id,
+                    "body": {
+                        "messages": [{"role": "user", "content": content}],
+                        "max_tokens": 2,
+                    },
+                }
+            )
+            for custom_id, content in [("ok", "words to summarise"), ("ko", "fail")]
+        )
+    )
+    batch_service = LocalBatchService(
+        str(tmp_path / "service"), backend=FailingBackend(), completion_delay=60
+    )
+    batch_id = batch_service.submit(str(requests_path))
+    assert batch_service.status(batch_id) == "in_progress"
+    batch_service.completion_delay = 0
+    assert batch_service.status(batch_id) == "completed"
+    results = {
+        result["custom_id"]: result for result in batch_service.results(batch_id)
+    }
+    assert get_result_summary(results["ok"]) == "summary"
+    assert get_result_summary(results["ko"]) is None
+    assert results["ko"]["error"]["message"] == "request failed"
+
+
+@pytest.mark.parametrize(
+    "result, summary",
+    [
+        (
+            {
+                "error": None,
+                "response": {
+                    "status_code": 200,
+                    "body": {"choices": [{"message": {"content": " summary\n"}}]},
+                },
+            },
+            "summary",
+        ),
+        ({"error": None, "response": {"status_code": 429, "body": {}}}, None),
+        ({"error": {"code": "expired"}, "response": None}, None),
+    ],
+)
+def test_get_result_summary(result, summary):
+    assert get_result_summary(result) == summary
+
+
+def test_submit_and_ingest(tmp_path):
+    batch_service = LocalBatchService(
+        str(tmp_path / "service"), backend=FailingBackend()
+    )
+    bulk_summarisation = build_bulk_summarisation(batch_service, tmp_path)
+    user_tasks = {
+        "task1": build_user_task("task1", "One two three.\n\nFour five six."),
+        "task2": build_user_task("task2", "Seven eight.\n\nThis will fail."),
+    }
+    with patch("backend.batch.BatchJob") as batch_jobs, patch(
+        "backend.batch.UserTasks"
+    ) as user_tasks_class:
+        user_tasks_class.objects.side_effect = lambda user_task_id: MagicMock(
+            first=MagicMock(return_value=user_tasks[user_task_id])
+        )
+        batch_jobs.side_effect = lambda **kwargs: MagicMock(
+            ingested_batch_ids=[], **kwargs
+        )
+        job = bulk_summarisation.submit(list(user_tasks.values()))
+        job.save.assert_called_once()
+        assert len(job.batch_ids) == 2
+        assert bulk_summarisation.ingest(job)
+    user_tasks["task1"].update.assert_called_once()
+    update = user_tasks["task1"].update.call_args.kwargs
+    assert update["set__user_task_status"] == "SUCCESS"
+    assert update["set__user_generated_summary"] == "summary\nsummary"
+    update = user_tasks["task2"].update.call_args.kwargs
+    assert update["set__user_task_status"] == "FAILED"
+    assert update["set__user_task_error"].startswith("1 of 2 chunks")
+    job.update.assert_called_with(set__job_status="SUCCESS")
+    # only the failed task keeps its text, to be resumed
+    assert not document_store.exists(user_tasks["task1"].user_read_docs_ref)
+    assert document_store.exists(user_tasks["task2"].user_read_docs_ref)
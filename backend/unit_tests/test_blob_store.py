@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+import mongoengine
+import os
+import pytest
+from backend.blob_store import LocalBlobStore, build_blob_store, GridFSBlobStore
+
+
+def test_local_blob_store_round_trip(tmp_path):
+    blob_store = LocalBlobStore(str(tmp_path))
+    key = blob_store.put("Hello, wörld")
+    assert key == LocalBlobStore.build_key("Hello, wörld")
+    assert len(key) == 64
+    assert blob_store.exists(key)
+    assert blob_store.get(key) == "Hello, wörld"
+
+
+def test_local_blob_store_writes_identical_texts_once(tmp_path):
+    blob_store = LocalBlobStore(str(tmp_path))
+    key = blob_store.put("text")
+    blob_path = blob_store._blob_path(key)
+    inode = os.stat(blob_path).st_ino
+    assert blob_store.put("text") == key
+    assert os.stat(blob_path).st_ino == inode
+    assert blob_store.put("other text") != key
+
+
+def test_local_blob_store_deletes_blob_with_last_reference(tmp_path):
+    blob_store = LocalBlobStore(str(tmp_path))
+    key = blob_store.put("shared text")
+    assert blob_store.put("shared text") == key
+    assert not blob_store.release(key)
+    assert blob_store.get(key) == "shared text"
+    assert blob_store.release(key)
+    assert not blob_store.exists(key)
+    assert not blob_store.release(key)
+    key = blob_store.put("deleted text")
+    blob_store.delete(key)
+    assert not blob_store.exists(key)
+
+
+def test_local_blob_store_expires_blobs_last_put_before_ttl(tmp_path):
+    blob_store = LocalBlobStore(str(tmp_path), ttl=60, expiry_interval=2)
+    old_key = blob_store.put("old text")
+    os.utime(blob_store._blob_path(old_key), (0, 0))
+    recent_key = blob_store.put("recent text")
+    assert not blob_store.exists(old_key)
+    assert blob_store.exists(recent_key)
+    assert blob_store.expire(datetime.utcnow() + timedelta(seconds=1)) == 1
+    assert not blob_store.exists(recent_key)
+
+
+def test_gridfs_blob_store_reference_counting():
+    mongomock = pytest.importorskip("mongomock")
+    mongomock_gridfs = pytest.importorskip("mongomock.gridfs")
+    mongomock_gridfs.enable_gridfs_integration()
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "blobs", host="mongodb://localhost", mongo_client_class=mongomock.MongoClient
+    )
+    try:
+        blob_store = GridFSBlobStore(ttl=60)
+        key = blob_store.put("shared text")
+        assert blob_store.put("shared text") == key
+        assert blob_store.get(key) == "shared text"
+        assert not blob_store.release(key)
+        assert blob_store.release(key)
+        assert not blob_store.exists(key)
+        with pytest.raises(KeyError):
+            blob_store.get(key)
+        key = blob_store.put("expired text")
+        assert blob_store.expire(datetime.utcnow() + timedelta(seconds=1)) == 1
+        assert not blob_store.exists(key)
+    finally:
+        mongoengine.disconnect()
+
+
+def test_local_blob_store_missing_key(tmp_path):
+    blob_store = LocalBlobStore(str(tmp_path))
+    assert not blob_store.exists("0" * 64)
+    with pytest.raises(KeyError):
+        blob_store.get("0" * 64)
+
+
+def test_build_blob_store(tmp_path):
+    assert isinstance(build_blob_store("local", str(tmp_path)), LocalBlobStore)
+    assert isinstance(build_blob_store("gridfs", str(tmp_path)), GridFSBlobStore)
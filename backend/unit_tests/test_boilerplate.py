@@ -0,0 +1,145 @@
+from unittest.mock import MagicMock
+import pytest
+from backend.boilerplate import (
+    BoilerplateFilter,
+    build_boilerplate_filter,
+    normalise_line,
+    simhash,
+)
+from backend.parser import PAGE_BREAK
+from backend.summarise_gpt import GPTSummarisation
+
+PAGE = """ACME Corporation - Confidential
+Quarterly report of the {section} division
+The {section} division grew its revenue by {growth} percent this quarter.
+Page {page} of 12
+This document must not be distributed outside of ACME Corporation."""
+
+SECTIONS = ["north", "south", "east", "west", "central", "export"]
+
+
+def build_document():
+    return PAGE_BREAK.join(
+        PAGE.format(section=section, growth=page * 3, page=page)
+        for page, section in enumerate(SECTIONS, start=1)
+    )
+
+
+def test_normalise_line():
+    assert normalise_line("  Page 3  of 12 ") == "page 0 of 0"
+
+
+def test_simhash_near_duplicates():
+    line = "acme corporation - printed for internal use only"
+    assert simhash(line) == simhash(line)
+    near_duplicate = simhash("acme corporation - printed for internal use onyl")
+    different = simhash("the north division grew its revenue this quarter")
+    assert bin(simhash(line) ^ near_duplicate).count("1") < bin(
+        simhash(line) ^ different
+    ).count("1")
+
+
+def test_strip_repeated_lines():
+    boilerplate_filter = BoilerplateFilter(min_repeats=3, min_length=8)
+    stripped = boilerplate_filter.strip(
+        build_document(), token_counter=lambda text: len(text.split())
+    )
+    assert stripped.count(PAGE_BREAK) == len(SECTIONS) - 1
+    lines = stripped.replace(PAGE_BREAK, "\n").split("\n")
+    assert lines.count("ACME Corporation - Confidential") == 1
+    assert lines[:4] == [
+        "ACME Corporation - Confidential",
+        "Quarterly report of the north division",
+        "The north division grew its revenue by 3 percent this quarter.",
+        "Page 1 of 12",
+    ]
+    # page numbers differ but normalise to the same line
+    assert not any(line.startswith("Page") for line in lines[4:])
+    # the content of every page is kept
+    assert len(lines) == 15
+    assert "The west division grew its revenue by 12 percent this quarter." in lines
+    stats = boilerplate_filter.stats()
+    assert stats["lines_removed"] == 15
+    assert stats["tokens_saved"] > 0
+
+
+def test_rare_lines_are_kept():
+    text = PAGE_BREAK.join(["Signed by both parties.\nThe end."] * 2)
+    assert BoilerplateFilter(min_repeats=3).strip(text) == text
+
+
+def test_text_without_pages_is_kept():
+    text = "\n".join(["Signed by both parties."] * 5)
+    assert BoilerplateFilter(min_repeats=3).strip(text) == text
+
+
+def test_strip_near_duplicates():
+    footers = [
+        f"acme corporation - printed for internal use {suffix}"
+        for suffix in ["only", "onyl", "only", "olny"]
+    ]
+    bodies = ["First page", "Second page", "Third page", "Fourth page"]
+    pages = [f"{body}\n{footer}" for body, footer in zip(bodies, footers)]
+    # two exact repetitions only
+    assert BoilerplateFilter(max_distance=0).strip_pages(pages) == pages
+    assert BoilerplateFilter(max_distance=10).strip_pages(pages) == [
+        pages[0],
+        *bodies[1:],
+    ]
+
+
+def test_repeated_lines_in_page_bodies_are_kept():
+    pages = [
+        "Annual report\nIntroduction\n"
+        + "\n".join(
+            f"Q{quarter} 2023 revenue 1,{quarter}04 million" for quarter in range(1, 5)
+        )
+        + "\nConclusion\nPage 1",
+        "Annual report\nOutlook\n"
+        + "\n".join(
+            f"Q{quarter} 2024 revenue 1,{quarter}50 million" for quarter in range(1, 5)
+        )
+        + "\nSummary\nPage 2",
+        "Annual report\nAppendix\nQ1 2025 revenue 1,300 million\nEnd\nPage 3",
+    ]
+    stripped = BoilerplateFilter(min_repeats=3, min_length=8).strip_pages(pages)
+    assert stripped[0] == pages[0]
+    for page in stripped[1:]:
+        assert not page.startswith("Annual report")
+    # data rows differing by their numbers only are all kept
+    for quarter in range(1, 5):
+        assert f"Q{quarter} 2023 revenue 1,{quarter}04 million" in stripped[0]
+        assert f"Q{quarter} 2024 revenue 1,{quarter}50 million" in stripped[1]
+
+
+def test_similar_headings_are_kept():
+    headings = [
+        "----- module manipulation",
+        "----- HTML formatting utilities",
+        "----- string manipulation",
+        "----- file handling utilities",
+    ]
+    pages = [f"{heading}\nThe {heading[6:]} functions.\n" for heading in headings]
+    boilerplate_filter = BoilerplateFilter(min_repeats=3, max_distance=3)
+    assert boilerplate_filter.strip_pages(pages) == pages
+    assert boilerplate_filter.lines_removed == 0
+
+
+def test_boilerplate_filter_is_disabled_by_default():
+    assert build_boilerplate_filter() is None
+
+
+def test_invalid_distance():
+    with pytest.raises(ValueError):
+        BoilerplateFilter(max_distance=16)
+
+
+def test_summarise_doc_strips_boilerplate():
+    summariser = GPTSummarisation(
+        "fake_api_key", boilerplate_filter=BoilerplateFilter(min_repeats=3)
+    )
+    summariser.call_open_api = MagicMock(return_value="summary")
+    summariser.summarise_doc(build_document(), min_chunk_tokens=0)
+    prompt = summariser.call_open_api.call_args.kwargs["prompt"]
+    assert prompt.count("ACME Corporation - Confidential") == 1
+    assert summariser.boilerplate_filter.tokens_saved > 0
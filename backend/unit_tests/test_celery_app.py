@@ -0,0 +1,380 @@
+from unittest.mock import MagicMock, call, patch
+import pytest
+from backend import celery_app
+
+
+@pytest.fixture
+def celery_application():
+    # tasks are shared between celery apps, so use the one they are registered with
+    document_store = MagicMock()
+    document_store.put.return_value = "ref"
+    document_store.get.return_value = "Hey"
+    with patch.object(
+        celery_app.celery_application, "task_notifier", MagicMock()
+    ), patch.object(
+        celery_app.celery_application, "run_generate_task", MagicMock()
+    ), patch.object(
+        celery_app.celery_application, "document_store", document_store
+    ), patch.object(
+        celery_app.celery_application, "scheduler", None
+    ):
+        yield celery_app.celery_application
+
+
+def run_parse_task(celery_application, charge_free_tier, remaining_capacity):
+    user_task = MagicMock(
+        user_email="user@example.com",
+        user_file_extension="txt",
+        user_extractive_ratio=0.5,
+    )
+    user = MagicMock(user_docs_capacity=remaining_capacity)
+    with patch("backend.celery_app.UserTasks") as user_tasks, patch(
+        "backend.celery_app.User"
+    ) as users, patch("backend.celery_app.parse_cache") as parse_cache:
+        user_tasks.objects.return_value.first.return_value = user_task
+        users.objects.return_value.modify.return_value = user
+        parse_cache.get_or_parse.return_value = "Hey"
+        celery_application.app.tasks["celery_app.parse_document_celery_task"].apply(
+            kwargs={
+                "user_task_id": "task123",
+                "user_openai_key": "key",
+                "charge_free_tier": charge_free_tier,
+            }
+        )
+    celery_application.document_store.put.assert_called_once_with("Hey")
+    user_task.update.assert_called_once_with(
+        set__user_read_docs_ref="ref", unset__user_upload=True
+    )
+    user_task.user_upload.delete.assert_called_once_with()
+    return users
+
+
+@pytest.mark.parametrize("charge_free_tier", [True, False])
+def test_parse_task_hands_off_to_summarisation(celery_application, charge_free_tier):
+    users = run_parse_task(celery_application, charge_free_tier, 10)
+    assert users.objects.called == charge_free_tier
+    celery_application.run_generate_task.assert_called_once_with(
+        "key", "ref", "task123", True, 0.5
+    )
+    celery_application.task_notifier.assert_not_called()
+    celery_application.document_store.release.assert_not_called()
+
+
+def test_parse_task_exhausted_free_tier(celery_application):
+    run_parse_task(celery_application, True, -1)
+    celery_application.run_generate_task.assert_not_called()
+    notification = celery_application.task_notifier.call_args.args[0]
+    assert notification["task_id"] == "task123"
+    assert notification["task_status"] == "FAILED"
+    assert "free summary generations" in notification["task_error"]
+    celery_application.document_store.release.assert_called_once_with("ref")
+
+
+def run_generate_task(celery_application, summarise_doc):
+    checkpoint_class = MagicMock()
+    with patch.object(
+        celery_application, "checkpoint_class", checkpoint_class
+    ), patch.object(celery_application, "task_retry_delay", 0), patch(
+        "backend.celery_app.GPTSummarisation"
+    ) as summariser_class:
+        summariser_class.return_value.summarise_doc.side_effect = summarise_doc
+        celery_application.app.tasks["celery_app.generate_summary_celery_task"].apply(
+            kwargs={
+                "user_openai_key": "key",
+                "read_docs_ref": "ref",
+                "user_task_id": "task123",
+            }
+        )
+    return summariser_class.return_value.summarise_doc, checkpoint_class
+
+
+def test_generate_task_checkpoints_and_clears(celery_application):
+    summarise_doc, checkpoint_class = run_generate_task(
+        celery_application, lambda text, checkpoint, extractive_ratio: "summary"
+    )
+    checkpoint_class.assert_called_once_with("task123")
+    celery_application.document_store.get.assert_called_once_with("ref")
+    summarise_doc.assert_called_once_with(
+        "Hey", checkpoint=checkpoint_class.return_value, extractive_ratio=1.0
+    )
+    checkpoint_class.return_value.clear.assert_called_once()
+    notification = celery_application.task_notifier.call_args.args[0]
+    assert notification["task_status"] == "SUCCESS"
+    assert notification["generated_summary"] == "summary"
+    celery_application.document_store.release.assert_called_once_with("ref")
+
+
+def test_generate_task_retries_before_failing(celery_application):
+    summarise_doc, checkpoint_class = run_generate_task(
+        celery_application, RuntimeError("chunk failed")
+    )
+    assert summarise_doc.call_count == celery_application.max_task_retries + 1
+    checkpoint_class.return_value.clear.assert_not_called()
+    celery_application.task_notifier.assert_called_once()
+    notification = celery_application.task_notifier.call_args.args[0]
+    assert notification["task_id"] == "task123"
+    assert notification["task_status"] == "FAILED"
+    # kept for the task to be resumed
+    celery_application.document_store.release.assert_not_called()
+
+
+def test_chord_mode_needs_a_result_backend():
+    app = MagicMock()
+    app.conf.result_backend = "rpc://"
+    with pytest.raises(ValueError):
+        celery_app.CeleryApplication(app, execution_mode="chord")
+
+
+def test_fan_out_chunks_skips_checkpointed_chunks(celery_application):
+    checkpoint_class = MagicMock()
+    checkpoint_class.return_value.load.return_value = {0: "summary"}
+    gpt_summariser = MagicMock()
+    gpt_summariser.split_doc.return_value = ["one", "two", "three"]
+    gpt_summariser.boilerplate_filter.tokens_saved = 5
+    celery_application.document_store.put.side_effect = lambda chunk: "ref-" + chunk
+    with patch.object(celery_application, "checkpoint_class", checkpoint_class), patch(
+        "backend.celery_app.chord"
+    ) as chord:
+        celery_application.fan_out_chunks(
+            gpt_summariser, "Hey", "ref", "task123", "key"
+        )
+    checkpoint_class.return_value.start.assert_called_once_with(3)
+    chunk_tasks = chord.call_args.args[0]
+    assert [task["kwargs"]["chunk_index"] for task in chunk_tasks] == [1, 2]
+    assert [task["kwargs"]["chunk_ref"] for task in chunk_tasks] == [
+        "ref-two",
+        "ref-three",
+    ]
+    # checkpointed chunks are not stored again
+    assert celery_application.document_store.put.call_count == 2
+    assemble_task = chord.return_value.call_args.args[0]
+    assert assemble_task["kwargs"]["chunk_refs"] == ["ref-two", "ref-three"]
+    assert (
+        assemble_task["kwargs"]["chunk_digests"]
+        == [checkpoint_class.return_value.chunk_digest.return_value] * 3
+    )
+    assert assemble_task["kwargs"]["boilerplate_tokens_saved"] == 5
+    assert assemble_task["kwargs"]["read_docs_ref"] == "ref"
+
+
+def run_chunk_task(celery_application, summarise_chunk):
+    checkpoint_class = MagicMock()
+    gpt_summariser = MagicMock()
+    gpt_summariser.summarise_chunk.side_effect = summarise_chunk
+    gpt_summariser.output_budget.stats.return_value = {"output_tokens": 1}
+    with patch.object(
+        celery_application, "checkpoint_class", checkpoint_class
+    ), patch.object(celery_application, "task_retry_delay", 0), patch.object(
+        celery_application, "build_summariser", return_value=gpt_summariser
+    ):
+        result = (
+            celery_application.app.tasks["celery_app.summarise_chunk_celery_task"]
+            .apply(
+                kwargs={
+                    "user_openai_key": "key",
+                    "user_task_id": "task123",
+                    "chunk_index": 2,
+                    "chunk_ref": "ref",
+                }
+            )
+            .get()
+        )
+    return result, gpt_summariser.summarise_chunk, checkpoint_class
+
+
+def test_chunk_task_checkpoints_its_summary(celery_application):
+    result, summarise_chunk, checkpoint_class = run_chunk_task(
+        celery_application, lambda chunk: "summary"
+    )
+    assert result == {"output_tokens": 1}
+    summarise_chunk.assert_called_once_with("Hey")
+    checkpoint_class.return_value.save.assert_called_once_with(2, "Hey", "summary")
+
+
+def test_chunk_task_retries_alone_then_gives_up(celery_application):
+    result, summarise_chunk, checkpoint_class = run_chunk_task(
+        celery_application, RuntimeError("chunk failed")
+    )
+    assert result is None
+    assert summarise_chunk.call_count == celery_application.max_task_retries + 1
+    checkpoint_class.return_value.save.assert_not_called()
+    celery_application.task_notifier.assert_not_called()
+
+
+def run_assemble_task(celery_application, summaries, chunk_usages):
+    checkpoint_class = MagicMock()
+    checkpoint_class.return_value.load_digests.return_value = summaries
+    gpt_summariser = MagicMock()
+    gpt_summariser.combine_summaries.side_effect = "\n".join
+    gpt_summariser.output_budget.stats.return_value = {
+        "budgeted_tokens": 10,
+        "output_tokens": 5,
+        "truncated": 0,
+    }
+    with patch.object(
+        celery_application, "checkpoint_class", checkpoint_class
+    ), patch.object(
+        celery_application, "build_summariser", return_value=gpt_summariser
+    ):
+        celery_application.app.tasks["celery_app.assemble_summary_celery_task"].apply(
+            args=(chunk_usages,),
+            kwargs={
+                "user_openai_key": "key",
+                "user_task_id": "task123",
+                "chunk_refs": ["ref1"],
+                "chunk_digests": ["digest0", "digest1"],
+                "boilerplate_tokens_saved": 7,
+                "read_docs_ref": "ref",
+            },
+        )
+    checkpoint_class.return_value.load_digests.assert_called_with(
+        ["digest0", "digest1"]
+    )
+    return checkpoint_class
+
+
+def test_assemble_task_notifies_summary_in_chunk_order(celery_application):
+    usage = {"budgeted_tokens": 20, "output_tokens": 15, "truncated": 1}
+    checkpoint_class = run_assemble_task(
+        celery_application, {1: "second", 0: "first"}, [usage, None]
+    )
+    checkpoint_class.return_value.clear.assert_called_once()
+    notification = celery_application.task_notifier.call_args.args[0]
+    assert notification["task_status"] == "SUCCESS"
+    assert notification["generated_summary"] == "first\nsecond"
+    assert notification["output_tokens_budgeted"] == 30
+    assert notification["output_tokens_used"] == 20
+    assert notification["truncated_requests"] == 1
+    assert notification["boilerplate_tokens_saved"] == 7
+    assert celery_application.document_store.release.call_args_list == [
+        call("ref1"),
+        call("ref"),
+    ]
+
+
+def test_assemble_task_reports_missing_chunks(celery_application):
+    checkpoint_class = run_assemble_task(celery_application, {0: "first"}, [None])
+    checkpoint_class.return_value.clear.assert_not_called()
+    # the chunks are stored again when the task is resumed, the text is kept for it
+    celery_application.document_store.release.assert_called_once_with("ref1")
+    notification = celery_application.task_notifier.call_args.args[0]
+    assert notification["task_status"] == "FAILED"
+    assert notification["task_error"].startswith("1 of 2 chunks")
+
+
+def test_assemble_task_releases_chunks_when_failing(celery_application):
+    with patch.object(celery_application, "max_task_retries", 0), patch.object(
+        celery_application, "notify_summary", side_effect=RuntimeError("down")
+    ):
+        checkpoint_class = run_assemble_task(
+            celery_application, {0: "first", 1: "second"}, [None, None]
+        )
+    checkpoint_class.return_value.clear.assert_not_called()
+    celery_application.document_store.release.assert_called_once_with("ref1")
+    notification = celery_application.task_notifier.call_args.args[0]
+    assert notification["task_status"] == "FAILED"
+
+
+def test_tasks_are_published_through_the_pool():
+    app = MagicMock()
+    publisher_pool = MagicMock()
+    publisher_pool.publish.side_effect = lambda send: send("producer")
+    celery_application = celery_app.CeleryApplication(
+        app, publisher_pool=publisher_pool
+    )
+    celery_application.run_generate_task("key", "ref", "task123")
+    publisher_pool.publish.assert_called_once()
+    assert app.send_task.call_args.args == ("celery_app.generate_summary_celery_task",)
+    assert app.send_task.call_args.kwargs["producer"] == "producer"
+    assert app.send_task.call_args.kwargs["retry"] is False
+    assert app.send_task.call_args.kwargs["kwargs"]["read_docs_ref"] == "ref"
+
+
+@pytest.mark.parametrize("charge_free_tier", [True, False])
+def test_parse_task_schedules_summarisation(celery_application, charge_free_tier):
+    scheduler = MagicMock()
+    with patch.object(celery_application, "scheduler", scheduler):
+        run_parse_task(celery_application, charge_free_tier, 10)
+    celery_application.run_generate_task.assert_not_called()
+    scheduler.queue.assert_called_once_with(
+        "task123",
+        "user@example.com",
+        priority=not charge_free_tier,
+        read_docs_ref="ref",
+        use_summary_cache=True,
+        extractive_ratio=0.5,
+    )
+    scheduler.dispatch.assert_called_once_with()
+
+
+def test_parse_task_leaves_undispatched_tasks_queued(celery_application):
+    scheduler = MagicMock()
+    # e.g. the broker is down while dispatching the task of another user
+    scheduler.dispatch.side_effect = ConnectionError("broker down")
+    with patch.object(celery_application, "scheduler", scheduler):
+        run_parse_task(celery_application, True, 10)
+    scheduler.queue.assert_called_once()
+    celery_application.task_notifier.assert_not_called()
+    celery_application.document_store.release.assert_not_called()
+
+
+def test_parse_task_fails_if_not_queued(celery_application):
+    scheduler = MagicMock()
+    scheduler.queue.side_effect = ConnectionError("db down")
+    with patch.object(celery_application, "scheduler", scheduler):
+        run_parse_task(celery_application, True, 10)
+    scheduler.dispatch.assert_not_called()
+    notification = celery_application.task_notifier.call_args.args[0]
+    assert notification["task_status"] == "FAILED"
+
+
+def dispatch_scheduled_task(priority, user_openai_key):
+    celery_application = celery_app.CeleryApplication(
+        MagicMock(),
+        task_notifier=MagicMock(),
+        scheduler_factory=lambda dispatch: None,
+        priority_queue="priority",
+    )
+    with patch.object(
+        celery_application, "run_generate_task"
+    ) as run_generate_task, patch.dict(
+        celery_app.global_config["OpenAI"], {"API_KEY": "shared key"}
+    ), patch(
+        "backend.celery_app.User"
+    ) as users:
+        users.objects.return_value.only.return_value.first.return_value = MagicMock(
+            user_openai_key=user_openai_key
+        )
+        celery_application.dispatch_scheduled_task(
+            "task123", "user@example.com", priority, "ref", True, 0.5
+        )
+    assert users.objects.called == priority
+    return run_generate_task, celery_application.task_notifier
+
+
+@pytest.mark.parametrize(
+    "priority, expected_key, expected_queue",
+    [(True, "own key", "priority"), (False, "shared key", None)],
+)
+def test_dispatch_scheduled_task(priority, expected_key, expected_queue):
+    run_generate_task, task_notifier = dispatch_scheduled_task(priority, "own key")
+    run_generate_task.assert_called_once_with(
+        expected_key, "ref", "task123", True, 0.5, queue=expected_queue
+    )
+    task_notifier.assert_not_called()
+
+
+def test_dispatch_scheduled_task_without_own_key_fails():
+    run_generate_task, task_notifier = dispatch_scheduled_task(True, None)
+    run_generate_task.assert_not_called()
+    notification = task_notifier.call_args.args[0]
+    assert notification["task_status"] == "FAILED"
+
+
+def test_generate_task_is_routed_to_its_queue():
+    app = MagicMock()
+    celery_application = celery_app.CeleryApplication(app)
+    celery_application.run_generate_task("key", "ref", "task123", queue="priority")
+    assert app.send_task.call_args.kwargs["queue"] == "priority"
+    celery_application.run_generate_task("key", "ref", "task123")
+    assert "queue" not in app.send_task.call_args.kwargs
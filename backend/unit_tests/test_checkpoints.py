@@ -0,0 +1,126 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+import mongoengine
+import pytest
+from backend.checkpoints import TaskCheckpoint
+from backend.models import ChunkSummaryCheckpoint
+from backend.summarise_gpt import GPTSummarisation
+
+
+class InMemoryCheckpoint(TaskCheckpoint):
+    def __init__(self):
+        super().__init__("task123", document_class=MagicMock(), task_class=MagicMock())
+        self.chunks_total = None
+        self.summaries = {}
+
+    def start(self, chunks_total):
+        self.chunks_total = chunks_total
+
+    def load(self, chunks):
+        return dict(self.summaries)
+
+    def save(self, chunk_index, chunk, summary):
+        self.summaries[chunk_index] = summary
+
+
+def build_summariser():
+    summariser = GPTSummarisation("fake_api_key", concurrency=2)
+    summariser.tokenizer = MagicMock()
+    summariser.tokenizer.count.side_effect = lambda text: len(text.split())
+    return summariser
+
+
+def test_load_skips_changed_chunks():
+    document_class = MagicMock()
+    document_class.objects.return_value = [
+        MagicMock(
+            chunk_index=0,
+            chunk_digest=TaskCheckpoint.chunk_digest("first"),
+            summary="first summary",
+        ),
+        MagicMock(
+            chunk_index=1,
+            chunk_digest=TaskCheckpoint.chunk_digest("old second"),
+            summary="old summary",
+        ),
+        MagicMock(
+            chunk_index=5,
+            chunk_digest=TaskCheckpoint.chunk_digest("sixth"),
+            summary="sixth summary",
+        ),
+    ]
+    checkpoint = TaskCheckpoint("task123", document_class=document_class)
+    assert checkpoint.load(["first", "second"]) == {0: "first summary"}
+    document_class.objects.assert_called_once_with(task_id="task123")
+
+
+def test_save_upserts_by_task_and_chunk_index():
+    document_class = MagicMock()
+    checkpoint = TaskCheckpoint("task123", document_class=document_class)
+    checkpoint.save(3, "chunk", "summary")
+    document_class.objects.assert_called_once_with(task_id="task123", chunk_index=3)
+    update = document_class.objects.return_value.update_one.call_args.kwargs
+    assert update["set__chunk_digest"] == TaskCheckpoint.chunk_digest("chunk")
+    assert update["set__summary"] == "summary"
+    assert update["upsert"] is True
+    assert isinstance(update["set_on_insert__created_at"], datetime)
+
+
+def test_saved_checkpoint_has_creation_time():
+    mongomock = pytest.importorskip("mongomock")
+    mongoengine.disconnect()
+    mongoengine.connect(
+        "checkpoints",
+        host="mongodb://localhost",
+        mongo_client_class=mongomock.MongoClient,
+    )
+    try:
+        checkpoint = TaskCheckpoint("task123")
+        checkpoint.save(0, "chunk", "first summary")
+        collection = ChunkSummaryCheckpoint._get_collection()
+        created_at = collection.find_one({"task_id": "task123"})["created_at"]
+        assert isinstance(created_at, datetime)
+        # the creation time the TTL expires from is kept across updates
+        checkpoint.save(0, "chunk", "second summary")
+        raw = collection.find_one({"task_id": "task123"})
+        assert raw["summary"] == "second summary"
+        assert raw["created_at"] == created_at
+    finally:
+        ChunkSummaryCheckpoint._collection = None
+        mongoengine.disconnect()
+
+
+def test_failed_chunk_keeps_completed_summaries():
+    summariser = build_summariser()
+    checkpoint = InMemoryCheckpoint()
+
+    def call_open_api(prompt, prompt_length):
+        chunk = prompt.rsplit("\n", 1)[1]
+        if chunk == "chunk 3":
+            raise RuntimeError("chunk failed")
+        return chunk.upper()
+
+    summariser.call_open_api = MagicMock(side_effect=call_open_api)
+    chunks = [f"chunk {i}" for i in range(6)]
+    with pytest.raises(RuntimeError):
+        summariser.summarise_chunks(chunks, checkpoint=checkpoint)
+    assert checkpoint.summaries == {i: f"CHUNK {i}" for i in range(6) if i != 3}
+
+    summariser.call_open_api = MagicMock(side_effect=lambda prompt, prompt_length: "s")
+    summaries = summariser.summarise_chunks(chunks, checkpoint=checkpoint)
+    assert summaries == ["CHUNK 0", "CHUNK 1", "CHUNK 2", "s", "CHUNK 4", "CHUNK 5"]
+    # only the missing chunk is summarised again
+    assert summariser.call_open_api.call_count == 1
+
+
+def test_summarise_doc_records_chunks_total():
+    summariser = build_summariser()
+    summariser.call_open_api = MagicMock(return_value="s")
+    checkpoint = InMemoryCheckpoint()
+    text = "One two three. Four five six.\n\nSeven eight nine. Ten."
+    summary = summariser.summarise_doc(
+        text, chunk_tokens=6, min_chunk_tokens=3, checkpoint=checkpoint
+    )
+    assert summary == "s\ns"
+    assert checkpoint.chunks_total == 2
+    assert checkpoint.summaries == {0: "s", 1: "s"}
@@ -0,0 +1,56 @@
+import pytest
+from backend.chunker import TokenChunker, Tokenizer
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_paragraphs_are_kept_whole():
+    text = "One two three.\n\nFour five six.\n\n\nSeven eight nine."
+    chunker = TokenChunker(count_words, max_tokens=6)
+    assert chunker.chunk(text) == [
+        "One two three.\n\nFour five six.",
+        "Seven eight nine.",
+    ]
+
+
+def test_long_paragraphs_are_split_between_sentences():
+    text = "One two three. Four five six. Seven eight nine."
+    chunker = TokenChunker(count_words, max_tokens=6)
+    assert chunker.chunk(text) == ["One two three. Four five six.", "Seven eight nine."]
+
+
+def test_long_sentences_are_split_between_words():
+    text = "one two three four five six seven eight nine ten"
+    chunks = TokenChunker(count_words, max_tokens=4).chunk(text)
+    assert all(count_words(chunk) <= 4 for chunk in chunks)
+    assert " ".join(chunks) == text
+
+
+@pytest.mark.parametrize("sentence_count", range(1, 40))
+def test_no_sub_minimum_tail_chunk(sentence_count):
+    text = " ".join(f"Sentence number {i} here." for i in range(sentence_count))
+    chunker = TokenChunker(count_words, max_tokens=40, min_tokens=12)
+    chunks = chunker.chunk(text)
+    assert " ".join(chunks) == text
+    assert all(count_words(chunk) <= 40 for chunk in chunks)
+    if len(chunks) > 1:
+        assert count_words(chunks[-1]) >= 12
+
+
+def test_coarse_tail_is_merged():
+    text = "a b c d e f g h.\n\ni"
+    chunks = TokenChunker(count_words, max_tokens=8, min_tokens=2).chunk(text)
+    assert chunks == ["a b c d e f g h.\n\ni"]
+
+
+def test_invalid_min_tokens():
+    with pytest.raises(ValueError):
+        TokenChunker(count_words, max_tokens=10, min_tokens=6)
+
+
+def test_tokenizer_counts_tokens():
+    tokenizer = Tokenizer("gpt-3.5-turbo-0125")
+    assert tokenizer.count("") == 0
+    assert 0 < tokenizer.count("Hello world, how are you?") < 10
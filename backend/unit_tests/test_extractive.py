@@ -0,0 +1,77 @@
+from unittest.mock import MagicMock
+import numpy as np
+from backend.extractive import ExtractiveCompressor
+from backend.summarise_gpt import GPTSummarisation
+
+SENTENCES = [
+    "The merger between the two banks was approved by the regulator.",
+    "The regulator approved the merger after a long review of the two banks.",
+    "Shareholders of both banks welcomed the merger.",
+    "The weather was sunny.",
+    "The merged bank will close some branches after the merger.",
+    "A cat sat on the mat.",
+]
+
+
+def dense_textrank(compressor, sentences, damping=0.85, iterations=200):
+    rows, columns, values = compressor.tfidf(sentences)
+    tfidf = np.zeros((len(sentences), columns.max() + 1))
+    tfidf[rows, columns] = values
+    similarities = tfidf @ tfidf.T
+    np.fill_diagonal(similarities, 0)
+    row_sums = similarities.sum(axis=1, keepdims=True)
+    transitions = np.where(
+        row_sums > 0,
+        similarities / np.where(row_sums > 0, row_sums, 1),
+        1 / len(sentences),
+    )
+    scores = np.full(len(sentences), 1 / len(sentences))
+    for _ in range(iterations):
+        scores = (1 - damping) / len(sentences) + damping * transitions.T @ scores
+    return scores
+
+
+def test_tfidf_rows_are_normalised():
+    rows, columns, values = ExtractiveCompressor.tfidf(SENTENCES)
+    norms = np.bincount(rows, weights=values**2)
+    assert np.allclose(norms, 1)
+
+
+def test_rank_matches_dense_textrank():
+    compressor = ExtractiveCompressor(iterations=200, tolerance=0)
+    scores = compressor.rank(SENTENCES)
+    assert np.allclose(scores, dense_textrank(compressor, SENTENCES))
+    assert np.isclose(scores.sum(), 1)
+    # sentences about the merger are the most central ones
+    assert set(np.argsort(-scores)[:2]) <= {0, 1, 2, 4}
+    assert np.argmin(scores) in {3, 5}
+
+
+def test_compress_keeps_central_sentences_in_order():
+    text = " ".join(SENTENCES[:3]) + "\n\n" + " ".join(SENTENCES[3:])
+    compressor = ExtractiveCompressor(min_tokens=0)
+    compressed = compressor.compress(text, 0.5)
+    assert len(compressed) <= len(text) / 2
+    kept = [sentence for sentence in SENTENCES if sentence in compressed]
+    assert kept and compressed.replace("\n\n", " ") == " ".join(kept)
+    assert "A cat sat on the mat." not in compressed
+
+
+def test_compress_keeps_short_documents():
+    text = " ".join(SENTENCES)
+    assert ExtractiveCompressor(min_tokens=1000).compress(text, 0.1) == text
+    assert ExtractiveCompressor(min_tokens=0).compress(text, 1) == text
+
+
+def test_summarise_doc_compresses_long_documents():
+    summariser = GPTSummarisation(
+        "fake_api_key", extractive_compressor=ExtractiveCompressor(min_tokens=0)
+    )
+    summariser.call_open_api = MagicMock(return_value="summary")
+    text = " ".join(SENTENCES)
+    summariser.summarise_doc(text, min_chunk_tokens=0, extractive_ratio=0.3)
+    prompt = summariser.call_open_api.call_args.kwargs["prompt"]
+    assert "A cat sat on the mat." not in prompt
+    summariser.summarise_doc(text, min_chunk_tokens=0)
+    prompt = summariser.call_open_api.call_args.kwargs["prompt"]
+    assert "A cat sat on the mat." in prompt
@@ -1,4 +1,7 @@
 import pytest
+import threading
+import time
+from unittest.mock import MagicMock
 from backend.summarise_gpt import GPTSummarisation
 
 import pytest
@@ -17,3 +20,111 @@ import pytest
 def test_get_subset(text, i, j, expected_subset):
     subset = GPTSummarisation.get_subset(text, i, j)
     assert subset == expected_subset
+
+
+def test_summarise_doc_chunks_by_tokens():
+    summariser = GPTSummarisation("fake_api_key", "gpt-3.5-turbo-0125")
+    summariser.tokenizer = MagicMock()
+    summariser.tokenizer.count.side_effect = lambda text: len(text.split())
+    summariser.call_open_api = MagicMock(side_effect=lambda prompt, prompt_length: "s")
+    text = "One two three. Four five six.\n\nSeven eight nine. Ten."
+    assert summariser.summarise_doc(text, chunk_tokens=6, min_chunk_tokens=3) == "s\ns"
+    prompt_lengths = [
+        call.kwargs["prompt_length"] for call in summariser.call_open_api.call_args_list
+    ]
+    assert prompt_lengths == [6, 4]
+
+
+def test_summarise_chunks_concurrently_in_order():
+    summariser = GPTSummarisation("concurrency_api_key", concurrency=4)
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    def call_open_api(prompt, prompt_length):
+        with lock:
+            in_flight.append(prompt)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.01)
+        with lock:
+            in_flight.remove(prompt)
+        return prompt.rsplit("\n", 1)[1].upper()
+
+    summariser.call_open_api = call_open_api
+    chunks = [f"chunk {i}" for i in range(20)]
+    assert summariser.summarise_chunks(chunks) == [chunk.upper() for chunk in chunks]
+    assert 1 < max(max_in_flight) <= 4
+
+
+def test_summarise_chunks_cancels_pending_chunks_on_error():
+    summariser = GPTSummarisation("cancel_api_key", concurrency=2)
+    calls = []
+
+    def call_open_api(prompt, prompt_length):
+        calls.append(prompt)
+        time.sleep(0.01)
+        raise RuntimeError("OpenAI is down")
+
+    summariser.call_open_api = call_open_api
+    chunks = [f"chunk {i}" for i in range(20)]
+    with pytest.raises(RuntimeError):
+        summariser.summarise_chunks(chunks)
+    time.sleep(0.05)
+    assert len(calls) < len(chunks)
+
+
+def test_key_concurrency_is_shared():
+    first = GPTSummarisation("shared_api_key", key_concurrency=2)
+    second = GPTSummarisation("shared_api_key", key_concurrency=2)
+    assert first.key_semaphore is second.key_semaphore
+
+
+def test_key_slot_is_only_held_during_the_request():
+    summariser = GPTSummarisation("slot_api_key", key_concurrency=1)
+    slot_free = []
+
+    def acquire(tokens):
+        # another request of the key may be sent while this one waits
+        slot_free.append(summariser.key_semaphore.acquire(blocking=False))
+        summariser.key_semaphore.release()
+
+    summariser.rate_limiter = MagicMock()
+    summariser.rate_limiter.acquire.side_effect = acquire
+    summariser.call_open_api = MagicMock(return_value="summary")
+    assert summariser.summarise_chunk("chunk") == "summary"
+    assert slot_free == [True]
+
+
+def test_summarise_doc_reduces_to_target():
+    summariser = GPTSummarisation("fake_api_key")
+    summariser.tokenizer = MagicMock()
+    summariser.tokenizer.count.side_effect = lambda text: len(text.split())
+    prompts = []
+
+    def call_open_api(prompt, prompt_length):
+        prompts.append(prompt)
+        # every summary is three words long
+        return "summary of part"
+
+    summariser.call_open_api = call_open_api
+    text = "\n\n".join(f"Paragraph {i} has five words." for i in range(64))
+    summary = summariser.summarise_doc(
+        text, chunk_tokens=10, min_chunk_tokens=0, target_tokens=5
+    )
+    assert summary == "summary of part"
+    reduce_prompts = [
+        prompt for prompt in prompts if prompt.startswith("Can you please combine")
+    ]
+    # 32 chunk summaries are reduced by 3 per level: 11, 4, 2, then 1
+    assert len(prompts) - len(reduce_prompts) == 32
+    assert len(reduce_prompts) == 11 + 4 + 2 + 1
+
+
+def test_summarise_doc_without_target_joins_summaries():
+    summariser = GPTSummarisation("fake_api_key")
+    summariser.call_open_api = MagicMock(return_value="summary")
+    text = "\n\n".join(f"Paragraph {i} has five words." for i in range(4))
+    summary = summariser.summarise_doc(
+        text, chunk_tokens=10, min_chunk_tokens=0, target_tokens=0
+    )
+    assert summary.split("\n") == ["summary"] * summariser.call_open_api.call_count
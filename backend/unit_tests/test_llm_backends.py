@@ -0,0 +1,101 @@
+from unittest.mock import MagicMock
+import openai
+import pytest
+from backend.llm_backends import (
+    Completion,
+    LocalBackend,
+    OpenAIBackend,
+    build_llm_backend,
+)
+from backend.openai_pool import OpenAIClientPool
+from backend.rate_limiter import call_with_retries
+from backend.summarise_gpt import GPTSummarisation
+
+
+def test_build_llm_backend():
+    assert isinstance(build_llm_backend("key", "model", "local"), LocalBackend)
+    backend = build_llm_backend("key", "model", "openai")
+    assert isinstance(backend, OpenAIBackend)
+    assert (backend.api_key, backend.model) == ("key", "model")
+
+
+def test_openai_backend_borrows_pooled_client():
+    client = MagicMock()
+    response = client.chat.completions.create.return_value
+    response.choices = [
+        MagicMock(message=MagicMock(content=" summary \n"), finish_reason="length")
+    ]
+    response.usage.completion_tokens = 10
+    pool = OpenAIClientPool(client_factory=lambda api_key: client)
+    backend = OpenAIBackend("key", "model", client_pool=pool)
+    assert backend.complete("prompt", max_tokens=10) == Completion("summary", 10, True)
+    client.chat.completions.create.assert_called_once_with(
+        model="model",
+        messages=[{"role": "user", "content": "prompt"}],
+        max_tokens=10,
+    )
+    assert len(pool) == 1
+
+
+def test_local_backend_is_deterministic():
+    sleeps = []
+    backend = LocalBackend(
+        latency_mean=0.5,
+        latency_sigma=0.5,
+        output_tokens=5,
+        seed=1,
+        sleep=sleeps.append,
+    )
+    other_backend = LocalBackend(
+        latency_mean=0.5, latency_sigma=0.5, output_tokens=5, seed=1, sleep=MagicMock()
+    )
+    prompt = "Can you summarise one two three four five six seven eight"
+    completion = backend.complete(prompt, max_tokens=100)
+    assert completion == other_backend.complete(prompt, max_tokens=100)
+    assert len(completion.text.split()) == completion.output_tokens == 5
+    assert not completion.truncated
+    assert set(completion.text.split()) <= set(prompt.split())
+    completion = backend.complete(prompt, max_tokens=3)
+    assert len(completion.text.split()) == completion.output_tokens == 3
+    assert completion.truncated
+    assert all(latency > 0 for latency in sleeps)
+
+
+def test_local_backend_latency_distribution():
+    sleeps = []
+    backend = LocalBackend(
+        latency_mean=0.2, latency_sigma=0.5, output_tokens=5, sleep=sleeps.append
+    )
+    for _ in range(2000):
+        backend.complete("prompt", max_tokens=5)
+    assert sum(sleeps) / len(sleeps) == pytest.approx(0.2, rel=0.1)
+    assert len(set(sleeps)) > 1
+
+
+def test_local_backend_errors_are_retried():
+    backend = LocalBackend(latency_mean=0, error_rate=0.5, sleep=MagicMock())
+    outcomes = []
+    for _ in range(200):
+        try:
+            backend.complete("prompt", max_tokens=5)
+            outcomes.append(True)
+        except openai.InternalServerError:
+            outcomes.append(False)
+    assert 0.3 < outcomes.count(False) / len(outcomes) < 0.7
+    completion = call_with_retries(
+        lambda: backend.complete("prompt", max_tokens=5),
+        max_retries=20,
+        sleep=MagicMock(),
+    )
+    assert completion.text == "prompt prompt prompt prompt prompt"
+
+
+def test_summarise_doc_with_local_backend():
+    backend = LocalBackend(latency_mean=0, output_tokens=3)
+    summariser = GPTSummarisation("fake_api_key", backend=backend)
+    text = "\n\n".join(f"Paragraph {i} has five words." for i in range(10))
+    summary = summariser.summarise_doc(text, chunk_tokens=20, min_chunk_tokens=0)
+    assert summary == summariser.summarise_doc(
+        text, chunk_tokens=20, min_chunk_tokens=0
+    )
+    assert all(len(line.split()) == 3 for line in summary.split("\n"))
@@ -40,3 +40,21 @@ def test_custom_middleware():
     )
     logger_mock.info.assert_any_call("Request Body: ")
     logger_mock.error.assert_not_called()
+
+
+def test_custom_middleware_rejects_large_upload():
+    logger_mock = MagicMock()
+    app = FastAPI()
+    app.middleware("http")(
+        CustomMiddleware(logger_mock, max_upload_size=8).generate_middleware()
+    )
+    handler = MagicMock(return_value={})
+    app.post("/upload")(handler)
+
+    client = TestClient(app)
+    response = client.post(
+        "/upload", files={"file": ("test.txt", b"a" * (128 * 1024), "text/plain")}
+    )
+
+    assert response.status_code == 413
+    handler.assert_not_called()
@@ -0,0 +1,86 @@
+from unittest.mock import MagicMock
+import requests
+from backend.notification_channel import NotificationChannel, build_session
+
+
+def build_channel(**kwargs):
+    session = MagicMock()
+    options = {"batch_window": 0.5, "max_batch": 100, "timeout": 3}
+    options.update(kwargs)
+    return NotificationChannel("http://api", session=session, **options), session
+
+
+def notification(task_id, notification_auth="key"):
+    return {
+        "notification_auth": notification_auth,
+        "task_id": task_id,
+        "task_status": "SUCCESS",
+    }
+
+
+def posted_task_ids(session):
+    return [
+        [item["task_id"] for item in call.kwargs["json"]["notifications"]]
+        for call in session.post.call_args_list
+    ]
+
+
+def test_notifications_in_a_window_are_batched():
+    channel, session = build_channel()
+    for task_id in ("task1", "task2", "task3"):
+        channel.notify(notification(task_id))
+    channel.close()
+    session.post.assert_called_once()
+    call = session.post.call_args
+    assert call.args == ("http://api/notify/tasks",)
+    assert call.kwargs["timeout"] == 3
+    assert call.kwargs["json"]["notification_auth"] == "key"
+    assert posted_task_ids(session) == [["task1", "task2", "task3"]]
+    assert "notification_auth" not in call.kwargs["json"]["notifications"][0]
+    assert channel.sent == 3
+
+
+def test_batches_are_bounded():
+    channel, session = build_channel(max_batch=2)
+    for task_id in ("task1", "task2", "task3"):
+        channel.notify(notification(task_id))
+    channel.close()
+    assert posted_task_ids(session) == [["task1", "task2"], ["task3"]]
+
+
+def test_notifications_are_grouped_by_key():
+    channel, session = build_channel()
+    channel.notify(notification("task1", "key1"))
+    channel.notify(notification("task2", "key2"))
+    channel.close()
+    keys = [
+        call.kwargs["json"]["notification_auth"] for call in session.post.call_args_list
+    ]
+    assert keys == ["key1", "key2"]
+
+
+def test_failed_notifications_are_counted():
+    channel, session = build_channel(batch_window=0)
+    session.post.side_effect = requests.ConnectionError("gateway down")
+    channel.notify(notification("task1"))
+    channel.close()
+    assert channel.failed == 1
+    assert channel.sent == 0
+
+
+def test_channel_restarts_after_close():
+    channel, session = build_channel(batch_window=0)
+    channel.notify(notification("task1"))
+    channel.close()
+    channel.notify(notification("task2"))
+    channel.close()
+    assert posted_task_ids(session) == [["task1"], ["task2"]]
+
+
+def test_build_session_retries_posts():
+    session = build_session(max_retries=4, backoff_factor=0.1)
+    retry = session.get_adapter("http://api").max_retries
+    assert retry.total == 4
+    assert retry.backoff_factor == 0.1
+    assert "POST" in retry.allowed_methods
+    assert 503 in retry.status_forcelist
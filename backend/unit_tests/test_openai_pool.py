@@ -0,0 +1,72 @@
+from unittest.mock import MagicMock
+from backend.openai_pool import OpenAIClientPool, build_openai_client
+
+
+def build_pool(**kwargs):
+    return OpenAIClientPool(client_factory=lambda api_key: MagicMock(), **kwargs)
+
+
+def test_build_openai_client():
+    client = build_openai_client("fake_api_key")
+    assert client.api_key == "fake_api_key"
+    assert client.max_retries == 0
+    client.close()
+
+
+def test_borrow_reuses_client():
+    pool = build_pool(max_size=4, idle_timeout=600)
+    with pool.borrow("key", "model") as client:
+        pass
+    with pool.borrow("key", "model") as same_client:
+        assert same_client is client
+    with pool.borrow("key", "other_model") as other_client:
+        assert other_client is not client
+    with pool.borrow("other_key", "model") as other_client:
+        assert other_client is not client
+    assert len(pool) == 3
+
+
+def test_pool_is_bounded():
+    pool = build_pool(max_size=2, idle_timeout=600)
+    with pool.borrow("key_1", "model") as first_client:
+        pass
+    with pool.borrow("key_2", "model"):
+        pass
+    with pool.borrow("key_1", "model"):
+        pass
+    with pool.borrow("key_3", "model"):
+        pass
+    assert len(pool) == 2
+    with pool.borrow("key_1", "model") as client:
+        assert client is first_client
+
+
+def test_clients_in_use_are_not_evicted():
+    pool = build_pool(max_size=1, idle_timeout=600)
+    with pool.borrow("key_1", "model") as first_client:
+        with pool.borrow("key_2", "model"):
+            assert len(pool) == 2
+        first_client.close.assert_not_called()
+    with pool.borrow("key_3", "model"):
+        pass
+    first_client.close.assert_called_once()
+    assert len(pool) == 1
+
+
+def test_idle_clients_are_closed():
+    pool = build_pool(max_size=4, idle_timeout=0)
+    with pool.borrow("key_1", "model") as idle_client:
+        pass
+    with pool.borrow("key_2", "model"):
+        pass
+    idle_client.close.assert_called_once()
+    assert len(pool) == 1
+
+
+def test_close():
+    pool = build_pool()
+    with pool.borrow("key", "model") as client:
+        pass
+    pool.close()
+    client.close.assert_called_once()
+    assert len(pool) == 0
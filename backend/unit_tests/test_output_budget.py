@@ -0,0 +1,71 @@
+from unittest.mock import MagicMock
+import pytest
+from backend.llm_backends import Completion, LLMBackend
+from backend.output_budget import OutputBudget
+from backend.summarise_gpt import GPTSummarisation
+
+
+@pytest.mark.parametrize(
+    "input_tokens, max_tokens, budget",
+    [
+        (2000, None, 500),  # compression ratio
+        (400, None, 100),
+        (100, None, 64),  # lower bound
+        (10, None, 10),  # never longer than the input
+        (20000, None, 1024),  # upper bound
+        (2000, 300, 300),  # target length
+        (0, None, 1),
+    ],
+)
+def test_budget(input_tokens, max_tokens, budget):
+    output_budget = OutputBudget(compression_ratio=0.25, min_tokens=64, max_tokens=1024)
+    assert output_budget.budget(input_tokens, max_tokens) == budget
+
+
+@pytest.mark.parametrize(
+    "compression_ratio, min_tokens, max_tokens",
+    [(0, 64, 1024), (0.25, 0, 1024), (0.25, 64, 32)],
+)
+def test_invalid_budget(compression_ratio, min_tokens, max_tokens):
+    with pytest.raises(ValueError):
+        OutputBudget(compression_ratio, min_tokens, max_tokens)
+
+
+def test_stats():
+    output_budget = OutputBudget()
+    assert output_budget.stats()["utilisation"] == 0.0
+    output_budget.record(100, 50, False)
+    output_budget.record(100, 100, True)
+    assert output_budget.stats() == {
+        "requests": 2,
+        "budgeted_tokens": 200,
+        "output_tokens": 150,
+        "truncated": 1,
+        "utilisation": 0.75,
+    }
+
+
+class RecordingBackend(LLMBackend):
+    def __init__(self):
+        self.max_tokens = []
+
+    def complete(self, prompt, max_tokens):
+        self.max_tokens.append(max_tokens)
+        return Completion("summary", max_tokens // 2, False)
+
+
+def test_summariser_budgets_and_records_usage():
+    backend = RecordingBackend()
+    summariser = GPTSummarisation(
+        "fake_api_key",
+        backend=backend,
+        output_budget=OutputBudget(compression_ratio=0.5, min_tokens=2, max_tokens=100),
+    )
+    summariser.tokenizer = MagicMock()
+    summariser.tokenizer.count.side_effect = lambda text: len(text.split())
+    text = "One two three four five six seven eight.\n\nNine ten eleven twelve."
+    summariser.summarise_doc(text, chunk_tokens=8, min_chunk_tokens=0)
+    assert sorted(backend.max_tokens) == [2, 4]
+    stats = summariser.output_budget.stats()
+    assert stats["budgeted_tokens"] == 6
+    assert stats["output_tokens"] == 3
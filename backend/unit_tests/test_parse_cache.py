@@ -0,0 +1,68 @@
+import fitz
+import io
+import os
+import tempfile
+from unittest.mock import patch
+import pytest
+from backend.parse_cache import DiskCacheTier, MemoryCacheTier, ParseCache
+from backend.parser import ParserFactory
+
+
+def test_memory_tier_evicts_least_recently_used():
+    memory_tier = MemoryCacheTier(max_bytes=250)
+    memory_tier.put("a", "a" * 60)
+    memory_tier.put("b", "b" * 60)
+    memory_tier.get("a")
+    memory_tier.put("c", "c" * 60)
+    assert memory_tier.get("a") is not None
+    assert memory_tier.get("b") is None
+    assert memory_tier.get("c") is not None
+    assert memory_tier.current_bytes <= memory_tier.max_bytes
+
+
+def test_disk_tier_evicts_to_size():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        disk_tier = DiskCacheTier(cache_dir, max_bytes=150)
+        disk_tier.put("a", "a" * 100)
+        disk_tier.put("b", "b" * 100)
+        assert disk_tier.get("a") is None
+        assert disk_tier.get("b") == "b" * 100
+
+
+def test_get_or_parse_skips_parsing_on_hit():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        parse_cache = ParseCache(
+            MemoryCacheTier(1024 * 1024), DiskCacheTier(cache_dir, 1024 * 1024)
+        )
+        assert parse_cache.get_or_parse(b"Hey", "txt") == "Hey"
+        with patch.object(ParserFactory, "build") as build:
+            assert parse_cache.get_or_parse(b"Hey", "txt") == "Hey"
+            build.assert_not_called()
+        assert parse_cache.stats()["memory_hits"] == 1
+        assert parse_cache.stats()["misses"] == 1
+
+        # a fresh process only shares the disk tier
+        restarted_cache = ParseCache(
+            MemoryCacheTier(1024 * 1024), DiskCacheTier(cache_dir, 1024 * 1024)
+        )
+        assert restarted_cache.get_or_parse(b"Hey", "txt") == "Hey"
+        assert restarted_cache.stats()["disk_hits"] == 1
+
+
+def test_get_or_parse_unsupported_extension():
+    parse_cache = ParseCache(MemoryCacheTier(1024))
+    with pytest.raises(NotImplementedError):
+        parse_cache.get_or_parse(b"Hey", "poiuy")
+
+
+def test_get_or_parse_reads_content_not_name():
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "ATTACKER UPLOAD")
+    upload = io.BytesIO(doc.tobytes())
+    doc.close()
+    # GridFS files carry the filename sent by the client
+    upload.name = os.path.abspath("unit_tests/test.pdf")
+    parse_cache = ParseCache(MemoryCacheTier(1024 * 1024))
+    assert parse_cache.get_or_parse(upload, "pdf").strip() == "ATTACKER UPLOAD"
+    with open("unit_tests/test.pdf", "rb") as file:
+        assert parse_cache.get_or_parse(file.read(), "pdf").strip() == "Hello"
@@ -1,6 +1,17 @@
+import fitz
+import os
 import unittest
 from io import BytesIO
-from backend.parser import ParserFactory, DocxParser, TxtParser, PDFParser
+from docx import Document
+from docx.shared import Inches
+from backend.parser import (
+    ParserFactory,
+    DocxParser,
+    TxtParser,
+    PDFParser,
+    get_page_executor,
+    sniff_encoding,
+)
 
 
 def open_file_binary_str(file_path: str):
@@ -31,6 +42,23 @@ class TestParserFactory(unittest.TestCase):
         with self.assertRaises(NotImplementedError):
             parser = factory.build()
 
+    def test_build_from_magic_bytes(self):
+        for file_path, parser_class in [
+            ("unit_tests/test.docx", DocxParser),
+            ("unit_tests/test.pdf", PDFParser),
+        ]:
+            file_like_object = open_file_binary_str(file_path)
+            for file_extension in ["", "PDF", "docx", "bin"]:
+                factory = ParserFactory(file_like_object, file_extension)
+                self.assertIsInstance(factory.build(), parser_class)
+
+    def test_build_text_without_extension(self):
+        factory = ParserFactory(b"Hey", "")
+        self.assertIsInstance(factory.build(), TxtParser)
+        factory = ParserFactory(b"\x00\x01\x02", "")
+        with self.assertRaises(NotImplementedError):
+            factory.build()
+
 
 class TestTxtParser(unittest.TestCase):
     def test_parse_txt(self):
@@ -60,3 +88,113 @@ class TestPDFParser(unittest.TestCase):
         parser = factory.build()
         text = parser.read().strip()
         assert text == "Hello"
+
+    def test_name_of_file_object_is_not_opened(self):
+        doc = fitz.open()
+        doc.new_page().insert_text((72, 72), "ATTACKER UPLOAD")
+        file_like_object = BytesIO(doc.tobytes())
+        doc.close()
+        # e.g. a GridFS file named by the client after a file on the server
+        file_like_object.name = os.path.abspath("unit_tests/test.pdf")
+        for parallel_workers in [1, 2]:
+            parser = PDFParser(
+                file_like_object,
+                parallel_page_threshold=1,
+                parallel_workers=parallel_workers,
+            )
+            assert parser.read().strip() == "ATTACKER UPLOAD"
+
+
+class TestIterPages(unittest.TestCase):
+    def test_read_matches_iter_pages(self):
+        for file_path, file_extension in [
+            ("unit_tests/test.txt", "txt"),
+            ("unit_tests/test.docx", "docx"),
+            ("unit_tests/test.pdf", "pdf"),
+        ]:
+            file_like_object = open_file_binary_str(file_path)
+            parser = ParserFactory(file_like_object, file_extension).build()
+            assert parser.read() == "".join(parser.iter_pages())
+
+    def test_iter_blocks(self):
+        file_like_object = open_file_binary_str("unit_tests/test.pdf")
+        parser = ParserFactory(file_like_object, "pdf").build()
+        blocks = list(parser.iter_blocks())
+        assert [block.strip() for block in blocks] == ["Hello"]
+
+    def test_txt_iter_blocks(self):
+        parser = TxtParser(b"first\nsecond\n")
+        assert list(parser.iter_blocks()) == ["first\n", "second\n"]
+
+
+class TestParallelPDFParser(unittest.TestCase):
+    def test_parallel_matches_serial(self):
+        file_like_object = open_file_binary_str("unit_tests/test.pdf")
+        serial_parser = PDFParser(file_like_object, parallel_workers=1)
+        parallel_parser = PDFParser(
+            file_like_object, parallel_page_threshold=1, parallel_workers=2
+        )
+        assert parallel_parser.read() == serial_parser.read()
+        assert parallel_parser.read().strip() == "Hello"
+
+    def test_parallel_reuses_executor(self):
+        content = open_file_binary_str("unit_tests/test.pdf")
+        PDFParser(content, parallel_page_threshold=1, parallel_workers=2).read()
+        executor = get_page_executor(2)
+        parser = PDFParser(content, parallel_page_threshold=1, parallel_workers=2)
+        assert parser.read().strip() == "Hello"
+        assert get_page_executor(2) is executor
+
+
+class TestStreamingDocxParser(unittest.TestCase):
+    def build_docx(self):
+        document = Document()
+        document.sections[0].header.paragraphs[0].text = "Confidential"
+        document.add_paragraph("Before the table")
+        table = document.add_table(rows=2, cols=2)
+        for row_index, row in enumerate(table.rows):
+            for cell_index, cell in enumerate(row.cells):
+                cell.text = f"cell {row_index}.{cell_index}"
+        document.add_paragraph("After\tthe table")
+        file_like_object = BytesIO()
+        document.save(file_like_object)
+        return file_like_object.getvalue()
+
+    def test_parse_tables_and_headers_in_order(self):
+        parser = DocxParser(self.build_docx())
+        blocks = list(parser.iter_blocks())
+        assert blocks[0] == "Confidential"
+        assert blocks.index("Before the table") < blocks.index("cell 0.0\tcell 0.1")
+        assert blocks.index("cell 1.0\tcell 1.1") < blocks.index("After\tthe table")
+
+    def test_tab_stops_are_not_text(self):
+        document = Document()
+        paragraph = document.add_paragraph("Name")
+        paragraph.paragraph_format.tab_stops.add_tab_stop(Inches(1))
+        paragraph.paragraph_format.tab_stops.add_tab_stop(Inches(2))
+        file_like_object = BytesIO()
+        document.save(file_like_object)
+        parser = DocxParser(file_like_object.getvalue())
+        assert list(parser.iter_blocks()) == ["Name"]
+
+
+class TestIncrementalTxtParser(unittest.TestCase):
+    def test_sniff_encoding(self):
+        assert sniff_encoding("Héllo".encode("utf-8")) == "utf-8"
+        assert sniff_encoding("Héllo".encode("utf-8-sig")) == "utf-8-sig"
+        assert sniff_encoding("Héllo".encode("utf-16")) == "utf-16"
+        assert sniff_encoding("Héllo".encode("utf-32")) == "utf-32"
+        assert sniff_encoding("Héllo".encode("latin-1")) == "cp1252"
+        assert sniff_encoding(b"\x81\x8d") == "latin-1"
+
+    def test_decode_across_blocks(self):
+        text = "Héllo wörld\nnäive\r\nlast line"
+        for encoding in ["utf-8", "utf-16", "latin-1"]:
+            parser = TxtParser(text.encode(encoding), block_size=3, sniff_size=3)
+            assert parser.read() == text
+            assert list(parser.iter_blocks()) == text.splitlines(keepends=True)
+
+    def test_empty_file(self):
+        parser = TxtParser(b"")
+        assert parser.read() == ""
+        assert list(parser.iter_blocks()) == []
@@ -0,0 +1,153 @@
+from unittest.mock import MagicMock
+import threading
+import pytest
+from backend.publisher_pool import PublisherPool, build_publisher_pool
+
+
+class FakeConnection:
+    connection_errors = (ConnectionError,)
+    channel_errors = ()
+
+    def __init__(self):
+        self.connected = True
+        self.closed = False
+        self.heartbeat_error = None
+
+    def ensure_connection(self, max_retries=None):
+        pass
+
+    def heartbeat_check(self):
+        if self.heartbeat_error is not None:
+            raise self.heartbeat_error
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def build_pool(**kwargs):
+    connections = []
+
+    def connection_factory():
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    clock = FakeClock()
+    options = {
+        "max_connections": 2,
+        "health_check_interval": 30,
+        "max_publishes": 100,
+        "max_age": 3600,
+        "acquire_timeout": 0.05,
+    }
+    options.update(kwargs)
+    pool = PublisherPool(
+        connection_factory,
+        lambda connection: ("producer", connection),
+        clock=clock,
+        **options,
+    )
+    return pool, connections, clock
+
+
+def test_publish_reuses_connections():
+    pool, connections, _ = build_pool()
+    producers = [pool.publish(lambda producer: producer) for _ in range(5)]
+    assert len(connections) == 1
+    assert set(producers) == {("producer", connections[0])}
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["reused"] == 4
+    assert stats["publishes"] == 5
+    assert stats["idle"] == 1
+
+
+def test_connections_are_bounded():
+    pool, connections, _ = build_pool()
+    first = pool.acquire()
+    second = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    released = threading.Timer(0.01, pool.release, args=(first,))
+    released.start()
+    pool.acquire_timeout = 1
+    assert pool.acquire() is first
+    released.join()
+    assert len(connections) == 2
+    pool.discard(second)
+    assert second.connection.closed
+    assert pool.stats()["connections"] == 1
+
+
+def test_connections_are_recycled():
+    pool, connections, clock = build_pool(max_publishes=2)
+    for _ in range(3):
+        pool.publish(lambda producer: None)
+    assert len(connections) == 2
+    assert connections[0].closed
+    clock.now = 3600
+    pool.publish(lambda producer: None)
+    assert connections[1].closed
+    assert pool.stats()["recycled"] == 2
+
+
+def test_idle_connections_are_health_checked():
+    pool, connections, clock = build_pool()
+    pool.publish(lambda producer: None)
+    connections[0].heartbeat_error = ConnectionError("missed heartbeats")
+    clock.now = 10
+    pool.publish(lambda producer: None)
+    assert len(connections) == 1
+    clock.now = 60
+    pool.publish(lambda producer: None)
+    assert len(connections) == 2
+    assert connections[0].closed
+    assert pool.stats()["unhealthy"] == 1
+
+
+def test_publish_reconnects_on_failure():
+    pool, connections, _ = build_pool()
+    send = MagicMock(side_effect=[ConnectionError("connection reset"), "sent"])
+    assert pool.publish(send) == "sent"
+    assert len(connections) == 2
+    assert connections[0].closed
+    stats = pool.stats()
+    assert stats["failures"] == 1
+    assert stats["connections"] == 1
+
+
+def test_publish_gives_up_after_attempts():
+    pool, connections, _ = build_pool()
+    with pytest.raises(ConnectionError):
+        pool.publish(MagicMock(side_effect=ConnectionError("broker down")))
+    assert all(connection.closed for connection in connections)
+    assert pool.stats()["connections"] == 0
+
+
+def test_other_errors_discard_the_connection():
+    pool, connections, _ = build_pool()
+    with pytest.raises(ValueError):
+        pool.publish(MagicMock(side_effect=ValueError("bad message")))
+    assert len(connections) == 1
+    assert connections[0].closed
+    assert pool.stats()["failures"] == 0
+
+
+def test_close_closes_idle_connections():
+    pool, connections, _ = build_pool()
+    pool.publish(lambda producer: None)
+    pool.close()
+    assert connections[0].closed
+    assert pool.stats()["connections"] == 0
+
+
+def test_build_publisher_pool():
+    assert build_publisher_pool(MagicMock(), 0) is None
+    assert build_publisher_pool(MagicMock(), 3).max_connections == 3
@@ -12,6 +12,7 @@ from backend.pydantic_models import (
     LoginUser,
     PasswordResetRequestModel,
     TaskCompletionNotification,
+    TaskCompletionNotifications,
 )
 
 
@@ -88,3 +89,18 @@ def test_task_completion_notification_model():
     }
     with pytest.raises(ValidationError):
         TaskCompletionNotification(**invalid_notification_data)
+
+
+def test_task_completion_notifications_model():
+    assert TaskCompletionNotifications(
+        notification_auth="auth_key",
+        notifications=[
+            {"task_id": "task123", "task_status": "SUCCESS", "generated_summary": "s"},
+            {"task_id": "task456", "task_status": "FAILED"},
+        ],
+    )
+
+    with pytest.raises(ValidationError):
+        TaskCompletionNotifications(
+            notification_auth="auth_key", notifications=[{"task_id": "task123"}]
+        )
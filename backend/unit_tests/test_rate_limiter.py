@@ -0,0 +1,79 @@
+from unittest.mock import MagicMock
+import httpx
+import openai
+import pytest
+from backend.rate_limiter import (
+    LocalBucketStore,
+    RateLimiter,
+    call_with_retries,
+    get_retry_after,
+)
+
+
+def rate_limit_error(headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers=headers or {}, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_local_bucket_store():
+    store = LocalBucketStore()
+    assert store.take("bucket", 6, capacity=10, rate=1) == 0
+    assert store.take("bucket", 4, capacity=10, rate=1) == 0
+    wait = store.take("bucket", 2, capacity=10, rate=1)
+    assert 1.9 < wait <= 2
+    assert store.take("other_bucket", 10, capacity=10, rate=1) == 0
+
+
+def test_rate_limiter_takes_from_both_buckets():
+    store = MagicMock()
+    store.take.side_effect = [0, 0.5, 0]
+    rate_limiter = RateLimiter(store, "api_key", 60, 600)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        sleep = MagicMock()
+        monkeypatch.setattr("backend.rate_limiter.time.sleep", sleep)
+        rate_limiter.acquire(1000)
+    sleep.assert_called_once_with(0.5)
+    requests_call, tokens_call, _ = store.take.call_args_list
+    assert requests_call.args[0].endswith(":requests")
+    assert requests_call.args[1:] == (1, 60, 1)
+    # requests larger than the bucket are clamped to its capacity
+    assert tokens_call.args[0].endswith(":tokens")
+    assert tokens_call.args[1:] == (600, 600, 10)
+    assert "api_key" not in rate_limiter.bucket_prefix
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({}, None),
+        ({"retry-after": "7"}, 7),
+        ({"retry-after-ms": "1500", "retry-after": "2"}, 1.5),
+        ({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, None),
+    ],
+)
+def test_get_retry_after(headers, expected):
+    assert get_retry_after(rate_limit_error(headers)) == expected
+
+
+def test_call_with_retries_honours_retry_after():
+    function = MagicMock(
+        side_effect=[rate_limit_error({"retry-after": "3"}), rate_limit_error(), "ok"]
+    )
+    sleep = MagicMock()
+    assert call_with_retries(function, max_retries=2, base_delay=1, sleep=sleep) == "ok"
+    first_delay, second_delay = [call.args[0] for call in sleep.call_args_list]
+    assert 3 <= first_delay <= 4
+    assert 0 <= second_delay <= 2
+
+
+def test_call_with_retries_gives_up():
+    function = MagicMock(side_effect=rate_limit_error())
+    with pytest.raises(openai.RateLimitError):
+        call_with_retries(function, max_retries=2, sleep=MagicMock())
+    assert function.call_count == 3
+
+    function = MagicMock(side_effect=ValueError)
+    with pytest.raises(ValueError):
+        call_with_retries(function, max_retries=2, sleep=MagicMock())
+    assert function.call_count == 1
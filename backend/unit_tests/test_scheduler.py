@@ -0,0 +1,234 @@
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+import pytest
+from backend.scheduler import FairScheduler, MongoSchedulerStore, build_scheduler
+
+
+class InMemorySchedulerStore:
+    def __init__(self):
+        self.tasks = []
+        self.running = {}
+        self.last_dispatched = {}
+
+    def add(self, task_id, user_email, priority, dispatch_kwargs):
+        self.tasks = [task for task in self.tasks if task["task_id"] != task_id]
+        self.tasks.append(
+            {
+                "task_id": task_id,
+                "user_email": user_email,
+                "priority": priority,
+                "dispatch_kwargs": dispatch_kwargs,
+                "status": "QUEUED",
+                "dispatched_at": None,
+            }
+        )
+
+    def queued_users(self):
+        queued = {}
+        for task in self.tasks:
+            if task["status"] == "QUEUED":
+                queued[task["user_email"]] = (
+                    queued.get(task["user_email"], False) or task["priority"]
+                )
+        return [
+            (user_email, priority, self.last_dispatched.get(user_email))
+            for user_email, priority in queued.items()
+        ]
+
+    def claim_slot(self, user_email, cap, now):
+        if self.running.get(user_email, 0) >= cap:
+            return False
+        self.running[user_email] = self.running.get(user_email, 0) + 1
+        self.last_dispatched[user_email] = now
+        return True
+
+    def release_slot(self, user_email):
+        self.running[user_email] = max(self.running.get(user_email, 0) - 1, 0)
+
+    def claim_task(self, user_email, now):
+        queued = [
+            task
+            for task in self.tasks
+            if task["user_email"] == user_email and task["status"] == "QUEUED"
+        ]
+        if not queued:
+            return None
+        task = sorted(queued, key=lambda task: not task["priority"])[0]
+        task["status"] = "DISPATCHED"
+        task["dispatched_at"] = now
+        return {key: task[key] for key in ("task_id", "priority", "dispatch_kwargs")}
+
+    def requeue(self, task_id):
+        for task in self.tasks:
+            if task["task_id"] == task_id:
+                task["status"] = "QUEUED"
+
+    def finish(self, task_id):
+        for task in self.tasks:
+            if task["task_id"] == task_id and task["status"] == "DISPATCHED":
+                self.tasks.remove(task)
+                return task["user_email"]
+        return None
+
+    def dispatched_before(self, before):
+        return [
+            task["task_id"]
+            for task in self.tasks
+            if task["status"] == "DISPATCHED" and task["dispatched_at"] < before
+        ]
+
+    def dispatched_count(self):
+        return sum(task["status"] == "DISPATCHED" for task in self.tasks)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime(2024, 1, 1)
+
+    def __call__(self):
+        # every dispatch happens at a later time
+        self.now += timedelta(seconds=1)
+        return self.now
+
+
+def build_scheduler_with_store(**kwargs):
+    dispatched = []
+    options = {
+        "max_running_per_user": 2,
+        "priority_max_running_per_user": 3,
+        "max_dispatched": 0,
+        "dispatch_timeout": 3600,
+    }
+    options.update(kwargs)
+    scheduler = FairScheduler(
+        lambda task_id, user_email, priority, **dispatch_kwargs: dispatched.append(
+            task_id
+        ),
+        store=InMemorySchedulerStore(),
+        clock=FakeClock(),
+        **options,
+    )
+    return scheduler, dispatched
+
+
+def test_users_are_capped():
+    scheduler, dispatched = build_scheduler_with_store()
+    for task_number in range(5):
+        scheduler.enqueue(f"bulk{task_number}", "bulk@example.com", read_docs_ref="ref")
+    scheduler.enqueue("single", "single@example.com", read_docs_ref="ref")
+    assert dispatched == ["bulk0", "bulk1", "single"]
+    scheduler.complete(["bulk0"])
+    assert dispatched[-1] == "bulk2"
+
+
+def test_priority_lane_has_a_higher_cap():
+    scheduler, dispatched = build_scheduler_with_store()
+    for task_number in range(5):
+        scheduler.enqueue(f"own{task_number}", "own@example.com", priority=True)
+    assert dispatched == ["own0", "own1", "own2"]
+
+
+def test_round_robin_under_a_global_cap():
+    scheduler, dispatched = build_scheduler_with_store(max_dispatched=2)
+    for task_number in range(3):
+        scheduler.store.add(f"a{task_number}", "a@example.com", False, {})
+        scheduler.store.add(f"b{task_number}", "b@example.com", False, {})
+    scheduler.store.add("own", "own@example.com", True, {})
+    scheduler.dispatch()
+    # the priority lane first, then the users in turn
+    assert dispatched == ["own", "a0"]
+    scheduler.complete(["own"])
+    assert dispatched[-1] == "b0"
+    scheduler.complete(["a0"])
+    scheduler.complete(["b0"])
+    assert dispatched[-2:] == ["a1", "b1"]
+
+
+def test_complete_is_idempotent():
+    scheduler, dispatched = build_scheduler_with_store(max_running_per_user=1)
+    scheduler.enqueue("task1", "user@example.com")
+    scheduler.enqueue("task2", "user@example.com")
+    scheduler.enqueue("task3", "user@example.com")
+    scheduler.complete(["task1"])
+    scheduler.complete(["task1", "unscheduled"])
+    assert dispatched == ["task1", "task2"]
+    assert scheduler.store.running["user@example.com"] == 1
+
+
+def test_failed_dispatches_are_requeued():
+    scheduler, _ = build_scheduler_with_store()
+    scheduler.dispatch_task = MagicMock(side_effect=ConnectionError("broker down"))
+    with pytest.raises(ConnectionError):
+        scheduler.enqueue("task1", "user@example.com", read_docs_ref="ref")
+    assert scheduler.store.tasks[0]["status"] == "QUEUED"
+    assert scheduler.store.running["user@example.com"] == 0
+    scheduler.dispatch_task = MagicMock()
+    scheduler.dispatch()
+    scheduler.dispatch_task.assert_called_once_with(
+        "task1", "user@example.com", False, read_docs_ref="ref"
+    )
+
+
+def test_stale_dispatches_free_their_slot():
+    scheduler, dispatched = build_scheduler_with_store(max_running_per_user=1)
+    scheduler.enqueue("task1", "user@example.com")
+    scheduler.enqueue("task2", "user@example.com")
+    assert dispatched == ["task1"]
+    scheduler.clock.now += timedelta(hours=2)
+    scheduler.dispatch()
+    assert dispatched == ["task1", "task2"]
+
+
+def test_resumed_task_replaces_its_stale_dispatch():
+    scheduler, dispatched = build_scheduler_with_store(max_running_per_user=1)
+    scheduler.enqueue("task1", "user@example.com")
+    # the completion of the first attempt was lost
+    scheduler.enqueue("task1", "user@example.com")
+    assert dispatched == ["task1", "task1"]
+    assert len(scheduler.store.tasks) == 1
+    assert scheduler.store.running["user@example.com"] == 1
+
+
+def test_mongo_store_upserts_queued_tasks():
+    task_class = MagicMock()
+    store = MongoSchedulerStore(task_class=task_class, state_class=MagicMock())
+    store.add("task1", "user@example.com", True, {"read_docs_ref": "ref"})
+    task_class.objects.assert_called_once_with(task_id="task1")
+    update = task_class.objects.return_value.update_one.call_args.kwargs
+    assert update["upsert"] is True
+    assert update["set__status"] == "QUEUED"
+    assert update["set__dispatch_kwargs"] == {"read_docs_ref": "ref"}
+    assert isinstance(update["set_on_insert__enqueued_at"], datetime)
+
+
+def test_mongo_store_claims_slots_under_the_cap():
+    state_class = MagicMock()
+    store = MongoSchedulerStore(task_class=MagicMock(), state_class=state_class)
+    now = datetime(2024, 1, 1)
+    assert store.claim_slot("user@example.com", 2, now)
+    state_class.objects.assert_called_with(user_email="user@example.com", running__lt=2)
+    state_class.objects.return_value.modify.assert_called_once_with(
+        inc__running=1, set__last_dispatched_at=now
+    )
+    state_class.objects.return_value.modify.return_value = None
+    assert not store.claim_slot("user@example.com", 2, now)
+
+
+def test_mongo_store_finishes_dispatched_tasks_once():
+    task_class = MagicMock()
+    store = MongoSchedulerStore(task_class=task_class, state_class=MagicMock())
+    task_class.objects.return_value.modify.return_value = MagicMock(
+        user_email="user@example.com"
+    )
+    assert store.finish("task1") == "user@example.com"
+    task_class.objects.assert_called_with(task_id="task1", status="DISPATCHED")
+    task_class.objects.return_value.modify.assert_called_with(remove=True)
+    task_class.objects.return_value.modify.return_value = None
+    assert store.finish("task1") is None
+
+
+def test_build_scheduler():
+    assert build_scheduler(MagicMock(), enabled=False) is None
+    assert isinstance(build_scheduler(MagicMock(), enabled=True), FairScheduler)
+    with pytest.raises(ValueError):
+        FairScheduler(MagicMock(), store=MagicMock(), max_running_per_user=0)
@@ -0,0 +1,80 @@
+from unittest.mock import MagicMock
+from mongoengine.errors import NotUniqueError
+from backend.summarise_gpt import GPTSummarisation, PROMPT_VERSION
+from backend.summary_cache import SummaryCache
+
+
+class InMemorySummaryCache(SummaryCache):
+    def __init__(self):
+        super().__init__(max_entries=10, document_class=MagicMock())
+        self.entries = {}
+
+    def get(self, key):
+        summary = self.entries.get(key)
+        if summary is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return summary
+
+    def put(self, key, summary):
+        self.entries[key] = summary
+
+
+def test_build_key():
+    key = SummaryCache.build_key("model", "1", "prompt", 100)
+    assert key.startswith("model:1:")
+    assert key != SummaryCache.build_key("other_model", "1", "prompt", 100)
+    assert key != SummaryCache.build_key("model", "2", "prompt", 100)
+    assert key != SummaryCache.build_key("model", "1", "other prompt", 100)
+    assert key != SummaryCache.build_key("model", "1", "prompt", 50)
+
+
+def test_cache_hit_skips_network_call():
+    summary_cache = InMemorySummaryCache()
+    summariser = GPTSummarisation("fake_api_key", summary_cache=summary_cache)
+    summariser.call_open_api = MagicMock(return_value="summary")
+    assert summariser.summarise_chunks(["chunk", "chunk", "other"]) == ["summary"] * 3
+    # the first two lookups of "chunk" may race, "other" always misses
+    assert summariser.call_open_api.call_count in (2, 3)
+    assert summariser.summarise_chunks(["chunk", "other"]) == ["summary"] * 2
+    assert summariser.call_open_api.call_count in (2, 3)
+    assert summary_cache.stats()["hits"] >= 2
+    assert (
+        summary_cache.build_key(
+            summariser.model,
+            PROMPT_VERSION,
+            GPTSummarisation.format_prompt("chunk"),
+            summariser.output_budget.budget(summariser.tokenizer.count("chunk")),
+        )
+        in summary_cache.entries
+    )
+
+
+def test_cache_is_keyed_by_output_budget():
+    summary_cache = InMemorySummaryCache()
+    summariser = GPTSummarisation("fake_api_key", summary_cache=summary_cache)
+    summariser.call_open_api = MagicMock(return_value="summary")
+    chunk = "word " * 200
+    summariser.summarise_chunk(chunk, max_tokens=1)
+    summariser.summarise_chunk(chunk)
+    assert summariser.call_open_api.call_count == 2
+
+
+def test_put_ignores_concurrent_insertions():
+    document_class = MagicMock()
+    document_class.return_value.save.side_effect = NotUniqueError
+    summary_cache = SummaryCache(document_class=document_class, eviction_interval=1)
+    summary_cache.put("key", "summary")
+    document_class.objects.count.assert_not_called()
+
+
+def test_evict_oldest_entries():
+    document_class = MagicMock()
+    document_class.objects.count.return_value = 12
+    summary_cache = SummaryCache(max_entries=10, document_class=document_class)
+    summary_cache.evict()
+    document_class.objects.order_by.assert_called_once_with("created_at")
+    document_class.objects.order_by.return_value.only.return_value.limit.assert_called_once_with(
+        2
+    )
@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+import io
+import pytest
+from starlette.datastructures import UploadFile
+from backend.parser import ParserFactory
+from backend.upload import UploadBuffer, UploadTooLargeError
+
+
+def buffer_upload(content: bytes, **kwargs):
+    upload_file = UploadFile(file=io.BytesIO(content), size=len(content))
+    return asyncio.run(
+        UploadBuffer.from_upload_file(upload_file, chunk_size=4, **kwargs)
+    )
+
+
+@pytest.mark.parametrize("spool_size", [1024, 4])
+def test_upload_buffer(spool_size):
+    content = b"Hello there, general Kenobi"
+    upload_buffer = buffer_upload(content, max_size=1024, spool_size=spool_size)
+    try:
+        assert upload_buffer.size == len(content)
+        assert upload_buffer.digest == hashlib.sha256(content).hexdigest()
+        assert upload_buffer.source.read() == content
+        assert ParserFactory(upload_buffer.source, "txt").build().read() == (
+            content.decode()
+        )
+    finally:
+        upload_buffer.close()
+
+
+def test_upload_buffer_too_large():
+    with pytest.raises(UploadTooLargeError):
+        buffer_upload(b"Hello there, general Kenobi", max_size=8)
+    upload_buffer = UploadBuffer(max_size=8)
+    upload_buffer.write(b"Hello")
+    with pytest.raises(UploadTooLargeError):
+        upload_buffer.write(b" there")
+
+
+def test_upload_file_is_not_copied():
+    content = b"Hello there, general Kenobi"
+    upload_file = UploadFile(file=io.BytesIO(content), size=None)
+    upload_buffer = asyncio.run(
+        UploadBuffer.from_upload_file(upload_file, chunk_size=4, max_size=1024)
+    )
+    assert upload_buffer.file is upload_file.file
+    # the adopted file is not the buffer's to hand out by path
+    assert upload_buffer.path is None
+    assert upload_buffer.size == len(content)
+    assert upload_buffer.source.read() == content
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(
+            UploadBuffer.from_upload_file(
+                UploadFile(file=io.BytesIO(content), size=None), max_size=8
+            )
+        )
+
+
+def test_spooled_pdf_is_parsed_from_disk():
+    with open("unit_tests/test.pdf", "rb") as file:
+        content = file.read()
+    upload_buffer = UploadBuffer(max_size=len(content), spool_size=16)
+    for start in range(0, len(content), 1024):
+        upload_buffer.write(content[start : start + 1024])
+    try:
+        assert upload_buffer.path is not None
+        parser = ParserFactory(
+            upload_buffer.source, "pdf", path=upload_buffer.path
+        ).build()
+        assert parser.read().strip() == "Hello"
+    finally:
+        upload_buffer.close()
@@ -19,6 +19,9 @@ global_config = {
         ("example.txt", "txt"),
         ("image.jpg", "jpg"),
         ("script.js", "js"),
+        ("report.PDF", "pdf"),
+        ("archive.tar.gz", "gz"),
+        ("README", ""),
     ],
 )
 def test_get_file_extension(filename, expected_extension):
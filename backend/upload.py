@@ -0,0 +1,146 @@
+from backend.configuration import global_config
+import hashlib
+import io
+import tempfile
+
+
+class UploadTooLargeError(Exception):
+    """
+    Raised when an upload exceeds the maximum accepted size.
+    """
+
+
+class UploadBuffer:
+    """
+    Size bounded buffer an upload is streamed into chunk by chunk, or wrapping the
+    file an upload was already spooled to.
+
+    Written content is hashed on the fly and kept in memory until it grows past
+    spool_size, at which point it is moved to a named temporary file owned by the
+    buffer, whose path parsers can open instead of holding the content in memory.
+
+    Attributes:
+        max_size (int): Maximum accepted size of the upload in bytes.
+        spool_size (int): Size in bytes above which the upload is spooled to disk.
+        size (int): Number of bytes written so far.
+        file: The underlying binary file object.
+    """
+
+    def __init__(
+        self,
+        max_size: int = global_config.getint(
+            "Upload", "MAX_SIZE", fallback=50 * 1024 * 1024
+        ),
+        spool_size: int = global_config.getint(
+            "Upload", "SPOOL_SIZE", fallback=1024 * 1024
+        ),
+    ):
+        """
+        Initialize an empty UploadBuffer.
+
+        Args:
+            max_size (int): Maximum accepted size of the upload in bytes.
+            spool_size (int): Size in bytes above which the upload is spooled to disk.
+        """
+        self.max_size = max_size
+        self.spool_size = spool_size
+        self.size = 0
+        self.file = io.BytesIO()
+        self._hash = hashlib.sha256()
+        self._rolled = False
+        self._path = None
+
+    @classmethod
+    async def from_upload_file(
+        cls, upload_file, chunk_size: int = 1024 * 1024, **kwargs
+    ):
+        """
+        Wrap an uploaded file in a new UploadBuffer.
+
+        The multipart parser has already spooled the upload, so its file is adopted
+        rather than copied, and only read through once to hash and measure it.
+
+        Args:
+            upload_file (UploadFile): The uploaded file.
+            chunk_size (int): Number of bytes read from the upload at a time.
+            **kwargs: Arguments passed on to the UploadBuffer constructor.
+
+        Returns:
+            UploadBuffer: The buffer holding the upload.
+
+        Raises:
+            UploadTooLargeError: As soon as the upload exceeds the maximum size.
+        """
+        upload_buffer = cls(**kwargs)
+        if upload_file.size is not None and upload_file.size > upload_buffer.max_size:
+            raise UploadTooLargeError
+        await upload_file.seek(0)
+        while chunk := await upload_file.read(chunk_size):
+            upload_buffer.size += len(chunk)
+            if upload_buffer.size > upload_buffer.max_size:
+                raise UploadTooLargeError
+            upload_buffer._hash.update(chunk)
+        upload_buffer.file = upload_file.file
+        # the file is already where the multipart parser spooled it
+        upload_buffer._rolled = True
+        return upload_buffer
+
+    def write(self, chunk: bytes):
+        """
+        Append a chunk to the buffer.
+
+        Args:
+            chunk (bytes): The next chunk of the upload.
+
+        Raises:
+            UploadTooLargeError: If the chunk makes the upload exceed the maximum size.
+        """
+        if self.size + len(chunk) > self.max_size:
+            raise UploadTooLargeError
+        self._hash.update(chunk)
+        if not self._rolled and self.size + len(chunk) > self.spool_size:
+            self._rollover()
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def _rollover(self):
+        """
+        Move the buffered content from memory to a named temporary file.
+        """
+        disk_file = tempfile.NamedTemporaryFile(prefix="pdf_gpt_upload_")
+        disk_file.write(self.file.getbuffer())
+        self.file = disk_file
+        self._rolled = True
+        self._path = disk_file.name
+
+    @property
+    def digest(self) -> str:
+        """
+        str: Hex SHA-256 digest of the content written so far.
+        """
+        return self._hash.hexdigest()
+
+    @property
+    def source(self):
+        """
+        The content as a rewound binary file object, without copying it.
+        """
+        self.file.seek(0)
+        return self.file
+
+    @property
+    def path(self):
+        """
+        str: Path of the temporary file the buffer spooled its content to, or None
+        if the content is in memory or in a file the buffer does not own, such as
+        one adopted from the multipart parser.
+        """
+        if self._path is not None:
+            self.file.flush()
+        return self._path
+
+    def close(self):
+        """
+        Release the buffer, deleting its temporary file if any.
+        """
+        self.file.close()
@@ -14,9 +14,11 @@ def get_file_extension(filename: str) -> str:
         filename (str): The name of the file.
 
     Returns:
-        str: The file extension.
+        str: The lowercase file extension, empty if the filename has none.
     """
-    return filename.rsplit(".", maxsplit=1)[1]
+    if "." not in filename:
+        return ""
+    return filename.rsplit(".", maxsplit=1)[1].lower()
 
 
 def verify_password(user_password: str, salt: str, user_hashed_password: str):